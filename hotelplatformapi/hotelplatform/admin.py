@@ -1,14 +1,17 @@
 from django.contrib import admin
 from django.db.models import Count, Q, Sum
+from django.http import JsonResponse
 from django.template.response import TemplateResponse
 from django.utils.safestring import mark_safe
 from django import forms
 from django.urls import path
 from django.utils import timezone
-from datetime import datetime, timedelta
+from datetime import date, datetime, timedelta
 from .models import (
-    User, RoomType, Room, Booking, RoomRental, Payment, DiscountCode, Notification, CustomerType, RoomImage
+    User, RoomType, RatePeriod, Room, Booking, BookingRoom, RoomRental, Payment, InvoiceLine, DailyStat, DiscountCode, Notification, CustomerType, RoomImage, Job
 )
+from . import jobs, rollup, snapshots
+from .inventory import local_date, sync_booking_nights, sync_booking_rooms
 
 # Form tùy chỉnh cho User
 class UserForm(forms.ModelForm):
@@ -63,6 +66,13 @@ class RoomImageInline(admin.TabularInline):
         return "Không có ảnh"
     image_preview.short_description = "Xem trước"
 
+# Inline cho phòng của Booking (Booking.rooms dùng bảng trung gian BookingRoom)
+class BookingRoomInline(admin.TabularInline):
+    model = BookingRoom
+    extra = 1
+    fields = ('room', 'check_in_date', 'check_out_date', 'is_active')
+    readonly_fields = ('check_in_date', 'check_out_date', 'is_active')
+
 # Admin cho User
 class UserAdmin(admin.ModelAdmin):
     list_display = ['id', 'username', 'email', 'full_name', 'role', 'phone', 'customer_type_display', 'total_bookings_display', 'total_spent_display', 'is_active', 'created_at']
@@ -174,6 +184,12 @@ class UserAdmin(admin.ModelAdmin):
         )
     update_customer_stats.short_description = "Cập nhật thống kê khách hàng"
 
+# Inline cho giá theo mùa của RoomType
+class RatePeriodInline(admin.TabularInline):
+    model = RatePeriod
+    extra = 1
+    fields = ('name', 'start_date', 'end_date', 'price')
+
 # Admin cho RoomType
 class RoomTypeAdmin(admin.ModelAdmin):
     list_display = ['id', 'name', 'base_price', 'max_guests', 'extra_guest_surcharge']
@@ -194,6 +210,7 @@ class RoomTypeAdmin(admin.ModelAdmin):
             'fields': ('amenities',)
         })
     )
+    inlines = [RatePeriodInline]
 
 # Admin cho Room
 class RoomAdmin(admin.ModelAdmin):
@@ -214,9 +231,16 @@ class BookingAdmin(admin.ModelAdmin):
     list_filter = ['status', 'check_in_date', 'check_out_date', 'created_at']
     readonly_fields = ['total_price_display']
     form = BookingForm
+    inlines = [BookingRoomInline]
     list_per_page = 20
     date_hierarchy = 'check_in_date'
 
+    def save_related(self, request, form, formsets, change):
+        super().save_related(request, form, formsets, change)
+        # Inline ghi thẳng BookingRoom (không qua m2m_changed) → đồng bộ lại sổ phòng
+        sync_booking_rooms(form.instance)
+        sync_booking_nights(form.instance)
+
     def customer_phone(self, obj):
         return obj.customer.phone if obj.customer.phone else 'Chưa có'
     customer_phone.short_description = "Số điện thoại"
@@ -232,7 +256,7 @@ class BookingAdmin(admin.ModelAdmin):
 
     fieldsets = (
         ('Thông tin đặt phòng', {
-            'fields': ('customer', 'rooms', 'check_in_date', 'check_out_date')
+            'fields': ('customer', 'check_in_date', 'check_out_date')
         }),
         ('Chi tiết', {
             'fields': ('total_price', 'total_price_display', 'guest_count', 'status')
@@ -267,6 +291,17 @@ class RoomRentalAdmin(admin.ModelAdmin):
     def get_queryset(self, request):
         return super().get_queryset(request).select_related('customer', 'booking').prefetch_related('rooms')
 
+# Inline cho khoản phí của hóa đơn (chỉ đọc, chụp lúc check-out)
+class InvoiceLineInline(admin.TabularInline):
+    model = InvoiceLine
+    extra = 0
+    can_delete = False
+    fields = ('room_number', 'room_type', 'guests', 'days', 'base_price', 'surcharge', 'subtotal')
+    readonly_fields = fields
+
+    def has_add_permission(self, request, obj=None):
+        return False
+
 # Admin cho Payment
 class PaymentAdmin(admin.ModelAdmin):
     list_display = ['id', 'rental_customer', 'amount_display', 'payment_method', 'status', 'paid_at', 'transaction_id']
@@ -275,6 +310,7 @@ class PaymentAdmin(admin.ModelAdmin):
     readonly_fields = ['transaction_id', 'amount_display']
     list_per_page = 20
     date_hierarchy = 'paid_at'
+    inlines = [InvoiceLineInline]
 
     def rental_customer(self, obj):
         return obj.rental.customer.full_name
@@ -346,16 +382,45 @@ class HotelAdminSite(admin.AdminSite):
         return [
             path('hotel-stats/', self.hotel_stats, name='hotel-stats'),
             path('revenue-stats/', self.revenue_stats, name='revenue-stats'),
+            path('analytics-snapshots/', self.admin_view(self.analytics_snapshots), name='analytics-snapshots'),
         ] + super().get_urls()
 
+    def analytics_snapshots(self, request):
+        """
+        Snapshot Parquet / Arrow cho phân tích offline
+        GET: watermark và số dòng từng tháng của lần xuất trước, trạng thái job xuất gần nhất
+        POST (format=parquet|arrow, full=1): ghi job xuất tăng dần cho worker, trả về 202
+        """
+        if request.method == 'POST':
+            file_format = request.POST.get('format', 'parquet')
+            try:
+                snapshots.check_format(file_format)
+            except (ImportError, ValueError) as e:
+                return JsonResponse({'error': str(e)}, status=400)
+            # Đã có job xuất đang chờ thì không ghi thêm (bấm nhiều lần)
+            jobs.enqueue(
+                'export_snapshots', dedup_key='export_snapshots', max_attempts=3,
+                file_format=file_format, full=request.POST.get('full') == '1',
+            )
+            # Job được ghi khi transaction commit; GET trả về trạng thái của nó
+            return JsonResponse({'status': 'queued'}, status=202)
+        return JsonResponse({**snapshots.load_manifest(), 'export': self.snapshot_export_status()})
+
+    def snapshot_export_status(self):
+        return Job.objects.filter(name='export_snapshots').order_by('-created_at', '-id').values(
+            'id', 'status', 'attempts', 'created_at', 'finished_at', 'last_error'
+        ).first()
+
     def hotel_stats(self, request):
         total_rooms = Room.objects.count()
         available_rooms = Room.objects.filter(status='available').count()
         occupied_rooms = Room.objects.filter(status='occupied').count()
         booked_rooms = Room.objects.filter(status='booked').count()
         
-        today = timezone.now().date()
-        bookings_today = Booking.objects.filter(created_at__date=today).count()
+        today = local_date(timezone.now())
+        month_start = today.replace(day=1)
+        # Booking / doanh thu lấy từ bảng thống kê theo ngày (DailyStat)
+        bookings_today = rollup.totals(today, today + timedelta(days=1))['bookings_created']
         total_bookings = Booking.objects.count()
         
         total_customers = User.objects.filter(role='customer').count()
@@ -371,15 +436,9 @@ class HotelAdminSite(admin.AdminSite):
             total_spent_sum=Sum('total_spent')
         ).order_by('-total_spent_sum')
         
-        total_revenue = Payment.objects.filter(status=True).aggregate(
-            total=Sum('amount')
-        )['total'] or 0
+        total_revenue = DailyStat.objects.aggregate(total=Sum('revenue'))['total'] or 0
         
-        revenue_this_month = Payment.objects.filter(
-            status=True,
-            paid_at__month=today.month,
-            paid_at__year=today.year
-        ).aggregate(total=Sum('amount'))['total'] or 0
+        revenue_this_month = rollup.totals(month_start, today + timedelta(days=1))['revenue']
         
         room_type_stats = RoomType.objects.annotate(
             room_count=Count('rooms'),
@@ -407,15 +466,11 @@ class HotelAdminSite(admin.AdminSite):
         })
 
     def revenue_stats(self, request):
-        current_year = timezone.now().year
-        monthly_revenue = Payment.objects.filter(
-            status=True,
-            paid_at__year=current_year
-        ).extra(
-            select={'month': 'MONTH(paid_at)'}
-        ).values('month').annotate(
-            total=Sum('amount')
-        ).order_by('month')
+        current_year = local_date(timezone.now()).year
+        monthly_revenue = [
+            {'month': month.month, 'total': data['revenue']}
+            for month, data in rollup.monthly_totals(date(current_year, 1, 1), date(current_year + 1, 1, 1)).items()
+        ]
         
         payment_method_stats = Payment.objects.filter(status=True).values(
             'payment_method'
@@ -0,0 +1,121 @@
+"""
+Gợi ý tổ hợp phòng rẻ nhất cho một đoàn khách (cheapest-fit allocation)
+
+Giá của một tổ hợp chỉ phụ thuộc vào số phòng mỗi loại, nên tìm kiếm trên "số phòng của
+từng RoomType" thay vì trên từng phòng cụ thể. Mỗi tổ hợp được tính giá bằng đúng
+pricing.quote_rooms (phòng lớn trước, khách dư tính phụ thu; kết quả memo theo dãy loại phòng),
+giữ k tổ hợp rẻ nhất bằng heap và cắt nhánh khi giá sàn đã vượt tổ hợp thứ k.
+"""
+import heapq
+from decimal import Decimal
+
+from . import pricing
+
+# Giới hạn số nút duyệt để một request không chạy quá lâu
+MAX_SEARCH_NODES = 20000
+
+# Đoàn khách vượt sức chứa cơ bản được phép tới 150% (có phụ thu), giống BookingSerializer.validate
+OVERFLOW_RATIO = Decimal('1.5')
+
+
+def max_allowed_guests(capacity):
+    return int(capacity * OVERFLOW_RATIO)
+
+
+def suggest_combinations(rooms, guest_count, stay_days, k=5, max_rooms=None, check_in=None):
+    """
+    Tìm k tổ hợp phòng rẻ nhất chứa được guest_count khách.
+
+    Args:
+        rooms: Các Room còn trống
+        guest_count: Tổng số khách
+        stay_days: Số đêm lưu trú
+        k: Số tổ hợp trả về
+        max_rooms: Số phòng tối đa mỗi tổ hợp (mặc định = guest_count)
+        check_in: Ngày nhận phòng để áp giá theo mùa (None: giá cơ bản)
+
+    Returns:
+        list[dict]: Tổ hợp sắp theo giá tăng dần, mỗi phần tử gồm 'rooms' và
+        kết quả của pricing.quote_rooms
+    """
+    if guest_count <= 0 or stay_days <= 0 or k <= 0:
+        return []
+    max_rooms = min(max_rooms or guest_count, guest_count)
+
+    pricing.rates.ensure_fresh()
+
+    # Gom phòng theo loại; loại sức chứa lớn trước để tổ hợp đủ chỗ xuất hiện sớm
+    by_type = {}
+    for room in rooms:
+        by_type.setdefault(room.room_type_id, []).append(room)
+    # Tiền phòng (chưa phụ thu) của cả lượt ở cho mỗi loại, theo giá từng đêm
+    stay_totals = {
+        room_type_id: pricing.rates.stay_total(room_type_id, check_in, stay_days) for room_type_id in by_type
+    }
+    groups = sorted(
+        by_type.values(),
+        key=lambda group: (-pricing.rates.get(group[0].room_type_id).max_guests, stay_totals[group[0].room_type_id])
+    )
+    # Sức chứa còn lại tối đa từ loại i trở đi (để cắt nhánh không thể đủ chỗ)
+    suffix_capacity = [0] * (len(groups) + 1)
+    for i in range(len(groups) - 1, -1, -1):
+        room_type = pricing.rates.get(groups[i][0].room_type_id)
+        suffix_capacity[i] = suffix_capacity[i + 1] + room_type.max_guests * min(len(groups[i]), max_rooms)
+
+    best = []  # max-heap theo giá: (-giá, thứ tự, tổ hợp)
+    counts = [0] * len(groups)
+    state = {'nodes': 0, 'seq': 0}
+
+    def kth_price():
+        return -best[0][0] if len(best) >= k else None
+
+    def evaluate(room_total, capacity):
+        if room_total == 0 or max_allowed_guests(capacity) < guest_count:
+            return
+        selected = [room for group, count in zip(groups, counts) for room in group[:count]]
+        quote = pricing.quote_rooms(selected, guest_count, stay_days, check_in=check_in, check_version=False)
+        # Phòng không có khách nào là thừa → tổ hợp nhỏ hơn luôn tốt hơn
+        if 0 in quote['guest_allocation']:
+            return
+        price = quote['total_price']
+        limit = kth_price()
+        if limit is not None and price >= limit:
+            return
+        state['seq'] += 1
+        entry = (-price, -state['seq'], quote)
+        if len(best) < k:
+            heapq.heappush(best, entry)
+        else:
+            heapq.heapreplace(best, entry)
+
+    def search(i, room_total, capacity, floor_price):
+        state['nodes'] += 1
+        if state['nodes'] > MAX_SEARCH_NODES:
+            return
+        # Giá sàn = tổng giá cơ bản các phòng đã chọn; thêm phòng/phụ thu chỉ làm tăng giá
+        limit = kth_price()
+        if limit is not None and floor_price >= limit:
+            return
+        if i == len(groups):
+            evaluate(room_total, capacity)
+            return
+        if max_allowed_guests(capacity + suffix_capacity[i]) < guest_count:
+            return
+
+        group = groups[i]
+        room_type = pricing.rates.get(group[0].room_type_id)
+        nightly = stay_totals[room_type.room_type_id]
+        for count in range(min(len(group), max_rooms - room_total) + 1):
+            limit = kth_price()
+            if limit is not None and floor_price + nightly * count >= limit:
+                break
+            counts[i] = count
+            search(
+                i + 1, room_total + count,
+                capacity + room_type.max_guests * count,
+                floor_price + nightly * count,
+            )
+        counts[i] = 0
+
+    search(0, 0, 0, Decimal('0'))
+    return [entry[2] for entry in sorted(best, key=lambda e: (-e[0], -e[1]))]
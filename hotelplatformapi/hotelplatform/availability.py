@@ -0,0 +1,178 @@
+"""
+Chỉ mục phòng trống trong bộ nhớ (availability bitmap)
+
+Ràng buộc check_in <= created_at + 28 ngày khiến cửa sổ đặt phòng nhỏ và cố định, nên mỗi
+worker giữ một bitset cho mỗi phòng: bit i bật nghĩa là đêm (start + i) đã bị giữ trong sổ
+RoomNight. Câu hỏi "phòng X có trống các đêm A..B" chỉ còn là một phép AND trên số nguyên.
+
+- Chỉ mục được dựng từ RoomNight trong cửa sổ, cập nhật từng phòng qua signals.
+- Phiên bản "availability" trong cache dùng chung cho biết worker khác đã ghi thay đổi;
+  khi lệch phiên bản, qua ngày mới hoặc quá MAX_AGE_SECONDS thì dựng lại toàn bộ. Phiên bản chỉ được
+  đọc lại sau VERSION_CHECK_SECONDS (cache mặc định là bảng DB) nên phần lớn truy vấn không chạm DB;
+  thay đổi của worker khác có thể trễ tối đa chừng đó, ràng buộc unique (room, date) của RoomNight
+  vẫn chặn đặt trùng.
+- (ngày bắt đầu, bitset) được thay cùng lúc như một tuple: bên đọc không thể ghép ngày bắt đầu cũ
+  với bitset mới khi một thread khác đang dựng lại.
+- Hold tạm thời được tính là bận tới khi hết hạn; tới hạn hold sớm nhất thì dựng lại.
+- Khoảng ngày nằm ngoài cửa sổ trả về None để bên gọi quay về truy vấn DB.
+"""
+import threading
+import time
+from datetime import timedelta
+
+from django.db import transaction
+from django.utils import timezone
+
+from .cache_utils import bump_version, get_version
+
+VERSION_NAME = 'availability'
+
+# 28 ngày đặt trước + độ dài lưu trú tối đa thường gặp
+HORIZON_DAYS = 60
+
+# Lưới an toàn khi cache không được chia sẻ giữa các worker
+MAX_AGE_SECONDS = 300
+
+# Khoảng tối thiểu giữa hai lần đọc phiên bản từ cache dùng chung
+VERSION_CHECK_SECONDS = 1.0
+
+
+class AvailabilityIndex:
+    def __init__(self, horizon_days=HORIZON_DAYS, max_age=MAX_AGE_SECONDS, version_check=VERSION_CHECK_SECONDS):
+        self.horizon_days = horizon_days
+        self.max_age = max_age
+        self.version_check = version_check
+        self._lock = threading.RLock()
+        # (ngày đầu cửa sổ, {room_id: bitset}); chỉ thay cả tuple, không sửa dict tại chỗ
+        self._snapshot = (None, {})
+        self._next_expiry = None
+        self._version = None
+        self._built_at = 0.0
+        self._version_checked_at = 0.0
+
+    # ----- Dựng / làm mới -----
+
+    def _today(self):
+        from .inventory import local_date
+        return local_date(timezone.now())
+
+    def _load(self, start, room_ids=None):
+        """
+        Đọc các đêm đang bị giữ trong cửa sổ và gom thành bitset theo phòng.
+        Trả về (bits, thời điểm hold sớm nhất hết hạn).
+        """
+        from .inventory import live_nights
+
+        nights = live_nights().filter(
+            date__gte=start, date__lt=start + timedelta(days=self.horizon_days)
+        )
+        if room_ids is not None:
+            nights = nights.filter(room_id__in=room_ids)
+
+        bits = dict.fromkeys(room_ids or (), 0)
+        next_expiry = None
+        for room_id, night, expires_at in nights.values_list('room_id', 'date', 'expires_at').iterator():
+            bits[room_id] = bits.get(room_id, 0) | (1 << (night - start).days)
+            if expires_at is not None and (next_expiry is None or expires_at < next_expiry):
+                next_expiry = expires_at
+        return bits, next_expiry
+
+    def rebuild(self):
+        with self._lock:
+            version = get_version(VERSION_NAME)
+            # Bắt đầu từ hôm qua để phủ các lượt ở đang diễn ra và cửa sổ mở rộng 1 đêm
+            start = self._today() - timedelta(days=1)
+            bits, self._next_expiry = self._load(start)
+            self._snapshot = (start, bits)
+            self._version = version
+            self._built_at = self._version_checked_at = time.monotonic()
+
+    def _version_changed(self):
+        """So phiên bản với cache dùng chung, tối đa một lần mỗi version_check giây"""
+        now = time.monotonic()
+        if now - self._version_checked_at < self.version_check:
+            return False
+        self._version_checked_at = now
+        return get_version(VERSION_NAME) != self._version
+
+    def ensure_fresh(self):
+        """Kiểm tra phiên bản, ngày, tuổi và hold hết hạn của chỉ mục; dựng lại nếu đã cũ"""
+        start = self._snapshot[0]
+        stale = (
+            start is None
+            or start != self._today() - timedelta(days=1)
+            or time.monotonic() - self._built_at > self.max_age
+            or (self._next_expiry is not None and timezone.now() >= self._next_expiry)
+            or self._version_changed()
+        )
+        if stale:
+            self.rebuild()
+
+    def refresh_rooms(self, room_ids):
+        """Nạp lại bitset của các phòng vừa thay đổi (trong chính worker này)"""
+        room_ids = list(room_ids)
+        if not room_ids or self._snapshot[0] is None:
+            return
+        with self._lock:
+            start, current = self._snapshot
+            bits, next_expiry = self._load(start, room_ids)
+            self._snapshot = (start, {**current, **bits})
+            if next_expiry is not None and (self._next_expiry is None or next_expiry < self._next_expiry):
+                self._next_expiry = next_expiry
+
+    def rooms_changed(self, room_ids):
+        """
+        Ghi nhận thay đổi sổ phòng: cập nhật bitset cục bộ và tăng phiên bản
+        để các worker khác dựng lại. Nếu phiên bản mới chỉ hơn phiên bản đang giữ 1
+        đơn vị thì không có ai khác ghi xen vào → giữ nguyên chỉ mục đã cập nhật.
+        """
+        self.refresh_rooms(room_ids)
+        new_version = bump_version(VERSION_NAME)
+        with self._lock:
+            if self._version is not None and new_version == self._version + 1:
+                self._version = new_version
+
+    # ----- Truy vấn -----
+
+    def _mask(self, window_start, start_date, end_date):
+        """Mặt nạ bit cho các đêm [start_date, end_date) của cửa sổ bắt đầu window_start, None nếu ngoài cửa sổ"""
+        if window_start is None:
+            return None
+        offset = (start_date - window_start).days
+        length = (end_date - start_date).days
+        if offset < 0 or length <= 0 or offset + length > self.horizon_days:
+            return None
+        return ((1 << length) - 1) << offset
+
+    def free_among(self, room_ids, start_date, end_date, check_version=True):
+        """
+        Tập con các phòng chắc chắn trống trong khoảng, None nếu ngoài cửa sổ.
+        check_version=False khi người gọi đã ensure_fresh() cho cả lô truy vấn.
+        """
+        if check_version:
+            self.ensure_fresh()
+        window_start, bits = self._snapshot
+        mask = self._mask(window_start, start_date, end_date)
+        if mask is None:
+            return None
+        return {room_id for room_id in room_ids if not (bits.get(room_id, 0) & mask)}
+
+    def busy_room_ids(self, start_date, end_date):
+        """Tập phòng có ít nhất một đêm bị giữ trong khoảng, None nếu ngoài cửa sổ"""
+        self.ensure_fresh()
+        window_start, bits = self._snapshot
+        mask = self._mask(window_start, start_date, end_date)
+        if mask is None:
+            return None
+        return {room_id for room_id, room_bits in bits.items() if room_bits & mask}
+
+
+# Chỉ mục dùng chung trong một process
+index = AvailabilityIndex()
+
+
+def notify_rooms_changed(room_ids):
+    """Gọi sau khi RoomNight của các phòng thay đổi; áp dụng khi transaction commit"""
+    room_ids = set(room_ids)
+    if room_ids:
+        transaction.on_commit(lambda: index.rooms_changed(room_ids))
@@ -0,0 +1,35 @@
+"""
+Tiện ích cache dùng chung
+
+Mỗi "namespace" dữ liệu (sổ phòng, bảng giá, thống kê...) có một số phiên bản lưu trong
+cache dùng chung (CACHES['default']). Khi dữ liệu thay đổi, tăng phiên bản; các worker
+so sánh với phiên bản mình đang giữ để biết bản sao trong bộ nhớ đã cũ.
+"""
+from django.core.cache import cache
+
+VERSION_KEY_PREFIX = 'hotelplatform:version:'
+
+
+def _version_key(name):
+    return f'{VERSION_KEY_PREFIX}{name}'
+
+
+def get_version(name):
+    """Phiên bản hiện tại của namespace (khởi tạo = 1 nếu chưa có)"""
+    key = _version_key(name)
+    version = cache.get(key)
+    if version is None:
+        cache.add(key, 1, timeout=None)
+        version = cache.get(key, 1)
+    return version
+
+
+def bump_version(name):
+    """Tăng phiên bản của namespace, trả về phiên bản mới"""
+    key = _version_key(name)
+    try:
+        return cache.incr(key)
+    except ValueError:
+        # Key chưa tồn tại (cache bị xóa/khởi động lại)
+        cache.add(key, 1, timeout=None)
+        return cache.incr(key)
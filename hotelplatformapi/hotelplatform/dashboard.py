@@ -0,0 +1,118 @@
+"""
+Cache ảnh chụp thống kê cho dashboard (StatsView)
+
+- Kết quả được cache theo (phiên bản, tên ảnh chụp), vd. một tháng của StatsView hay một khoảng
+  ngày của chuỗi thời gian. Lưu Booking / RoomRental / Payment làm tăng phiên bản "dashboard" sau
+  khi commit → mọi ảnh chụp cũ tự hết hiệu lực, không cần xóa key.
+- Single-flight: khi cache trống, chỉ một request tính lại; các request đồng thời (cùng process
+  qua lock, khác process qua cache.add) chờ và dùng chung kết quả.
+- Bộ đếm hit / miss / refresh giữ trong bộ nhớ của từng process: không thêm một lượt ghi cache
+  (incr) vào mỗi request; StatsCacheView báo số liệu của process trả lời request đó.
+"""
+import os
+import threading
+import time
+
+from django.core.cache import cache
+from django.db import transaction
+
+from .cache_utils import bump_version, get_version
+
+VERSION_NAME = 'dashboard'
+KEY_PREFIX = 'hotelplatform:dashboard:'
+COUNTERS = ('hits', 'misses', 'refreshes')
+
+# Ảnh chụp vẫn hết hạn sau khoảng này (số khách hàng mới không làm tăng phiên bản)
+CACHE_TIMEOUT = 300
+
+# Lock giữa các process tự hết hạn nếu worker đang tính bị chết
+LOCK_TIMEOUT = 30
+
+# Thời gian tối đa chờ request khác tính xong trước khi tự tính: khoảng p95 thời gian tính một ảnh chụp
+# (vài truy vấn trên bảng DailyStat), chờ lâu hơn chỉ giữ worker khi process đang tính bị treo
+WAIT_TIMEOUT = 1
+POLL_INTERVAL = 0.05
+
+# Lock trong process, chia theo key (số lượng cố định để không phình theo số tháng)
+_local_locks = [threading.Lock() for _ in range(16)]
+
+
+_counter_lock = threading.Lock()
+_counters = dict.fromkeys(COUNTERS, 0)
+
+
+def _count(name):
+    with _counter_lock:
+        _counters[name] += 1
+
+
+def counters():
+    """Bộ đếm hit / miss / refresh của process hiện tại và phiên bản hiện tại"""
+    with _counter_lock:
+        result = dict(_counters)
+    result['process'] = os.getpid()
+    result['version'] = get_version(VERSION_NAME)
+    return result
+
+
+def reset_counters():
+    with _counter_lock:
+        _counters.update(dict.fromkeys(COUNTERS, 0))
+
+
+def invalidate():
+    """Đánh dấu mọi ảnh chụp đã cũ; thực hiện khi transaction hiện tại commit"""
+    transaction.on_commit(lambda: bump_version(VERSION_NAME))
+
+
+def _refresh(key, compute):
+    data = compute()
+    cache.set(key, data, CACHE_TIMEOUT)
+    _count('refreshes')
+    return data
+
+
+def get_snapshot(name, compute, fresh=False):
+    """
+    Lấy ảnh chụp thống kê name từ cache, tính bằng compute() khi chưa có.
+
+    Args:
+        name: Tên ảnh chụp (phân biệt theo tham số của request)
+        compute: Hàm không tham số trả về dữ liệu cần cache
+        fresh: Bỏ qua cache và tính lại ngay (kết quả mới vẫn được lưu)
+
+    Returns:
+        tuple: (dữ liệu, True nếu lấy từ cache)
+    """
+    key = f'{KEY_PREFIX}{get_version(VERSION_NAME)}:{name}'
+    if fresh:
+        _count('misses')
+        return _refresh(key, compute), False
+
+    data = cache.get(key)
+    if data is not None:
+        _count('hits')
+        return data, True
+    _count('misses')
+
+    with _local_locks[hash(key) % len(_local_locks)]:
+        # Thread khác trong process có thể vừa tính xong
+        data = cache.get(key)
+        if data is not None:
+            return data, True
+
+        lock_key = f'{key}:lock'
+        if cache.add(lock_key, 1, LOCK_TIMEOUT):
+            try:
+                return _refresh(key, compute), False
+            finally:
+                cache.delete(lock_key)
+
+        # Process khác đang tính: chờ kết quả, quá hạn thì tự tính
+        deadline = time.monotonic() + WAIT_TIMEOUT
+        while time.monotonic() < deadline:
+            time.sleep(POLL_INTERVAL)
+            data = cache.get(key)
+            if data is not None:
+                return data, True
+        return _refresh(key, compute), False
@@ -0,0 +1,111 @@
+"""
+Xuất dữ liệu dạng luồng (CSV / JSONL) cho booking, phiếu thuê và thanh toán
+
+Thay vì gọi API phân trang từng trang (mỗi trang một COUNT(*) và serializer lồng nhau),
+queryset được đọc theo lô bằng .iterator(chunk_size) (select_related / prefetch theo từng lô)
+và ghi thẳng từng dòng ra StreamingHttpResponse → bộ nhớ không tăng theo số bản ghi.
+"""
+import csv
+import json
+
+from django.core.serializers.json import DjangoJSONEncoder
+from django.http import StreamingHttpResponse
+from django.utils import timezone
+
+FORMATS = ('csv', 'jsonl')
+
+# Số bản ghi mỗi lô đọc từ DB (mỗi lô một truy vấn prefetch)
+CHUNK_SIZE = 500
+
+
+class _Echo:
+    """File giả cho csv.writer: trả lại dòng vừa ghi thay vì lưu vào bộ đệm"""
+
+    def write(self, value):
+        return value
+
+
+def booking_row(booking):
+    return {
+        'id': booking.id,
+        'customer_id': booking.customer_id,
+        'customer_name': booking.customer.full_name or booking.customer.username,
+        'check_in_date': booking.check_in_date,
+        'check_out_date': booking.check_out_date,
+        'guest_count': booking.guest_count,
+        'status': booking.status,
+        'total_price': booking.total_price,
+        'rooms': ', '.join(room.room_number for room in booking.rooms.all()),
+        'created_at': booking.created_at,
+    }
+
+
+def rental_row(rental):
+    return {
+        'id': rental.id,
+        'booking_id': rental.booking_id,
+        'customer_id': rental.customer_id,
+        'customer_name': rental.customer.full_name or rental.customer.username,
+        'check_in_date': rental.check_in_date,
+        'check_out_date': rental.check_out_date,
+        'actual_check_out_date': rental.actual_check_out_date,
+        'guest_count': rental.guest_count,
+        'total_price': rental.total_price,
+        'rooms': ', '.join(room.room_number for room in rental.rooms.all()),
+        'created_at': rental.created_at,
+    }
+
+
+def payment_row(payment):
+    lines = payment.lines.all()
+    return {
+        'id': payment.id,
+        'transaction_id': payment.transaction_id,
+        'rental_id': payment.rental_id,
+        'customer_id': payment.customer_id,
+        'customer_name': payment.rental.customer.full_name or payment.rental.customer.username,
+        'amount': payment.amount,
+        'payment_method': payment.payment_method,
+        'status': payment.status,
+        'paid_at': payment.paid_at,
+        'discount_code': payment.discount_code.code if payment.discount_code else '',
+        'rooms': ', '.join(line.room_number for line in lines),
+        'subtotal': sum((line.subtotal for line in lines), 0),
+        'created_at': payment.created_at,
+    }
+
+
+def _csv_lines(rows):
+    writer = csv.writer(_Echo())
+    header = None
+    for row in rows:
+        if header is None:
+            header = list(row)
+            yield writer.writerow(header)
+        yield writer.writerow(['' if value is None else value for value in row.values()])
+
+
+def _jsonl_lines(rows):
+    for row in rows:
+        yield json.dumps(row, cls=DjangoJSONEncoder, ensure_ascii=False) + '\n'
+
+
+def stream(queryset, row, name, file_format):
+    """
+    Tạo StreamingHttpResponse xuất queryset.
+
+    Args:
+        queryset: Queryset đã lọc (có thể kèm select_related / prefetch_related)
+        row: Hàm chuyển một bản ghi thành dict (thứ tự khóa = thứ tự cột CSV)
+        name: Tên file (không đuôi)
+        file_format: 'csv' hoặc 'jsonl'
+    """
+    rows = (row(obj) for obj in queryset.iterator(chunk_size=CHUNK_SIZE))
+    if file_format == 'csv':
+        content, content_type = _csv_lines(rows), 'text/csv; charset=utf-8'
+    else:
+        content, content_type = _jsonl_lines(rows), 'application/x-ndjson; charset=utf-8'
+    response = StreamingHttpResponse(content, content_type=content_type)
+    filename = f"{name}-{timezone.now().strftime('%Y%m%d%H%M%S')}.{file_format}"
+    response['Content-Disposition'] = f'attachment; filename="{filename}"'
+    return response
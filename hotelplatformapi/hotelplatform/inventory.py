@@ -0,0 +1,297 @@
+"""
+Sổ tồn kho phòng theo đêm (room-night ledger)
+
+Mỗi booking còn hiệu lực giữ một dòng RoomNight cho mỗi (phòng, đêm lưu trú).
+Ràng buộc unique (room, date) để DB chặn hai bên cùng giữ một đêm; hold tạm thời (TTL)
+cho phép khách giữ phòng khi mở trang thanh toán rồi chuyển thành booking.
+Kiểm tra phòng trống cho một khoảng ngày bất kỳ chỉ còn là một anti-join trên
+index (room, date), không phụ thuộc vào kích thước bảng Booking. Trong cửa sổ đặt phòng,
+câu trả lời lấy từ chỉ mục bitmap trong bộ nhớ (availability.py) mà không cần truy vấn.
+"""
+import secrets
+from datetime import timedelta
+
+import pytz
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import Exists, OuterRef, Q
+from django.utils import timezone
+
+from . import availability
+from .models import ACTIVE_BOOKING_STATUSES, Booking, BookingRoom, Room, RoomNight
+
+# Múi giờ của khách sạn - dùng để quy đổi check-in/check-out sang "đêm" địa phương
+HOTEL_TIMEZONE = pytz.timezone('Asia/Ho_Chi_Minh')
+
+# Thời gian giữ phòng mặc định khi khách mở trang thanh toán
+DEFAULT_HOLD_TTL_SECONDS = 600
+
+
+class HoldConflict(Exception):
+    """Một hoặc nhiều (phòng, đêm) đã bị booking hoặc hold khác giữ"""
+
+    def __init__(self, room_ids):
+        self.room_ids = set(room_ids)
+        super().__init__(f"Phòng đã bị giữ: {sorted(self.room_ids)}")
+
+
+def local_date(value):
+    """Quy đổi datetime (aware) sang ngày theo giờ địa phương của khách sạn"""
+    if hasattr(value, 'astimezone') and getattr(value, 'tzinfo', None) is not None:
+        return value.astimezone(HOTEL_TIMEZONE).date()
+    if hasattr(value, 'date'):
+        return value.date()
+    return value
+
+
+def stay_nights(check_in, check_out):
+    """
+    Danh sách các đêm lưu trú [check_in, check_out) theo ngày địa phương.
+    Một lượt ở ngắn hơn một đêm vẫn chiếm đêm nhận phòng.
+    """
+    start = local_date(check_in)
+    end = local_date(check_out)
+    if end <= start:
+        end = start + timedelta(days=1)
+    return [start + timedelta(days=i) for i in range((end - start).days)]
+
+
+def sync_booking_rooms(booking):
+    """
+    Sao chép khoảng lưu trú và cờ còn hiệu lực của booking lên các dòng BookingRoom.
+    Chỉ cập nhật các dòng đang lệch (một câu UPDATE).
+    """
+    if booking.pk is None:
+        return 0
+    is_active = booking.status in ACTIVE_BOOKING_STATUSES
+    return BookingRoom.objects.filter(booking_id=booking.pk).exclude(
+        check_in_date=booking.check_in_date,
+        check_out_date=booking.check_out_date,
+        is_active=is_active,
+    ).update(
+        check_in_date=booking.check_in_date,
+        check_out_date=booking.check_out_date,
+        is_active=is_active,
+    )
+
+
+def sync_booking_nights(booking):
+    """
+    Đồng bộ các dòng RoomNight của một booking với trạng thái, ngày và danh sách phòng hiện tại.
+    Chỉ ghi phần chênh lệch (thêm đêm mới, xóa đêm không còn giữ).
+    Trả về tập phòng có đêm bị thay đổi.
+    """
+    if booking.pk is None:
+        return set()
+
+    desired = set()
+    if booking.status in ACTIVE_BOOKING_STATUSES and booking.check_in_date and booking.check_out_date:
+        nights = stay_nights(booking.check_in_date, booking.check_out_date)
+        room_ids = BookingRoom.objects.filter(booking_id=booking.pk).values_list('room_id', flat=True)
+        desired = {(room_id, night) for room_id in room_ids for night in nights}
+
+    existing = {
+        (room_id, night): pk
+        for pk, room_id, night in RoomNight.objects.filter(booking_id=booking.pk).values_list('pk', 'room_id', 'date')
+    }
+
+    stale = {key: pk for key, pk in existing.items() if key not in desired}
+    if stale:
+        RoomNight.objects.filter(pk__in=stale.values()).delete()
+
+    missing = desired - existing.keys()
+    if missing:
+        # Hold đã hết hạn không còn giữ phòng; xóa trước để không vướng unique (room, date)
+        purge_expired_holds(
+            room_ids={room_id for room_id, _ in missing}, dates={night for _, night in missing}
+        )
+        # unique (room, date): IntegrityError nếu booking/hold khác đã giữ đêm này
+        RoomNight.objects.bulk_create([
+            RoomNight(room_id=room_id, booking_id=booking.pk, date=night)
+            for room_id, night in sorted(missing)
+        ])
+
+    changed_rooms = {room_id for room_id, _ in stale} | {room_id for room_id, _ in missing}
+    availability.notify_rooms_changed(changed_rooms)
+    return changed_rooms
+
+
+def release_booking_nights(booking_ids):
+    """Giải phóng toàn bộ đêm đang giữ của các booking (hủy, no-show, check-out)"""
+    nights = RoomNight.objects.filter(booking_id__in=list(booking_ids))
+    availability.notify_rooms_changed(nights.values_list('room_id', flat=True).distinct())
+    return nights.delete()[0]
+
+
+def live_nights():
+    """Các đêm đang bị giữ: của booking, hoặc của hold chưa hết hạn"""
+    return RoomNight.objects.filter(Q(booking__isnull=False) | Q(expires_at__gt=timezone.now()))
+
+
+def occupied_nights(start_date, end_date):
+    """Queryset các đêm đã bị giữ trong khoảng [start_date, end_date)"""
+    return live_nights().filter(date__gte=start_date, date__lt=end_date)
+
+
+# ----- Hold tạm thời (TTL) -----
+
+def purge_expired_holds(room_ids=None, dates=None):
+    """Xóa các hold đã hết hạn (có thể giới hạn theo phòng / ngày)"""
+    expired = RoomNight.objects.filter(booking__isnull=True, expires_at__lte=timezone.now())
+    if room_ids is not None:
+        expired = expired.filter(room_id__in=room_ids)
+    if dates is not None:
+        expired = expired.filter(date__in=dates)
+    return expired.delete()[0]
+
+
+def acquire_hold(rooms, check_in, check_out, holder, ttl_seconds=None):
+    """
+    Giữ tạm các phòng cho khoảng [check_in, check_out) trong ttl_seconds cho người dùng holder.
+    Mỗi người chỉ có một hold: hold cũ của holder được trả lại trước khi giữ phòng mới.
+    Trả về (hold_token, expires_at); ném HoldConflict nếu có đêm đã bị giữ (hold cũ vẫn được giữ nguyên).
+    Tranh chấp được DB phân xử qua unique (room, date), không cần khóa ứng dụng.
+    """
+    if ttl_seconds is None:
+        ttl_seconds = getattr(settings, 'BOOKING_HOLD_TTL_SECONDS', DEFAULT_HOLD_TTL_SECONDS)
+    room_ids = {room.pk if isinstance(room, Room) else room for room in rooms}
+    nights = stay_nights(check_in, check_out)
+    token = secrets.token_urlsafe(24)
+    expires_at = timezone.now() + timedelta(seconds=ttl_seconds)
+
+    try:
+        with transaction.atomic():
+            previous = RoomNight.objects.filter(held_by=holder, booking__isnull=True)
+            released_rooms = set(previous.values_list('room_id', flat=True))
+            previous.delete()
+            purge_expired_holds(room_ids=room_ids, dates=nights)
+            RoomNight.objects.bulk_create([
+                RoomNight(room_id=room_id, date=night, hold_token=token, expires_at=expires_at, held_by=holder)
+                for room_id in sorted(room_ids) for night in nights
+            ])
+    except IntegrityError:
+        raise HoldConflict(
+            live_nights().filter(room_id__in=room_ids, date__in=nights).values_list('room_id', flat=True)
+        )
+
+    availability.notify_rooms_changed(room_ids | released_rooms)
+    return token, expires_at
+
+
+def claim_hold(hold_token, booking, holder):
+    """Chuyển các đêm của hold (chưa hết hạn, do holder giữ) thành đêm của booking"""
+    if not hold_token:
+        return 0
+    return RoomNight.objects.filter(
+        hold_token=hold_token, held_by=holder, booking__isnull=True, expires_at__gt=timezone.now()
+    ).update(booking=booking, hold_token=None, expires_at=None, held_by=None)
+
+
+def release_hold(hold_token, holder):
+    """Trả lại các đêm của hold do holder giữ (khách rời trang thanh toán)"""
+    nights = RoomNight.objects.filter(hold_token=hold_token, held_by=holder, booking__isnull=True)
+    availability.notify_rooms_changed(nights.values_list('room_id', flat=True).distinct())
+    return nights.delete()[0]
+
+
+def find_held_rooms(rooms, check_in, check_out, exclude_token=None, holder=None):
+    """
+    Các phòng có đêm trong [check_in, check_out) đang bị hold khác (chưa hết hạn) giữ.
+    exclude_token: bỏ qua hold này nếu nó do holder giữ (token của người khác không được miễn)
+    """
+    room_ids = rooms_to_verify(
+        [room.pk if isinstance(room, Room) else room for room in rooms], check_in, check_out
+    )
+    if not room_ids:
+        return set()
+    holds = RoomNight.objects.filter(
+        room_id__in=room_ids, booking__isnull=True, expires_at__gt=timezone.now(),
+        date__in=stay_nights(check_in, check_out),
+    )
+    if exclude_token and holder is not None:
+        holds = holds.exclude(hold_token=exclude_token, held_by=holder)
+    return set(holds.values_list('room_id', flat=True))
+
+
+def available_rooms(start_date, end_date, queryset=None):
+    """
+    Các phòng không bị giữ bất kỳ đêm nào trong khoảng [start_date, end_date).
+    Trong cửa sổ đặt phòng: loại các phòng bận theo bitmap trong bộ nhớ.
+    Ngoài cửa sổ: anti-join (NOT EXISTS) trên index (room, date).
+    """
+    if queryset is None:
+        queryset = Room.objects.all()
+
+    busy = availability.index.busy_room_ids(start_date, end_date)
+    if busy is not None:
+        return queryset.exclude(pk__in=busy)
+
+    return queryset.filter(
+        ~Exists(occupied_nights(start_date, end_date).filter(room=OuterRef('pk')))
+    )
+
+
+def rooms_to_verify(room_ids, check_in, check_out, check_version=True):
+    """
+    Lọc nhanh bằng bitmap: trả về các phòng CẦN kiểm tra chồng lấn bằng DB.
+    Phòng bị loại là phòng chắc chắn không có booking nào chồng lấn [check_in, check_out).
+
+    Hai lượt ở có thể chồng lấn theo giờ dù không chung "đêm" (vd. trả phòng 10h, nhận 8h
+    cùng ngày), nên mở rộng khoảng kiểm tra thêm một đêm mỗi phía: mọi booking chồng lấn
+    đều giữ ít nhất một đêm trong [ngày check_in - 1, ngày check_out].
+    """
+    room_ids = set(room_ids)
+    start = local_date(check_in) - timedelta(days=1)
+    end = local_date(check_out) + timedelta(days=1)
+    free = availability.index.free_among(room_ids, start, end, check_version=check_version)
+    if free is None:
+        return room_ids
+    return room_ids - free
+
+
+def find_conflicting_bookings(rooms, check_in, check_out, exclude_booking=None):
+    """
+    Tìm booking còn hiệu lực chồng lấn [check_in, check_out) cho cả nhóm phòng bằng MỘT truy vấn.
+    Trả về dict {room_id: booking chồng lấn sớm nhất}; phòng không bị trùng không có trong dict.
+
+    Hai khoảng thời gian overlap nếu booking khác bắt đầu trước khi ta kết thúc
+    và kết thúc sau khi ta bắt đầu.
+    """
+    return find_conflicts_many([(rooms, check_in, check_out)], exclude_booking=exclude_booking)[0]
+
+
+def find_conflicts_many(windows, exclude_booking=None):
+    """
+    Như find_conflicting_bookings cho nhiều khoảng (rooms, check_in, check_out) cùng lúc:
+    bitmap kiểm tra phiên bản một lần, các khoảng còn cần xác minh gộp vào MỘT truy vấn (OR).
+    Trả về list dict {room_id: booking} theo thứ tự windows.
+    """
+    availability.index.ensure_fresh()
+    pending = []
+    condition = Q()
+    for rooms, check_in, check_out in windows:
+        room_ids = rooms_to_verify(
+            [room.pk if isinstance(room, Room) else room for room in rooms],
+            check_in, check_out, check_version=False,
+        )
+        pending.append(room_ids)
+        if room_ids:
+            condition |= Q(room_id__in=room_ids, check_in_date__lt=check_out, check_out_date__gt=check_in)
+
+    results = [{} for _ in windows]
+    if not condition:
+        return results
+
+    # Quét index (room, is_active, check_in_date, check_out_date) trên bảng BookingRoom
+    overlaps = BookingRoom.objects.filter(condition, is_active=True).select_related('booking').order_by(
+        'room_id', 'check_in_date', 'booking_id'
+    )
+    if exclude_booking is not None:
+        exclude_id = exclude_booking.pk if isinstance(exclude_booking, Booking) else exclude_booking
+        overlaps = overlaps.exclude(booking_id=exclude_id)
+
+    for row in overlaps:
+        for room_ids, (_, check_in, check_out), conflicts in zip(pending, windows, results):
+            if row.room_id in room_ids and row.check_in_date < check_out and row.check_out_date > check_in:
+                conflicts.setdefault(row.room_id, row.booking)
+    return results
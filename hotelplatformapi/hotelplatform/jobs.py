@@ -0,0 +1,257 @@
+"""
+Hàng đợi tác vụ nền lưu trong DB (Job)
+
+Các việc phụ của signals (thông báo, thống kê khách hàng, tạo hóa đơn khi trả phòng) và việc chạy lâu
+(xuất snapshot phân tích từ trang admin) không chạy trong request mà được ghi thành job và do worker
+(manage.py run_worker) xử lý.
+
+- enqueue() ghi job khi transaction hiện tại commit: rollback thì không có job, worker không thấy
+  dữ liệu chưa commit.
+- dedup_key: đã có job cùng key đang chờ thì bỏ qua (vd. nhiều booking của cùng khách trong một
+  request chỉ cần tính lại thống kê một lần). Job đang chờ giữ key ở cột unique pending_key, bỏ trống khi
+  worker nhận job → chặn trùng bằng ràng buộc unique thường, đúng trên cả MySQL lẫn PostgreSQL.
+- Worker nhận job bằng SELECT ... FOR UPDATE SKIP LOCKED nếu DB hỗ trợ (PostgreSQL, MySQL 8);
+  SQLite không có → nhận từng job bằng UPDATE có điều kiện trạng thái (chỉ một worker thắng).
+- Lỗi → thử lại sau BASE_BACKOFF * 2^(lần thử - 1) (tối đa MAX_BACKOFF) tới max_attempts rồi FAILED.
+  Job RUNNING quá STALE_AFTER (worker chết giữa chừng) được trả về hàng đợi; worker cũ chạy xong sau đó
+  không ghi đè kết quả vì chỉ cập nhật job còn do mình giữ.
+- Handler chạy trong transaction.atomic(); việc chạy lâu (xuất snapshot) đăng ký atomic=False để không giữ
+  transaction suốt thời gian chạy và stale_after riêng để không bị coi là worker chết rồi chạy trùng.
+- prune() xóa job DONE / FAILED đã lâu để bảng không phình ra (run_worker gọi định kỳ).
+- settings.JOB_QUEUE_EAGER = True: chạy handler ngay khi commit, không cần worker (dev / test).
+"""
+import logging
+import os
+import socket
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import IntegrityError, connection, transaction
+from django.db.models import F, Q
+from django.utils import timezone
+
+from . import snapshots
+from .models import Job, JobStatus, Notification, Payment, RoomRental, User
+
+logger = logging.getLogger(__name__)
+
+BASE_BACKOFF = timedelta(seconds=10)
+MAX_BACKOFF = timedelta(hours=1)
+
+# Job đang chạy lâu hơn mốc này coi như worker đã chết
+STALE_AFTER = timedelta(minutes=10)
+
+# Thời gian giữ job đã xong / thất bại (job thất bại giữ lâu hơn để tra lỗi)
+KEEP_DONE = timedelta(days=7)
+KEEP_FAILED = timedelta(days=30)
+
+# Tên job → hàm xử lý (nhận payload dạng keyword arguments)
+HANDLERS = {}
+# Tên job chạy ngoài transaction / tên job → mốc stale riêng (thay STALE_AFTER)
+NON_ATOMIC = set()
+STALE_AFTER_BY_NAME = {}
+
+
+def handler(name, atomic=True, stale_after=None):
+    """
+    Đăng ký hàm xử lý cho job tên name.
+    atomic=False: không bọc handler trong transaction (việc chạy lâu, tự lo tính nhất quán).
+    stale_after: thời gian chạy tối đa trước khi job bị coi là của worker đã chết.
+    """
+    def decorator(func):
+        HANDLERS[name] = func
+        if not atomic:
+            NON_ATOMIC.add(name)
+        if stale_after:
+            STALE_AFTER_BY_NAME[name] = stale_after
+        return func
+    return decorator
+
+
+def enqueue(name, dedup_key=None, delay=None, max_attempts=None, **payload):
+    """Ghi job khi transaction hiện tại commit; payload phải serialize được thành JSON"""
+    if name not in HANDLERS:
+        raise LookupError(f'Job chưa được đăng ký: {name}')
+    if getattr(settings, 'JOB_QUEUE_EAGER', False):
+        transaction.on_commit(lambda: HANDLERS[name](**payload))
+        return
+    transaction.on_commit(lambda: _insert(name, payload, dedup_key, delay, max_attempts))
+
+
+def enqueue_many(name, payloads):
+    """Như enqueue() cho nhiều job cùng tên (không dedup): một câu INSERT khi transaction commit"""
+    if name not in HANDLERS:
+        raise LookupError(f'Job chưa được đăng ký: {name}')
+    payloads = list(payloads)
+    if not payloads:
+        return
+    if getattr(settings, 'JOB_QUEUE_EAGER', False):
+        transaction.on_commit(lambda: [HANDLERS[name](**payload) for payload in payloads])
+        return
+    transaction.on_commit(lambda: Job.objects.bulk_create([Job(name=name, payload=payload) for payload in payloads]))
+
+
+def _insert(name, payload, dedup_key, delay, max_attempts):
+    job = Job(
+        name=name, payload=payload, dedup_key=dedup_key, pending_key=dedup_key,
+        run_at=timezone.now() + (delay or timedelta()),
+    )
+    if max_attempts:
+        job.max_attempts = max_attempts
+    # Đã có job cùng key đang chờ (kể cả do request khác ghi đồng thời): unique pending_key làm
+    # câu INSERT bị bỏ qua (ON CONFLICT DO NOTHING / INSERT IGNORE)
+    Job.objects.bulk_create([job], ignore_conflicts=True)
+
+
+def worker_name():
+    return f'{socket.gethostname()}:{os.getpid()}'
+
+
+def claim(worker, limit=1):
+    """Nhận tối đa limit job đến hạn cho worker; trả về danh sách Job đã chuyển sang RUNNING"""
+    now = timezone.now()
+    due = Job.objects.filter(status=JobStatus.PENDING, run_at__lte=now).order_by('run_at', 'id')
+    # Bỏ pending_key: từ lúc này request mới cùng key ghi được job mới (dữ liệu có thể đã đổi sau khi job chạy)
+    claimed = dict(
+        status=JobStatus.RUNNING, pending_key=None, locked_by=worker, locked_at=now, attempts=F('attempts') + 1
+    )
+
+    if connection.features.has_select_for_update_skip_locked:
+        with transaction.atomic():
+            ids = list(due.select_for_update(skip_locked=True).values_list('id', flat=True)[:limit])
+            Job.objects.filter(id__in=ids).update(**claimed)
+    else:
+        ids = [
+            job_id for job_id in due.values_list('id', flat=True)[:limit]
+            if Job.objects.filter(id=job_id, status=JobStatus.PENDING).update(**claimed)
+        ]
+    return list(Job.objects.filter(id__in=ids).order_by('run_at', 'id'))
+
+
+def backoff(attempts):
+    return min(BASE_BACKOFF * 2 ** max(attempts - 1, 0), MAX_BACKOFF)
+
+
+def run(job):
+    """Chạy một job đã nhận; cập nhật DONE / chờ thử lại / FAILED. Trả về True nếu thành công"""
+    try:
+        func = HANDLERS.get(job.name)
+        if func is None:
+            raise LookupError(f'Job chưa được đăng ký: {job.name}')
+        if job.name in NON_ATOMIC:
+            func(**job.payload)
+        else:
+            with transaction.atomic():
+                func(**job.payload)
+    except Exception as e:
+        logger.exception(f'Job {job.id} ({job.name}) lỗi ở lần thử {job.attempts}')
+        _failed(job, f'{type(e).__name__}: {e}')
+        return False
+
+    _owned(job).update(status=JobStatus.DONE, finished_at=timezone.now(), locked_by=None)
+    return True
+
+
+def _owned(job):
+    """Job còn do lần nhận này giữ; đã bị requeue_stale trả về / worker khác nhận thì rỗng"""
+    return Job.objects.filter(id=job.id, status=JobStatus.RUNNING, locked_by=job.locked_by, locked_at=job.locked_at)
+
+
+def _failed(job, error):
+    now = timezone.now()
+    if job.attempts < job.max_attempts:
+        _requeue(_owned(job), job.dedup_key, now, now + backoff(job.attempts), last_error=error)
+        return
+    _owned(job).update(status=JobStatus.FAILED, finished_at=now, last_error=error, locked_by=None)
+
+
+def _requeue(jobs, dedup_key, now, run_at, **fields):
+    """
+    Đưa job (queryset) về PENDING; trả về số job đã đưa về.
+    Đã có job mới cùng dedup_key đang chờ → job đó làm thay, job này chuyển DONE.
+    """
+    if not dedup_key:
+        return jobs.update(status=JobStatus.PENDING, run_at=run_at, locked_by=None, **fields)
+    try:
+        with transaction.atomic():
+            return jobs.update(
+                status=JobStatus.PENDING, pending_key=dedup_key, run_at=run_at, locked_by=None, **fields
+            )
+    except IntegrityError:
+        jobs.update(status=JobStatus.DONE, finished_at=now, locked_by=None, **fields)
+        return 0
+
+
+def requeue_stale(now=None):
+    """Đưa job RUNNING quá STALE_AFTER (hoặc mốc riêng của tên job) về hàng đợi; trả về số job"""
+    now = now or timezone.now()
+    expired = Q(locked_at__lt=now - STALE_AFTER) & ~Q(name__in=STALE_AFTER_BY_NAME)
+    for name, stale_after in STALE_AFTER_BY_NAME.items():
+        expired |= Q(name=name, locked_at__lt=now - stale_after)
+    stale = Job.objects.filter(expired, status=JobStatus.RUNNING)
+    requeued = _requeue(stale.filter(dedup_key__isnull=True), None, now, now)
+    # Job có key đưa về từng job: job nào đã có job mới cùng key thì bỏ
+    for job_id, dedup_key in stale.filter(dedup_key__isnull=False).values_list('id', 'dedup_key'):
+        requeued += _requeue(stale.filter(id=job_id), dedup_key, now, now)
+    return requeued
+
+
+def prune(now=None, keep_done=KEEP_DONE, keep_failed=KEEP_FAILED):
+    """Xóa job DONE cũ hơn keep_done và FAILED cũ hơn keep_failed; trả về số job đã xóa"""
+    now = now or timezone.now()
+    deleted, _ = Job.objects.filter(
+        Q(status=JobStatus.DONE, finished_at__lt=now - keep_done)
+        | Q(status=JobStatus.FAILED, finished_at__lt=now - keep_failed)
+    ).delete()
+    return deleted
+
+
+def work(worker, batch_size=10):
+    """Nhận và chạy một lô job; trả về số job đã chạy"""
+    jobs = claim(worker, batch_size)
+    for job in jobs:
+        run(job)
+    return len(jobs)
+
+
+# ===================== Hàm xử lý =====================
+
+@handler('notify')
+def notify(user_id, title, message, notification_type='booking_confirmation'):
+    Notification.objects.create(user_id=user_id, notification_type=notification_type, title=title, message=message)
+
+
+@handler('refresh_customer_stats')
+def refresh_customer_stats(user_id):
+    user = User.objects.filter(pk=user_id, role='customer').first()
+    if user:
+        user.refresh_customer_stats()
+
+
+@handler('create_rental_payment')
+def create_rental_payment(rental_id):
+    """Phiếu thuê đã trả phòng nhưng chưa có Payment → tạo hóa đơn chờ thanh toán tại quầy"""
+    rental = RoomRental.objects.filter(pk=rental_id).select_related('customer').first()
+    if rental is None or rental.actual_check_out_date is None or Payment.objects.filter(rental=rental).exists():
+        return
+    payment = Payment.objects.create(
+        customer=rental.customer,
+        rental=rental,
+        amount=rental.total_price,
+        status=False,  # Chưa thanh toán, cần thanh toán tại quầy
+        payment_method='cash',  # Mặc định thanh toán tiền mặt
+        transaction_id=f"PAY_{rental.id}_{timezone.now().strftime('%Y%m%d_%H%M%S')}"
+    )
+    logger.info(f'Auto-created Payment {payment.id} for RoomRental {rental.id}: {payment.amount} VND')
+    Notification.objects.create(
+        user=rental.customer,
+        notification_type='booking_confirmation',
+        title='Hóa đơn đã được tạo',
+        message=f'Hóa đơn thanh toán {payment.transaction_id} đã được tạo. Số tiền: {payment.amount:,.0f} VND. Vui lòng thanh toán tại quầy.'
+    )
+
+
+@handler('export_snapshots', atomic=False, stale_after=timedelta(hours=3))
+def export_snapshots(file_format='parquet', full=False):
+    summary = snapshots.export(file_format=file_format, full=full)
+    logger.info(f'Exported analytics snapshots ({file_format}): {summary}')
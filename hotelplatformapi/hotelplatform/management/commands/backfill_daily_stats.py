@@ -0,0 +1,65 @@
+from datetime import date, timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import Max, Min
+from django.utils import timezone
+
+from hotelplatform import rollup
+from hotelplatform.inventory import local_date
+from hotelplatform.models import Booking, Payment, RoomRental
+
+
+class Command(BaseCommand):
+    help = (
+        'Tính lại bảng thống kê theo ngày (DailyStat) từ Booking / RoomRental / Payment. '
+        'Mặc định phủ toàn bộ dữ liệu (kể cả booking nhận phòng trong tương lai); chạy lại nhiều lần cho cùng kết quả.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--start', help='Ngày bắt đầu (YYYY-MM-DD)')
+        parser.add_argument('--end', help='Ngày kết thúc, không bao gồm (YYYY-MM-DD)')
+
+    def handle(self, *args, **options):
+        start = self.parse_date(options['start']) if options['start'] else self.earliest_date()
+        end = self.parse_date(options['end']) if options['end'] else self.latest_date() + timedelta(days=1)
+        if start is None:
+            self.stdout.write('Không có dữ liệu để tính.')
+            return
+        if start >= end:
+            raise CommandError('--start phải nhỏ hơn --end')
+
+        # Thanh toán hoàn tất trước khi có bảng RevenueNight: ghi doanh thu theo đêm trước
+        missing = Payment.objects.filter(status=True, revenue_nights__isnull=True).select_related('rental')
+        recognized = 0
+        for payment in missing.iterator():
+            payment.recognize_revenue()
+            recognized += 1
+        if recognized:
+            self.stdout.write(f'Đã ghi doanh thu theo đêm cho {recognized} thanh toán')
+
+        chunks = rollup.backfill(start, end)
+        self.stdout.write(self.style.SUCCESS(
+            f'Đã tính lại DailyStat từ {start} tới {end} ({(end - start).days} ngày, {chunks} cụm)'
+        ))
+
+    def parse_date(self, value):
+        try:
+            return date.fromisoformat(value)
+        except ValueError:
+            raise CommandError(f'Ngày không hợp lệ: {value}')
+
+    def earliest_date(self):
+        moments = [
+            *Booking.objects.aggregate(Min('created_at'), Min('check_in_date')).values(),
+            RoomRental.objects.aggregate(Min('check_in_date'))['check_in_date__min'],
+        ]
+        moments = [local_date(moment) for moment in moments if moment is not None]
+        return min(moments) if moments else None
+
+    def latest_date(self):
+        moments = [
+            timezone.now(),
+            Booking.objects.aggregate(Max('check_in_date'))['check_in_date__max'],
+            RoomRental.objects.aggregate(Max('check_out_date'))['check_out_date__max'],
+        ]
+        return max(local_date(moment) for moment in moments if moment is not None)
@@ -0,0 +1,129 @@
+import random
+import statistics
+import time
+from datetime import datetime, timedelta
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.utils import timezone
+
+from hotelplatform import inventory
+from hotelplatform.models import Booking, BookingRoom, BookingStatus, Room, RoomNight, RoomType, User
+
+
+class Command(BaseCommand):
+    help = (
+        'Đo độ trễ truy vấn phòng trống (sổ phòng theo đêm so với cách cũ qua M2M) '
+        'khi bảng Booking tăng dần. Toàn bộ dữ liệu giả được rollback khi kết thúc.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', default='10000,100000,1000000',
+                            help='Các mốc số lượng booking, phân tách bằng dấu phẩy')
+        parser.add_argument('--rooms', type=int, default=100, help='Số phòng giả lập')
+        parser.add_argument('--repeat', type=int, default=20, help='Số lần lặp mỗi truy vấn')
+        parser.add_argument('--batch-size', type=int, default=5000)
+
+    def handle(self, *args, **options):
+        try:
+            sizes = sorted(int(size) for size in options['sizes'].split(','))
+        except ValueError:
+            raise CommandError('--sizes phải là danh sách số nguyên, ví dụ 10000,100000')
+
+        self.batch_size = options['batch_size']
+        self.repeat = options['repeat']
+
+        with transaction.atomic():
+            self.setup_fixtures(options['rooms'])
+            self.stdout.write(f"{'bookings':>10} | {'ledger rows':>11} | {'ledger ms':>9} | {'legacy ms':>9}")
+
+            current = Booking.objects.count()
+            for size in sizes:
+                if size > current:
+                    self.create_historical_bookings(size - current)
+                    current = size
+                ledger_ms = self.measure(self.ledger_query)
+                legacy_ms = self.measure(self.legacy_query)
+                self.stdout.write(
+                    f"{current:>10} | {RoomNight.objects.count():>11} | {ledger_ms:>9.2f} | {legacy_ms:>9.2f}"
+                )
+
+            transaction.set_rollback(True)
+        self.stdout.write(self.style.SUCCESS('Đã rollback toàn bộ dữ liệu benchmark.'))
+
+    def setup_fixtures(self, room_count):
+        """Tạo phòng giả lập và các booking còn hiệu lực trong 28 ngày tới (không chồng lấn)"""
+        self.customer = User.objects.create_user(
+            username='benchmark_customer', email='benchmark@example.com',
+            password=None, full_name='Benchmark', role='customer'
+        )
+        room_type = RoomType.objects.create(name='Benchmark Type', base_price=Decimal('500000'), max_guests=2)
+        Room.objects.bulk_create([
+            Room(room_number=f'BENCH-{i:05d}', room_type=room_type) for i in range(room_count)
+        ])
+        self.rooms = list(Room.objects.filter(room_type=room_type))
+
+        now = timezone.now()
+        self.window_start = inventory.local_date(now + timedelta(days=10))
+        self.window_end = self.window_start + timedelta(days=3)
+        self.window_start_at = inventory.HOTEL_TIMEZONE.localize(datetime.combine(self.window_start, datetime.min.time()))
+        self.window_end_at = inventory.HOTEL_TIMEZONE.localize(datetime.combine(self.window_end, datetime.min.time()))
+
+        # Mỗi phòng có các lượt ở liên tiếp trong 28 ngày tới → sổ đêm có kích thước cố định
+        for room in self.rooms:
+            day = 1
+            while day < 27:
+                nights = random.randint(1, 4)
+                if random.random() < 0.6:
+                    booking = Booking.objects.create(
+                        customer=self.customer, check_in_date=now + timedelta(days=day),
+                        check_out_date=now + timedelta(days=day + nights),
+                        total_price=Decimal('0'), guest_count=1, status=BookingStatus.CONFIRMED,
+                    )
+                    booking.rooms.add(room)
+                day += nights
+
+    def create_historical_bookings(self, count):
+        """Thêm booking lịch sử (đã check-out) - bảng Booking tăng, sổ đêm không đổi"""
+        now = timezone.now()
+        remaining = count
+        while remaining > 0:
+            size = min(self.batch_size, remaining)
+            bookings = []
+            for _ in range(size):
+                check_in = now - timedelta(days=random.randint(30, 3 * 365), hours=random.randint(0, 23))
+                bookings.append(Booking(
+                    customer=self.customer, check_in_date=check_in,
+                    check_out_date=check_in + timedelta(days=random.randint(1, 5)),
+                    total_price=Decimal('0'), guest_count=1, status=BookingStatus.CHECKED_OUT,
+                ))
+            created = Booking.objects.bulk_create(bookings)
+            BookingRoom.objects.bulk_create([
+                BookingRoom(
+                    booking_id=booking.pk, room_id=random.choice(self.rooms).pk,
+                    check_in_date=booking.check_in_date, check_out_date=booking.check_out_date,
+                    is_active=False,
+                )
+                for booking in created
+            ])
+            remaining -= size
+
+    def ledger_query(self):
+        return list(inventory.available_rooms(self.window_start, self.window_end).values_list('id', flat=True))
+
+    def legacy_query(self):
+        booked_rooms = Booking.objects.filter(
+            status__in=['pending', 'confirmed', 'checked_in'],
+            check_in_date__lt=self.window_end_at,
+            check_out_date__gt=self.window_start_at,
+        ).values_list('rooms__id', flat=True)
+        return list(Room.objects.exclude(id__in=booked_rooms).values_list('id', flat=True))
+
+    def measure(self, query):
+        timings = []
+        for _ in range(self.repeat):
+            started = time.perf_counter()
+            query()
+            timings.append((time.perf_counter() - started) * 1000)
+        return statistics.median(timings)
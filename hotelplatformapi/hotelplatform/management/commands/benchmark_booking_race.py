@@ -0,0 +1,156 @@
+import statistics
+import threading
+import time
+from collections import Counter
+from datetime import timedelta
+from decimal import Decimal
+from types import SimpleNamespace
+
+from django.core.management.base import BaseCommand
+from django.db import connection, connections
+from django.utils import timezone
+
+from hotelplatform import inventory
+from hotelplatform.models import Booking, BookingRoom, Room, RoomType, User
+from hotelplatform.serializers import BookingSerializer
+
+
+class Command(BaseCommand):
+    help = (
+        'Benchmark tranh chấp đặt phòng: nhiều thread cùng đặt một phòng cho cùng khoảng ngày '
+        '(qua BookingSerializer như API thật) và kiểm tra không có booking trùng. '
+        'Dữ liệu giả được xóa khi kết thúc.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--threads', type=int, default=32, help='Số thread đặt phòng đồng thời mỗi vòng')
+        parser.add_argument('--rounds', type=int, default=20, help='Số vòng (mỗi vòng một phòng)')
+        parser.add_argument('--with-hold', action='store_true',
+                            help='Mỗi thread lấy hold trước rồi mới tạo booking (luồng trang thanh toán)')
+
+    def handle(self, *args, **options):
+        self.threads = options['threads']
+        self.with_hold = options['with_hold']
+
+        if connection.vendor == 'sqlite':
+            self.stdout.write(self.style.WARNING(
+                'SQLite khóa toàn bộ file khi ghi: nhiều request sẽ lỗi "database is locked" thay vì tranh chấp thật. '
+                'Nên chạy trên MySQL/PostgreSQL.'
+            ))
+
+        self.setup_fixtures(options['rounds'])
+        outcomes = Counter()
+        latencies = []
+        started = time.perf_counter()
+        try:
+            for room in self.rooms:
+                round_outcomes, round_latencies = self.run_round(room)
+                outcomes.update(round_outcomes)
+                latencies.extend(round_latencies)
+            elapsed = time.perf_counter() - started
+            double_bookings = self.count_double_bookings()
+        finally:
+            self.cleanup()
+
+        attempts = sum(outcomes.values())
+        latencies.sort()
+        self.stdout.write(f"Số request      : {attempts} ({len(self.rooms)} vòng x {self.threads} thread)")
+        self.stdout.write(f"Thành công      : {outcomes['created']}")
+        self.stdout.write(f"Bị từ chối      : {outcomes['rejected']}")
+        self.stdout.write(f"Lỗi khác        : {outcomes['error']}")
+        self.stdout.write(f"Thời gian       : {elapsed:.2f}s ({attempts / elapsed:.0f} req/s)")
+        if latencies:
+            self.stdout.write(
+                f"Độ trễ (ms)     : p50={statistics.median(latencies):.1f} "
+                f"p95={latencies[int(len(latencies) * 0.95) - 1]:.1f} max={latencies[-1]:.1f}"
+            )
+        if double_bookings:
+            self.stdout.write(self.style.ERROR(f"Booking trùng   : {double_bookings}"))
+        else:
+            self.stdout.write(self.style.SUCCESS('Booking trùng   : 0'))
+
+    def setup_fixtures(self, rounds):
+        # Mỗi thread một khách: mỗi người chỉ giữ được một hold, các thread phải là những khách tranh nhau
+        self.customers = [
+            User.objects.create_user(
+                username=f'race_benchmark_customer_{i}', email=f'race-benchmark-{i}@example.com',
+                password=None, full_name='Race Benchmark', role='customer'
+            )
+            for i in range(self.threads)
+        ]
+        self.room_type = RoomType.objects.create(name='Race Benchmark Type', base_price=Decimal('500000'), max_guests=4)
+        Room.objects.bulk_create([
+            Room(room_number=f'RACE-{i:04d}', room_type=self.room_type) for i in range(rounds)
+        ])
+        self.rooms = list(Room.objects.filter(room_type=self.room_type).order_by('pk'))
+        now = timezone.now()
+        self.check_in = now + timedelta(days=7)
+        self.check_out = now + timedelta(days=9)
+
+    def run_round(self, room):
+        barrier = threading.Barrier(self.threads)
+        outcomes = Counter()
+        latencies = []
+        lock = threading.Lock()
+
+        def worker(customer):
+            try:
+                barrier.wait()
+                started = time.perf_counter()
+                outcome = self.attempt_booking(room, customer)
+                elapsed = (time.perf_counter() - started) * 1000
+                with lock:
+                    outcomes[outcome] += 1
+                    latencies.append(elapsed)
+            finally:
+                connections.close_all()
+
+        workers = [threading.Thread(target=worker, args=(customer,)) for customer in self.customers]
+        for thread in workers:
+            thread.start()
+        for thread in workers:
+            thread.join()
+        return outcomes, latencies
+
+    def attempt_booking(self, room, customer):
+        data = {
+            'rooms': [room.pk],
+            'check_in_date': self.check_in.isoformat(),
+            'check_out_date': self.check_out.isoformat(),
+            'guest_count': 2,
+        }
+        try:
+            if self.with_hold:
+                try:
+                    data['hold_token'], _ = inventory.acquire_hold([room], self.check_in, self.check_out, customer)
+                except inventory.HoldConflict:
+                    return 'rejected'
+
+            request = SimpleNamespace(user=customer, data=data)
+            serializer = BookingSerializer(data=data, context={'request': request})
+            if not serializer.is_valid():
+                return 'rejected'
+            serializer.save()
+            return 'created'
+        except Exception as e:
+            if 'rooms' in getattr(e, 'detail', {}):
+                return 'rejected'
+            self.stderr.write(f"Lỗi: {e}")
+            return 'error'
+
+    def count_double_bookings(self):
+        """Số cặp booking còn hiệu lực chồng lấn trên cùng một phòng"""
+        double = 0
+        for room in self.rooms:
+            latest_check_out = None
+            for link in BookingRoom.objects.filter(room=room, is_active=True).order_by('check_in_date'):
+                if latest_check_out and link.check_in_date < latest_check_out:
+                    double += 1
+                latest_check_out = max(latest_check_out or link.check_out_date, link.check_out_date)
+        return double
+
+    def cleanup(self):
+        Booking.objects.filter(customer__in=self.customers).delete()
+        Room.objects.filter(room_type=self.room_type).delete()
+        self.room_type.delete()
+        User.objects.filter(pk__in=[customer.pk for customer in self.customers]).delete()
@@ -0,0 +1,33 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from hotelplatform import snapshots
+
+
+class Command(BaseCommand):
+    help = (
+        'Xuất ảnh chụp Parquet / Arrow (phân vùng theo tháng) của booking, liên kết booking-phòng, phiếu thuê, '
+        'thanh toán và thống kê khách hàng cho phân tích offline. Chỉ ghi lại các tháng thay đổi từ lần xuất trước. '
+        'Cần cài pyarrow.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--output', help='Thư mục đích (mặc định settings.ANALYTICS_SNAPSHOT_DIR)')
+        parser.add_argument('--format', dest='file_format', choices=snapshots.FORMATS, default='parquet',
+                            help='Định dạng file (mặc định parquet)')
+        parser.add_argument('--full', action='store_true', help='Ghi lại toàn bộ, bỏ qua watermark')
+        parser.add_argument('--table', action='append', choices=[table.name for table in snapshots.TABLES],
+                            help='Chỉ xuất bảng này (lặp lại được)')
+
+    def handle(self, *args, **options):
+        try:
+            summary = snapshots.export(
+                options['output'], options['file_format'], full=options['full'], tables=options['table']
+            )
+        except ImportError as e:
+            raise CommandError(str(e))
+
+        for name, months in summary.items():
+            self.stdout.write(f"{name:<14}: {len(months)} tháng ghi lại{' (' + ', '.join(months) + ')' if months else ''}")
+        self.stdout.write(self.style.SUCCESS(
+            f"Đã xuất snapshot vào {options['output'] or snapshots.default_directory()}"
+        ))
@@ -0,0 +1,55 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import close_old_connections
+
+from hotelplatform import tasks
+from hotelplatform.models import TaskRunStatus
+
+
+class Command(BaseCommand):
+    help = (
+        'Chạy tác vụ cập nhật trạng thái phòng / booking (giống RoomStatusUpdateTaskView) ngay trong tiến trình. '
+        'Mặc định chạy một lần; --loop chạy lặp lại theo --interval giây thay cho cron gọi HTTP.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--loop', action='store_true', help='Chạy lặp lại cho tới khi bị dừng (Ctrl+C)')
+        parser.add_argument('--interval', type=float, default=60, help='Số giây giữa hai lần chạy (mặc định 60)')
+        parser.add_argument('--full', action='store_true', help='Lần chạy đầu bỏ qua mốc, quét toàn bộ booking đang chờ')
+
+    def handle(self, *args, **options):
+        if options['interval'] <= 0:
+            raise CommandError('--interval phải lớn hơn 0')
+
+        full = options['full']
+        try:
+            while True:
+                started = time.monotonic()
+                self.run_once(full)
+                full = False
+                if not options['loop']:
+                    break
+                time.sleep(max(0, options['interval'] - (time.monotonic() - started)))
+        except KeyboardInterrupt:
+            self.stdout.write('Đã dừng.')
+
+    def run_once(self, full):
+        # Tiến trình chạy lâu: bỏ kết nối DB đã hết hạn / lỗi giữa các lần chạy
+        close_old_connections()
+        try:
+            run = tasks.run_room_status_task(full=full)
+        except Exception as e:
+            # Một lần lỗi không dừng vòng lặp; mốc không đổi nên lần sau xét lại
+            self.stderr.write(self.style.ERROR(f'Cập nhật trạng thái thất bại: {e}'))
+            return
+
+        if run.status == TaskRunStatus.SKIPPED:
+            self.stdout.write('Bỏ qua: instance khác đang chạy tác vụ')
+            return
+        no_show, due = run.result['no_show'], run.result['check_in_due']
+        self.stdout.write(self.style.SUCCESS(
+            f"no-show: {no_show['bookings']} booking, {no_show['rooms_released']} phòng trả lại "
+            f"({no_show['duration_ms']} ms) | đến hạn: {due['bookings']} booking, {due['rooms_booked']} phòng "
+            f"({due['duration_ms']} ms)"
+        ))
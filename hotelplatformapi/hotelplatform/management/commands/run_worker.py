@@ -0,0 +1,91 @@
+import threading
+import time
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import close_old_connections, connection
+
+from hotelplatform import jobs
+
+# Khoảng giữa hai lần xóa job cũ
+PRUNE_INTERVAL = 3600
+
+
+class Command(BaseCommand):
+    help = (
+        'Chạy worker xử lý hàng đợi tác vụ nền (Job): thông báo, thống kê khách hàng, tạo hóa đơn khi trả phòng. '
+        'Mỗi luồng nhận job riêng (SKIP LOCKED nếu DB hỗ trợ) nên có thể chạy nhiều worker cùng lúc.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--concurrency', type=int, default=1, help='Số luồng xử lý (mặc định 1)')
+        parser.add_argument('--batch-size', type=int, default=10, help='Số job mỗi lần nhận (mặc định 10)')
+        parser.add_argument('--poll-interval', type=float, default=2,
+                            help='Số giây chờ khi hàng đợi trống (mặc định 2)')
+        parser.add_argument('--once', action='store_true', help='Xử lý hết job đến hạn rồi thoát')
+        parser.add_argument('--keep-days', type=float, default=jobs.KEEP_DONE.days,
+                            help=f'Số ngày giữ job đã xong (mặc định {jobs.KEEP_DONE.days}); '
+                                 f'job thất bại giữ {jobs.KEEP_FAILED.days} ngày')
+
+    def handle(self, *args, **options):
+        if options['concurrency'] < 1 or options['batch_size'] < 1:
+            raise CommandError('--concurrency và --batch-size phải lớn hơn 0')
+        if options['keep_days'] <= 0:
+            raise CommandError('--keep-days phải lớn hơn 0')
+
+        self.options = options
+        self.stopping = threading.Event()
+        requeued = jobs.requeue_stale()
+        if requeued:
+            self.stdout.write(f'Đưa {requeued} job bị treo về hàng đợi')
+        self.prune()
+        pruned_at = time.monotonic()
+
+        threads = [
+            threading.Thread(target=self.loop, args=(f'{jobs.worker_name()}:{i}',), daemon=True)
+            for i in range(options['concurrency'])
+        ]
+        for thread in threads:
+            thread.start()
+        self.stdout.write(self.style.SUCCESS(f"Worker đang chạy với {options['concurrency']} luồng"))
+        try:
+            while any(thread.is_alive() for thread in threads):
+                for thread in threads:
+                    thread.join(timeout=1)
+                if time.monotonic() - pruned_at >= PRUNE_INTERVAL:
+                    self.prune()
+                    pruned_at = time.monotonic()
+        except KeyboardInterrupt:
+            # Luồng dừng sau job đang chạy; job dở dang được requeue_stale trả về hàng đợi
+            self.stopping.set()
+            for thread in threads:
+                thread.join()
+            self.stdout.write('Đã dừng.')
+
+    def prune(self):
+        close_old_connections()
+        keep_done = timedelta(days=self.options['keep_days'])
+        try:
+            deleted = jobs.prune(keep_done=keep_done, keep_failed=max(keep_done, jobs.KEEP_FAILED))
+        except Exception as e:
+            self.stderr.write(self.style.ERROR(f'Xóa job cũ thất bại: {e}'))
+            return
+        if deleted:
+            self.stdout.write(f'Xóa {deleted} job cũ')
+
+    def loop(self, worker):
+        try:
+            while not self.stopping.is_set():
+                close_old_connections()
+                try:
+                    processed = jobs.work(worker, self.options['batch_size'])
+                except Exception as e:
+                    self.stderr.write(self.style.ERROR(f'{worker}: lỗi khi nhận job: {e}'))
+                    processed = 0
+                if not processed:
+                    if self.options['once']:
+                        return
+                    self.stopping.wait(self.options['poll_interval'])
+                    jobs.requeue_stale()
+        finally:
+            connection.close()
@@ -0,0 +1,56 @@
+# Generated by Django 5.2.4 on 2025-08-20 10:15
+
+import django.db.models.deletion
+from datetime import timedelta
+
+import pytz
+from django.db import migrations, models
+
+
+ACTIVE_STATUSES = ('pending', 'confirmed', 'checked_in')
+
+
+def backfill_room_nights(apps, schema_editor):
+    """Tạo sổ phòng theo đêm cho các booking còn hiệu lực hiện có"""
+    Booking = apps.get_model('hotelplatform', 'Booking')
+    RoomNight = apps.get_model('hotelplatform', 'RoomNight')
+    hotel_tz = pytz.timezone('Asia/Ho_Chi_Minh')
+
+    batch = []
+    bookings = Booking.objects.filter(status__in=ACTIVE_STATUSES).prefetch_related('rooms')
+    for booking in bookings.iterator(chunk_size=500):
+        start = booking.check_in_date.astimezone(hotel_tz).date()
+        end = booking.check_out_date.astimezone(hotel_tz).date()
+        if end <= start:
+            end = start + timedelta(days=1)
+        for room in booking.rooms.all():
+            for i in range((end - start).days):
+                batch.append(RoomNight(room_id=room.pk, booking_id=booking.pk, date=start + timedelta(days=i)))
+        if len(batch) >= 1000:
+            RoomNight.objects.bulk_create(batch)
+            batch = []
+    if batch:
+        RoomNight.objects.bulk_create(batch)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('hotelplatform', '0002_alter_notification_notification_type'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RoomNight',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField()),
+                ('booking', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='room_nights', to='hotelplatform.booking')),
+                ('room', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='nights', to='hotelplatform.room')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['room', 'date'], name='hotelplatfo_room_id_080bb9_idx')],
+            },
+        ),
+        migrations.RunPython(backfill_room_nights, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,72 @@
+# Generated by Django 5.2.4 on 2025-08-21 09:30
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+ACTIVE_STATUSES = ('pending', 'confirmed', 'checked_in')
+
+
+def copy_stay_window(apps, schema_editor):
+    """Sao chép khoảng lưu trú và trạng thái của booking lên các dòng BookingRoom đã có"""
+    Booking = apps.get_model('hotelplatform', 'Booking')
+    BookingRoom = apps.get_model('hotelplatform', 'BookingRoom')
+
+    booking = Booking.objects.filter(pk=models.OuterRef('booking_id'))
+    BookingRoom.objects.update(
+        check_in_date=models.Subquery(booking.values('check_in_date')[:1]),
+        check_out_date=models.Subquery(booking.values('check_out_date')[:1]),
+    )
+    BookingRoom.objects.exclude(booking__status__in=ACTIVE_STATUSES).update(is_active=False)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('hotelplatform', '0003_roomnight'),
+    ]
+
+    operations = [
+        # Bảng hotelplatform_booking_rooms đã tồn tại (M2M tự sinh) → chỉ khai báo lại ở state
+        migrations.SeparateDatabaseAndState(
+            state_operations=[
+                migrations.CreateModel(
+                    name='BookingRoom',
+                    fields=[
+                        ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                        ('booking', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='room_links', to='hotelplatform.booking')),
+                        ('room', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='booking_links', to='hotelplatform.room')),
+                    ],
+                    options={
+                        'db_table': 'hotelplatform_booking_rooms',
+                        'unique_together': {('booking', 'room')},
+                    },
+                ),
+                migrations.AlterField(
+                    model_name='booking',
+                    name='rooms',
+                    field=models.ManyToManyField(related_name='bookings', through='hotelplatform.BookingRoom', to='hotelplatform.room'),
+                ),
+            ],
+        ),
+        migrations.AddField(
+            model_name='bookingroom',
+            name='check_in_date',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='bookingroom',
+            name='check_out_date',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='bookingroom',
+            name='is_active',
+            field=models.BooleanField(default=True),
+        ),
+        migrations.RunPython(copy_stay_window, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='bookingroom',
+            index=models.Index(fields=['room', 'is_active', 'check_in_date', 'check_out_date'], name='hotelplatfo_room_id_19ed7e_idx'),
+        ),
+    ]
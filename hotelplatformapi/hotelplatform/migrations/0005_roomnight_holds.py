@@ -0,0 +1,57 @@
+# Generated by Django 5.2.4 on 2025-08-22 14:05
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def remove_duplicate_nights(apps, schema_editor):
+    """
+    Trước khi thêm unique (room, date): mỗi (phòng, đêm) chỉ giữ dòng tạo sớm nhất.
+    Trùng lặp chỉ có thể xuất hiện khi hai booking cùng giữ một đêm trước khi có ràng buộc.
+    """
+    RoomNight = apps.get_model('hotelplatform', 'RoomNight')
+
+    duplicates = []
+    last_key = None
+    for pk, room_id, date in RoomNight.objects.order_by('room_id', 'date', 'pk').values_list('pk', 'room_id', 'date').iterator():
+        if (room_id, date) == last_key:
+            duplicates.append(pk)
+        last_key = (room_id, date)
+
+    for start in range(0, len(duplicates), 1000):
+        RoomNight.objects.filter(pk__in=duplicates[start:start + 1000]).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('hotelplatform', '0004_bookingroom'),
+    ]
+
+    operations = [
+        migrations.RunPython(remove_duplicate_nights, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='roomnight',
+            name='booking',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='room_nights', to='hotelplatform.booking'),
+        ),
+        migrations.AddField(
+            model_name='roomnight',
+            name='hold_token',
+            field=models.CharField(blank=True, db_index=True, max_length=64, null=True),
+        ),
+        migrations.AddField(
+            model_name='roomnight',
+            name='expires_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddConstraint(
+            model_name='roomnight',
+            constraint=models.UniqueConstraint(fields=('room', 'date'), name='unique_room_night'),
+        ),
+        # Unique (room, date) đã phủ index cũ
+        migrations.RemoveIndex(
+            model_name='roomnight',
+            name='hotelplatfo_room_id_080bb9_idx',
+        ),
+    ]
@@ -0,0 +1,32 @@
+# Generated by Django 5.2.4 on 2026-10-17 16:02
+
+import django.core.validators
+import django.db.models.deletion
+from decimal import Decimal
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('hotelplatform', '0005_roomnight_holds'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RatePeriod',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(blank=True, max_length=100)),
+                ('start_date', models.DateField()),
+                ('end_date', models.DateField()),
+                ('price', models.DecimalField(decimal_places=2, max_digits=10, validators=[django.core.validators.MinValueValidator(Decimal('0'))])),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('room_type', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='rate_periods', to='hotelplatform.roomtype')),
+            ],
+            options={
+                'ordering': ['room_type', 'start_date'],
+                'indexes': [models.Index(fields=['room_type', 'start_date', 'end_date'], name='hotelplatfo_room_ty_b70864_idx')],
+            },
+        ),
+    ]
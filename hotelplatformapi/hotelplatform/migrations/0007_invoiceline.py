@@ -0,0 +1,32 @@
+# Generated by Django 5.2.4 on 2026-10-17 16:04
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('hotelplatform', '0006_rateperiod'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='InvoiceLine',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('room_number', models.CharField(max_length=50)),
+                ('room_type', models.CharField(max_length=100)),
+                ('guests', models.PositiveIntegerField(default=0)),
+                ('days', models.PositiveIntegerField()),
+                ('base_price', models.DecimalField(decimal_places=2, max_digits=10)),
+                ('surcharge', models.DecimalField(decimal_places=2, default=0, max_digits=12)),
+                ('subtotal', models.DecimalField(decimal_places=2, max_digits=12)),
+                ('payment', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='lines', to='hotelplatform.payment')),
+                ('room', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='invoice_lines', to='hotelplatform.room')),
+            ],
+            options={
+                'ordering': ['payment', 'id'],
+            },
+        ),
+    ]
@@ -0,0 +1,32 @@
+# Generated by Django 5.2.4 on 2026-10-17 16:07
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('hotelplatform', '0007_invoiceline'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DailyStat',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField()),
+                ('occupied_room_nights', models.PositiveIntegerField(default=0)),
+                ('bookings_created', models.PositiveIntegerField(default=0)),
+                ('revenue', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('cancellations', models.PositiveIntegerField(default=0)),
+                ('no_shows', models.PositiveIntegerField(default=0)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('room_type', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='daily_stats', to='hotelplatform.roomtype')),
+            ],
+            options={
+                'ordering': ['date', 'room_type'],
+                'unique_together': {('date', 'room_type')},
+            },
+        ),
+    ]
@@ -0,0 +1,29 @@
+# Generated by Django 5.2.4 on 2026-10-17 16:12
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('hotelplatform', '0008_dailystat'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RevenueNight',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField()),
+                ('amount', models.DecimalField(decimal_places=2, max_digits=12)),
+                ('payment', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='revenue_nights', to='hotelplatform.payment')),
+                ('room', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='revenue_nights', to='hotelplatform.room')),
+                ('room_type', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='revenue_nights', to='hotelplatform.roomtype')),
+            ],
+            options={
+                'ordering': ['date', 'id'],
+                'indexes': [models.Index(fields=['date', 'room_type'], name='hotelplatfo_date_2f17a0_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 5.2.4 on 2026-10-17 16:14
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('hotelplatform', '0009_revenuenight'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RoomDailyStat',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField()),
+                ('occupied_nights', models.PositiveIntegerField(default=0)),
+                ('revenue', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('room', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='daily_stats', to='hotelplatform.room')),
+            ],
+            options={
+                'ordering': ['date', 'room'],
+                'unique_together': {('date', 'room')},
+            },
+        ),
+    ]
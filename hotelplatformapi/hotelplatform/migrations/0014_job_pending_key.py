@@ -0,0 +1,34 @@
+# Generated by Django 5.2.4 on 2026-10-17 18:05
+
+from django.db import migrations, models
+
+
+def fill_pending_key(apps, schema_editor):
+    """Job đang chờ có dedup_key → pending_key; trùng key (MySQL không chặn trước đây) thì giữ job cũ nhất"""
+    Job = apps.get_model('hotelplatform', 'Job')
+    seen = set()
+    pending = Job.objects.filter(status='pending', dedup_key__isnull=False).order_by('id')
+    for job_id, key in pending.values_list('id', 'dedup_key'):
+        if key not in seen:
+            seen.add(key)
+            Job.objects.filter(pk=job_id).update(pending_key=key)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('hotelplatform', '0013_tasklock_taskrun'),
+    ]
+
+    operations = [
+        migrations.RemoveConstraint(
+            model_name='job',
+            name='unique_pending_job_dedup_key',
+        ),
+        migrations.AddField(
+            model_name='job',
+            name='pending_key',
+            field=models.CharField(blank=True, max_length=200, null=True, unique=True),
+        ),
+        migrations.RunPython(fill_pending_key, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,20 @@
+# Generated by Django 5.2.4 on 2026-10-17 18:30
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('hotelplatform', '0014_job_pending_key'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='roomnight',
+            name='held_by',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='held_nights', to=settings.AUTH_USER_MODEL),
+        ),
+    ]
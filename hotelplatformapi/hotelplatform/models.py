@@ -46,6 +46,9 @@ class BookingStatus(models.TextChoices):
     CANCELLED = 'cancelled', 'Đã hủy'
     NO_SHOW = 'no_show', 'Không xuất hiện'
 
+# Các trạng thái booking còn giữ phòng
+ACTIVE_BOOKING_STATUSES = (BookingStatus.PENDING, BookingStatus.CONFIRMED, BookingStatus.CHECKED_IN)
+
 # Vai trò người dùng
 class User(AbstractBaseUser, PermissionsMixin):
     ROLE_CHOICES = (
@@ -116,7 +119,8 @@ class User(AbstractBaseUser, PermissionsMixin):
         else:
             self.customer_type = CustomerType.NEW
         
-        self.save(update_fields=['total_bookings', 'total_spent', 'customer_type'])
+        # Gồm updated_at để watermark của snapshot phân tích thấy thay đổi
+        self.save(update_fields=['total_bookings', 'total_spent', 'customer_type', 'updated_at'])
 
 # Loại phòng
 class RoomType(models.Model):
@@ -130,6 +134,31 @@ class RoomType(models.Model):
     def __str__(self):
         return self.name
 
+# Giá theo mùa của loại phòng
+# Giá mỗi đêm trong khoảng [start_date, end_date] (tính cả hai đầu) thay cho RoomType.base_price.
+# Các khoảng trùng nhau: khoảng tạo sau được ưu tiên. Engine tính giá dựng sẵn mảng giá
+# từng đêm theo loại phòng cho cửa sổ đặt phòng, xem pricing.RateTable.
+class RatePeriod(models.Model):
+    room_type = models.ForeignKey(RoomType, on_delete=models.CASCADE, related_name='rate_periods')
+    name = models.CharField(max_length=100, blank=True)  # Ví dụ: Cao điểm hè, Tết
+    start_date = models.DateField()
+    end_date = models.DateField()
+    price = models.DecimalField(max_digits=10, decimal_places=2, validators=[MinValueValidator(Decimal('0'))])
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        ordering = ['room_type', 'start_date']
+        indexes = [
+            models.Index(fields=['room_type', 'start_date', 'end_date']),
+        ]
+
+    def __str__(self):
+        return f"{self.room_type.name}: {self.start_date} - {self.end_date} ({self.price})"
+
+    def clean(self):
+        if self.start_date and self.end_date and self.end_date < self.start_date:
+            raise ValidationError("Ngày kết thúc phải sau hoặc bằng ngày bắt đầu.")
+
 # Phòng
 class Room(models.Model):
     ROOM_STATUS = (
@@ -192,10 +221,49 @@ class RoomImage(models.Model):
             RoomImage.objects.filter(room=self.room, is_primary=True).exclude(pk=self.pk).update(is_primary=False)
         super().save(*args, **kwargs)
 
+# Giá trị trong DB của một số trường (TRACKED_FIELDS) để signals so sánh với giá trị mới.
+# Ghi lại khi nạp từ DB / sau khi lưu nên pre_save không phải SELECT lại bản ghi.
+class TrackedFieldsMixin:
+    TRACKED_FIELDS = ()
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance._remember_tracked(name for name in cls.TRACKED_FIELDS if name in field_names)
+        return instance
+
+    def refresh_from_db(self, using=None, fields=None, from_queryset=None):
+        super().refresh_from_db(using=using, fields=fields, from_queryset=from_queryset)
+        self._remember_tracked(name for name in self.TRACKED_FIELDS if fields is None or name in fields)
+
+    def save(self, *args, **kwargs):
+        super().save(*args, **kwargs)
+        # Signals đã so sánh xong với giá trị cũ; giờ DB giữ giá trị hiện tại của các trường vừa ghi
+        update_fields = kwargs.get('update_fields')
+        self._remember_tracked(name for name in self.TRACKED_FIELDS if update_fields is None or name in update_fields)
+
+    def _remember_tracked(self, names):
+        self._loaded_values = {**self.__dict__.get('_loaded_values', {}), **{name: getattr(self, name) for name in names}}
+
+    def loaded_values(self):
+        """
+        Giá trị TRACKED_FIELDS trong DB theo lần nạp / lưu gần nhất của instance; None nếu bản ghi chưa có trong DB.
+        Instance không nạp qua queryset (tạo tay với pk) hoặc bị defer trường theo dõi → đọc DB một lần.
+        """
+        if self.pk is None:
+            return None
+        values = self.__dict__.get('_loaded_values', {})
+        if len(values) < len(self.TRACKED_FIELDS):
+            values = type(self)._default_manager.filter(pk=self.pk).values(*self.TRACKED_FIELDS).first()
+            if values is None:
+                return None
+            self._loaded_values = values
+        return values
+
 # Đặt phòng
-class Booking(models.Model):
+class Booking(TrackedFieldsMixin, models.Model):
     customer = models.ForeignKey(User, on_delete=models.CASCADE, related_name='bookings', limit_choices_to={'role': 'customer'})
-    rooms = models.ManyToManyField(Room, related_name='bookings')
+    rooms = models.ManyToManyField(Room, related_name='bookings', through='BookingRoom')
     check_in_date = models.DateTimeField()
     check_out_date = models.DateTimeField()
     total_price = models.DecimalField(max_digits=12, decimal_places=2, validators=[MinValueValidator(Decimal('0'))])
@@ -218,11 +286,15 @@ class Booking(models.Model):
         ]
         indexes = [
             models.Index(fields=['customer', 'check_in_date']),
+            models.Index(fields=['status', 'check_in_date']),  # Tác vụ cập nhật trạng thái định kỳ
         ]
 
     def __str__(self):
         return f"Đặt phòng của {self.customer} từ {self.check_in_date} đến {self.check_out_date}"
 
+    # Trường signals cần giá trị cũ để so sánh (đổi trạng thái, ngày thống kê cũ)
+    TRACKED_FIELDS = ('status', 'check_in_date', 'check_out_date', 'created_at')
+
     def clean(self):
         # Kiểm tra ngày
         if self.check_in_date and self.check_out_date:
@@ -260,39 +332,20 @@ class Booking(models.Model):
         """
         Tính giá thực tế dựa trên số khách thực tế - SỬ DỤNG LOGIC PHÂN BỔ THÔNG MINH
         """
+        from .pricing import quote_rooms
+
         if not actual_guest_count:
             actual_guest_count = self.guest_count
-        
-        # SỬ DỤNG LOGIC PHÂN BỔ THÔNG MINH cho nhiều phòng
-        rooms = list(self.rooms.all())
-        if len(rooms) > 1:
-            stay_days = (self.check_out_date - self.check_in_date).days
-            pricing_result = self.calculate_price_for_multiple_rooms(rooms, actual_guest_count, stay_days)
-            return pricing_result['total_price']
-        
-        # Logic cũ cho phòng đơn
-        total_price = Decimal('0')
-        for room in rooms:
-            base_price = room.room_type.base_price
-            stay_days = (self.check_out_date - self.check_in_date).days
-            
-            # Tính phụ thu nếu vượt quá số khách tối đa
-            if actual_guest_count > room.room_type.max_guests:
-                extra_guests = actual_guest_count - room.room_type.max_guests
-                surcharge = base_price * (room.room_type.extra_guest_surcharge / 100) * extra_guests
-                room_total = (base_price + surcharge) * stay_days
-            else:
-                room_total = base_price * stay_days
-                
-            total_price += room_total
-        
-        return total_price
+
+        stay_days = (self.check_out_date - self.check_in_date).days
+        return quote_rooms(self.rooms.all(), actual_guest_count, stay_days, check_in=self.check_in_date)['total_price']
 
     @classmethod
-    def calculate_price_for_multiple_rooms(cls, rooms, guest_count, stay_days):
+    def calculate_price_for_multiple_rooms(cls, rooms, guest_count, stay_days, check_in=None):
         """
         Tính giá cho booking nhiều phòng với thuật toán phân bổ khách tối ưu
-        
+        (giữ lại để tương thích, logic nằm ở pricing.quote_rooms)
+
         Thuật toán:
         1. Sắp xếp phòng theo max_guests giảm dần (phòng lớn trước)
         2. Phân bổ tối đa cho mỗi phòng không vượt quá max_guests
@@ -302,6 +355,7 @@ class Booking(models.Model):
             rooms: Danh sách các Room objects
             guest_count: Tổng số khách  
             stay_days: Số ngày lưu trú
+            check_in: Ngày nhận phòng để áp giá theo mùa (None: giá cơ bản)
             
         Returns:
             dict: {
@@ -310,85 +364,66 @@ class Booking(models.Model):
                 'calculation_details': list
             }
         """
-        if not rooms or guest_count <= 0 or stay_days <= 0:
-            return {
-                'total_price': Decimal('0'),
-                'guest_allocation': [],
-                'calculation_details': []
-            }
-        
-        # Sắp xếp phòng theo max_guests giảm dần để ưu tiên phòng lớn trước
-        sorted_rooms = sorted(rooms, key=lambda r: r.room_type.max_guests, reverse=True)
-        
-        # Khởi tạo phân bổ khách
-        guest_allocation = [0] * len(sorted_rooms)
-        remaining_guests = guest_count
-        
-        # Bước 1: Phân bổ tối đa cho mỗi phòng không vượt quá max_guests
-        for i, room in enumerate(sorted_rooms):
-            max_guests = room.room_type.max_guests
-            allocated = min(remaining_guests, max_guests)
-            guest_allocation[i] = allocated
-            remaining_guests -= allocated
-            
-            if remaining_guests == 0:
-                break
-        
-        # Bước 2: Nếu còn khách dư, phân bổ đều cho các phòng (tạo phụ thu)
-        if remaining_guests > 0:
-            base_extra = remaining_guests // len(sorted_rooms)
-            extra_remainder = remaining_guests % len(sorted_rooms)
-            
-            for i in range(len(sorted_rooms)):
-                guest_allocation[i] += base_extra
-                if i < extra_remainder:
-                    guest_allocation[i] += 1
-        
-        # Tính giá cho từng phòng
-        total_price = Decimal('0')
-        calculation_details = []
-        
-        for i, room in enumerate(sorted_rooms):
-            room_guests = guest_allocation[i]
-            
-            # Tính giá cho phòng này
-            base_price = room.room_type.base_price
-            max_guests = room.room_type.max_guests
-            surcharge_rate = room.room_type.extra_guest_surcharge / 100
-            
-            if room_guests <= max_guests:
-                # Không vượt quá sức chứa
-                room_price = base_price
-                excess_guests = 0
-            else:
-                # Có phụ thu
-                excess_guests = room_guests - max_guests
-                surcharge = base_price * surcharge_rate * excess_guests
-                room_price = base_price + surcharge
-            
-            # Nhân với số ngày
-            total_room_price = room_price * stay_days
-            total_price += total_room_price
-            
-            calculation_details.append({
-                'room_number': room.room_number,
-                'room_type': room.room_type.name,
-                'guests': room_guests,
-                'max_guests': max_guests,
-                'excess_guests': excess_guests,
-                'base_price': base_price,
-                'room_price_per_day': room_price,
-                'total_room_price': total_room_price
-            })
-        
-        return {
-            'total_price': total_price,
-            'guest_allocation': guest_allocation,
-            'calculation_details': calculation_details
-        }
+        from .pricing import quote_rooms
+
+        return quote_rooms(rooms, guest_count, stay_days, check_in=check_in)
+
+# Liên kết Booking - Room (bảng trung gian của Booking.rooms)
+# Sao chép khoảng lưu trú và cờ còn hiệu lực của booking lên từng phòng để truy vấn trùng lịch
+# chỉ cần quét index (room, is_active, check_in_date, check_out_date) trên một bảng.
+# Được đồng bộ khi booking lưu / thêm phòng qua signals, xem inventory.sync_booking_rooms
+class BookingRoom(models.Model):
+    booking = models.ForeignKey(Booking, on_delete=models.CASCADE, related_name='room_links')
+    room = models.ForeignKey(Room, on_delete=models.CASCADE, related_name='booking_links')
+    check_in_date = models.DateTimeField(null=True, blank=True)
+    check_out_date = models.DateTimeField(null=True, blank=True)
+    is_active = models.BooleanField(default=True)
+
+    class Meta:
+        db_table = 'hotelplatform_booking_rooms'
+        unique_together = ('booking', 'room')
+        indexes = [
+            models.Index(fields=['room', 'is_active', 'check_in_date', 'check_out_date']),
+        ]
+
+    def __str__(self):
+        return f"Booking #{self.booking_id} - Phòng {self.room_id}"
+
+    def save(self, *args, **kwargs):
+        # Tạo trực tiếp (vd. inline trong admin): sao chép khoảng lưu trú từ booking
+        if self.booking_id and self.check_in_date is None:
+            self.check_in_date = self.booking.check_in_date
+            self.check_out_date = self.booking.check_out_date
+            self.is_active = self.booking.status in ACTIVE_BOOKING_STATUSES
+        super().save(*args, **kwargs)
+
+# Sổ phòng theo đêm (room-night inventory)
+# Mỗi dòng là một đêm (theo ngày giờ địa phương) mà một phòng bị giữ, bởi:
+# - booking còn hiệu lực (pending/confirmed/checked_in), hoặc
+# - hold tạm thời (booking rỗng, có hold_token và expires_at) khi khách mở trang thanh toán.
+# Ràng buộc unique (room, date) để DB đảm bảo mỗi đêm chỉ có một bên giữ phòng.
+# Được đồng bộ qua signals, xem inventory.py
+class RoomNight(models.Model):
+    room = models.ForeignKey(Room, on_delete=models.CASCADE, related_name='nights')
+    booking = models.ForeignKey(Booking, on_delete=models.CASCADE, related_name='room_nights', null=True, blank=True)
+    date = models.DateField()
+    hold_token = models.CharField(max_length=64, null=True, blank=True, db_index=True)
+    expires_at = models.DateTimeField(null=True, blank=True)  # Chỉ dùng cho hold
+    # Người giữ hold: chỉ người này tạo booking từ / trả lại hold; mỗi người một hold đang hiệu lực
+    held_by = models.ForeignKey(User, on_delete=models.CASCADE, related_name='held_nights', null=True, blank=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['room', 'date'], name='unique_room_night'),
+        ]
+
+    def __str__(self):
+        if self.booking_id is None:
+            return f"Phòng {self.room_id} - đêm {self.date} (Hold đến {self.expires_at})"
+        return f"Phòng {self.room_id} - đêm {self.date} (Booking #{self.booking_id})"
 
 # Phiếu thuê phòng
-class RoomRental(models.Model):
+class RoomRental(TrackedFieldsMixin, models.Model):
     booking = models.ForeignKey(Booking, on_delete=models.CASCADE, related_name='rentals', null=True, blank=True)
     customer = models.ForeignKey(User, on_delete=models.CASCADE, related_name='rentals', limit_choices_to={'role': 'customer'})
     rooms = models.ManyToManyField(Room, related_name='rentals')
@@ -412,6 +447,9 @@ class RoomRental(models.Model):
     def __str__(self):
         return f"Phiếu thuê của {self.customer} từ {self.check_in_date} đến {self.check_out_date}"
 
+    # Đổi ngày thuê → ngày thống kê cũ cũng phải tính lại
+    TRACKED_FIELDS = ('check_in_date', 'check_out_date')
+
     def clean(self):
         if self.check_in_date is None or self.check_out_date is None:
             return  # Không kiểm tra nếu thiếu dữ liệu ngày
@@ -499,30 +537,16 @@ class RoomRental(models.Model):
         """
         Tính giá cuối cùng dựa trên thời gian thực tế và số khách
         """
-        total_price = Decimal('0')
-        # Tính số ngày thực tế
-        actual_days = (self.check_out_date - self.check_in_date).days
-        if actual_days < 1:
-            actual_days = 1  # Tối thiểu 1 ngày
-
-        for room in self.rooms.all():
-            base_price = room.room_type.base_price
-            room_total = base_price * actual_days
-
-            # Tính phụ thu nếu vượt quá số khách tối đa
-            if self.guest_count > room.room_type.max_guests:
-                extra_guests = self.guest_count - room.room_type.max_guests
-                surcharge = base_price * (room.room_type.extra_guest_surcharge / 100) * extra_guests * actual_days
-                room_total += surcharge
+        from .pricing import quote_rooms, stay_days
 
-            total_price += room_total
-
-        return total_price
+        # Tính số ngày thực tế (tối thiểu 1 ngày)
+        actual_days = stay_days(self.check_in_date, self.check_out_date)
+        return quote_rooms(self.rooms.all(), self.guest_count, actual_days, check_in=self.check_in_date)['total_price']
 
 # Thanh toán
 # Được tạo khi khách check-out,Trường amount lưu tổng số tiền thanh toán cuối cùng, 
 # dựa trên total_price của RoomRental, có thể điều chỉnh thêm nếu áp dụng mã giảm giá (discount_code).
-class Payment(models.Model):
+class Payment(TrackedFieldsMixin, models.Model):
     PAYMENT_METHOD_CHOICES = (
         ('stripe', 'Stripe'),
         ('vnpay', 'VNPay'),
@@ -547,6 +571,9 @@ class Payment(models.Model):
             models.Index(fields=['transaction_id']),
         ]
 
+    # Doanh thu theo đêm (RevenueNight) chỉ đổi khi các trường này đổi
+    TRACKED_FIELDS = ('status', 'amount', 'rental_id')
+
     def save(self, *args, **kwargs):
         # Tự động gán customer từ rental nếu chưa có
         if not self.customer and self.rental:
@@ -562,6 +589,211 @@ class Payment(models.Model):
     def __str__(self):
         return f"Thanh toán {self.transaction_id} - {self.amount}"
 
+    def snapshot_lines(self):
+        """
+        Chụp các khoản phí (mỗi phòng một dòng) theo giá tại thời điểm check-out vào InvoiceLine,
+        để hóa đơn không phải tính lại khi đọc và không đổi khi giá RoomType thay đổi sau này
+        """
+        from .pricing import invoice_items
+
+        self.lines.all().delete()
+        lines = InvoiceLine.objects.bulk_create([
+            InvoiceLine(payment=self, **item) for item in invoice_items(self.rental)
+        ])
+        # Doanh thu từng đêm chia theo khoản phí → ghi lại theo các dòng vừa chụp
+        if self.status:
+            self.recognize_revenue()
+        return lines
+
+    def recognize_revenue(self):
+        """
+        Ghi lại doanh thu từng đêm (RevenueNight) của thanh toán: số tiền (sau giảm giá) chia cho các phòng
+        theo khoản phí hóa đơn (chia đều nếu chưa có InvoiceLine), rồi chia đều cho các đêm lưu trú.
+        Thanh toán chưa hoàn tất không có doanh thu.
+
+        Returns:
+            set: Các ngày có doanh thu thay đổi (trước và sau khi ghi)
+        """
+        from .inventory import local_date, stay_nights
+        from .rollup import split_amount
+
+        changed = set(self.revenue_nights.values_list('date', flat=True))
+        self.revenue_nights.all().delete()
+        if not self.status:
+            return changed
+
+        rental = self.rental
+        nights = stay_nights(rental.check_in_date, rental.check_out_date) or [local_date(rental.check_in_date)]
+        weights = [
+            ((line.room_id, line.room.room_type_id if line.room else None), line.subtotal)
+            for line in self.lines.select_related('room')
+        ] or [((room.id, room.room_type_id), 1) for room in rental.rooms.all()] or [((None, None), 1)]
+
+        RevenueNight.objects.bulk_create([
+            RevenueNight(payment=self, room_id=room_id, room_type_id=room_type_id, date=night, amount=amount)
+            for (room_id, room_type_id), share in split_amount(self.amount, weights)
+            for night, amount in split_amount(share, [(night, 1) for night in nights])
+        ])
+        return changed | set(nights)
+
+# Khoản phí của hóa đơn
+# Mỗi phòng của RoomRental một dòng, được ghi trong transaction check-out (Payment.snapshot_lines).
+# Lưu cả số phòng / tên loại phòng để hóa đơn vẫn đúng khi phòng bị đổi tên hoặc xóa.
+class InvoiceLine(models.Model):
+    payment = models.ForeignKey(Payment, on_delete=models.CASCADE, related_name='lines')
+    room = models.ForeignKey(Room, on_delete=models.SET_NULL, null=True, blank=True, related_name='invoice_lines')
+    room_number = models.CharField(max_length=50)
+    room_type = models.CharField(max_length=100)
+    guests = models.PositiveIntegerField(default=0)
+    days = models.PositiveIntegerField()
+    base_price = models.DecimalField(max_digits=10, decimal_places=2)  # Giá/đêm (trung bình nếu có giá theo mùa)
+    surcharge = models.DecimalField(max_digits=12, decimal_places=2, default=0)
+    subtotal = models.DecimalField(max_digits=12, decimal_places=2)
+
+    class Meta:
+        ordering = ['payment', 'id']
+
+    def __str__(self):
+        return f"Hóa đơn {self.payment_id} - Phòng {self.room_number}: {self.subtotal}"
+
+# Doanh thu ghi nhận theo đêm
+# Mỗi (thanh toán, phòng, đêm lưu trú) một dòng, ghi khi thanh toán hoàn tất (Payment.recognize_revenue).
+# Doanh thu của một khoảng ngày = tổng amount theo index (date, room_type), không phụ thuộc ngày tạo phiếu thuê.
+class RevenueNight(models.Model):
+    payment = models.ForeignKey(Payment, on_delete=models.CASCADE, related_name='revenue_nights')
+    room = models.ForeignKey(Room, on_delete=models.SET_NULL, null=True, blank=True, related_name='revenue_nights')
+    room_type = models.ForeignKey(RoomType, on_delete=models.SET_NULL, null=True, blank=True, related_name='revenue_nights')
+    date = models.DateField()  # Đêm lưu trú (giờ khách sạn)
+    amount = models.DecimalField(max_digits=12, decimal_places=2)
+
+    class Meta:
+        ordering = ['date', 'id']
+        indexes = [
+            models.Index(fields=['date', 'room_type']),
+        ]
+
+    def __str__(self):
+        return f"Doanh thu {self.date} - Thanh toán {self.payment_id}: {self.amount}"
+
+# Thống kê theo ngày (rollup)
+# Mỗi (ngày địa phương, loại phòng) một dòng; room_type rỗng = phần không gắn được với loại phòng nào.
+# Tổng các dòng của một ngày = số liệu toàn khách sạn. Booking / hủy / no-show được tính cho loại phòng
+# của phòng đầu tiên trong booking, doanh thu là tổng RevenueNight của đêm đó.
+# Được tính lại theo ngày bởi rollup.refresh_days (signals sau khi commit, lệnh backfill_daily_stats).
+class DailyStat(models.Model):
+    date = models.DateField()
+    room_type = models.ForeignKey(RoomType, on_delete=models.SET_NULL, null=True, blank=True, related_name='daily_stats')
+    occupied_room_nights = models.PositiveIntegerField(default=0)
+    bookings_created = models.PositiveIntegerField(default=0)
+    revenue = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    cancellations = models.PositiveIntegerField(default=0)  # Theo ngày nhận phòng
+    no_shows = models.PositiveIntegerField(default=0)  # Theo ngày nhận phòng
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        unique_together = ('date', 'room_type')
+        ordering = ['date', 'room_type']
+
+    def __str__(self):
+        return f"Thống kê {self.date} - {self.room_type or 'Không xác định'}"
+
+# Thống kê theo ngày của từng phòng (rollup)
+# Chỉ lưu các (ngày, phòng) có phòng-đêm thuê hoặc doanh thu; cùng được tính lại với DailyStat.
+class RoomDailyStat(models.Model):
+    date = models.DateField()
+    room = models.ForeignKey(Room, on_delete=models.CASCADE, related_name='daily_stats')
+    occupied_nights = models.PositiveIntegerField(default=0)
+    revenue = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+
+    class Meta:
+        unique_together = ('date', 'room')
+        ordering = ['date', 'room']
+
+    def __str__(self):
+        return f"Thống kê {self.date} - Phòng {self.room_id}"
+
+# Mốc xử lý của các tác vụ định kỳ (tasks.py)
+# Mỗi giai đoạn lưu thời điểm lần chạy thành công gần nhất; lần sau chỉ xét booking vượt ngưỡng từ mốc đó.
+class TaskWatermark(models.Model):
+    name = models.CharField(max_length=50, unique=True)
+    value = models.DateTimeField()
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"{self.name}: {self.value}"
+
+# Lease của tác vụ định kỳ (schedule.py): chỉ một instance chạy mỗi tác vụ tại một thời điểm.
+# token tăng mỗi lần cấp lease (fencing token); người giữ token cũ không commit được nữa.
+class TaskLock(models.Model):
+    name = models.CharField(max_length=50, unique=True)
+    owner = models.CharField(max_length=100, blank=True, default='')
+    token = models.PositiveBigIntegerField(default=0)
+    acquired_at = models.DateTimeField(null=True, blank=True)
+    expires_at = models.DateTimeField()
+
+    def __str__(self):
+        return f"{self.name} (token {self.token}, hết hạn {self.expires_at})"
+
+# Kết quả lần chạy tác vụ định kỳ
+class TaskRunStatus(models.TextChoices):
+    SUCCESS = 'success', 'Thành công'
+    FAILED = 'failed', 'Thất bại'
+    SKIPPED = 'skipped', 'Bỏ qua (instance khác đang chạy)'
+
+# Lịch sử chạy tác vụ định kỳ
+class TaskRun(models.Model):
+    name = models.CharField(max_length=50)
+    status = models.CharField(max_length=20, choices=TaskRunStatus.choices)
+    token = models.PositiveBigIntegerField(null=True, blank=True)  # Fencing token của lease
+    started_at = models.DateTimeField()
+    finished_at = models.DateTimeField()
+    duration_ms = models.FloatField(default=0)
+    rows_affected = models.PositiveIntegerField(default=0)
+    result = models.JSONField(default=dict, blank=True)
+    error = models.TextField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['name', 'started_at']),
+        ]
+
+    def __str__(self):
+        return f"{self.name} lúc {self.started_at} ({self.status})"
+
+# Trạng thái tác vụ nền
+class JobStatus(models.TextChoices):
+    PENDING = 'pending', 'Chờ chạy'
+    RUNNING = 'running', 'Đang chạy'
+    DONE = 'done', 'Hoàn tất'
+    FAILED = 'failed', 'Thất bại'
+
+# Tác vụ nền (jobs.py): signals ghi job khi commit, worker (manage.py run_worker) nhận và chạy.
+# dedup_key: mỗi key chỉ có tối đa một job đang chờ.
+class Job(models.Model):
+    name = models.CharField(max_length=100)
+    payload = models.JSONField(default=dict, blank=True)
+    dedup_key = models.CharField(max_length=200, null=True, blank=True)
+    # = dedup_key khi job đang chờ, NULL khi đã được nhận: unique thường (không điều kiện) nên MySQL cũng
+    # chặn hai job cùng key đang chờ
+    pending_key = models.CharField(max_length=200, null=True, blank=True, unique=True)
+    status = models.CharField(max_length=20, choices=JobStatus.choices, default=JobStatus.PENDING)
+    attempts = models.PositiveIntegerField(default=0)
+    max_attempts = models.PositiveIntegerField(default=5)
+    run_at = models.DateTimeField(default=timezone.now)  # Không chạy trước thời điểm này (backoff khi thử lại)
+    locked_by = models.CharField(max_length=100, null=True, blank=True)
+    locked_at = models.DateTimeField(null=True, blank=True)
+    last_error = models.TextField(null=True, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'run_at']),
+        ]
+
+    def __str__(self):
+        return f"Job #{self.id} {self.name} ({self.status})"
+
 # # Đánh giá
 # class Review(models.Model):
 #     rental = models.ForeignKey(RoomRental, on_delete=models.CASCADE, related_name='reviews')
@@ -48,15 +48,20 @@ class RoomPaginator(PageNumberPagination):
     page_query_param = 'page'
     last_page_strings = ['last']
 
+    def paginate_queryset(self, queryset, request, view=None):
+        # Giữ queryset đã lọc để thống kê theo đúng danh sách đang xem
+        self.queryset = queryset
+        return super().paginate_queryset(queryset, request, view)
+
     def get_paginated_response(self, data):
-        # Import Room model để tính thống kê
-        from .models import Room
-        
-        # Tính thống kê tổng từ toàn bộ queryset không phân trang
-        total_rooms = Room.objects.count()
-        available_rooms = Room.objects.filter(status='available').count()
-        booked_rooms = Room.objects.filter(status='booked').count()
-        occupied_rooms = Room.objects.filter(status='occupied').count()
+        from .room_stats import counts
+
+        # Một truy vấn GROUP BY status (có cache) trên queryset đã lọc, không phân trang
+        room_counts = counts(self.queryset)
+        total_rooms = sum(room_counts.values())
+        available_rooms = room_counts['available']
+        booked_rooms = room_counts['booked']
+        occupied_rooms = room_counts['occupied']
         
         return Response({
             'links': {
@@ -0,0 +1,378 @@
+"""
+Engine tính giá phòng dùng chung
+
+Một nơi duy nhất áp dụng quy tắc giá (trước đây lặp lại ở BookingSerializer, calculate_price,
+PaymentSerializer.get_items và các model):
+1. Sắp xếp phòng theo max_guests giảm dần (phòng lớn trước)
+2. Phân bổ khách tối đa cho mỗi phòng không vượt quá max_guests
+3. Khách dư chia đều cho các phòng và tính phụ thu extra_guest_surcharge (%) mỗi khách
+4. Giá mỗi đêm lấy theo RatePeriod (giá theo mùa) nếu đêm đó nằm trong một khoảng giá,
+   ngược lại là RoomType.base_price
+
+Bảng giá RoomType được giữ trong bộ nhớ mỗi process, kèm mảng giá từng đêm (đơn vị xu, int64)
+của mỗi loại phòng cho cửa sổ đặt phòng: tiền phòng của một lượt ở là tổng một lát cắt mảng,
+không cần truy vấn theo đêm. Làm mới khi RoomType / RatePeriod thay đổi (phiên bản "room_rates"
+trong cache dùng chung, xem signals.py); RatePeriod thay đổi chỉ dựng lại mảng của loại phòng đó.
+Kết quả phân bổ khách được memo theo (dãy loại phòng, số khách).
+Lịch giá (loại phòng x ngày x số khách) được tính bằng mảng NumPy trên đơn vị xu (số nguyên)
+và chỉ đổi về số thập phân 2 chữ số (chuỗi, chính xác) ở đầu ra, memo tới khi bảng giá đổi phiên bản.
+"""
+import threading
+from collections import namedtuple
+from datetime import datetime, timedelta
+from decimal import ROUND_HALF_UP, Decimal
+from functools import lru_cache
+
+import numpy as np
+from django.db import transaction
+from django.utils import timezone
+
+from .cache_utils import bump_version, get_version
+
+VERSION_NAME = 'room_rates'
+
+# Cửa sổ của mảng giá từng đêm: bằng cửa sổ chỉ mục phòng trống (28 ngày đặt trước + lưu trú)
+HORIZON_DAYS = 60
+
+Rate = namedtuple('Rate', ['room_type_id', 'name', 'base_price', 'max_guests', 'surcharge_rate'])
+
+
+def _to_cents(amount):
+    return int(amount * 100)
+
+
+def _from_cents(cents):
+    return Decimal(int(cents)).scaleb(-2)
+
+
+def _local_date(value):
+    from .inventory import local_date
+
+    return local_date(value) if isinstance(value, datetime) else value
+
+
+class RateTable:
+    """Bảng giá RoomType theo id và mảng giá từng đêm, nạp một lần cho mỗi phiên bản"""
+
+    def __init__(self, horizon_days=HORIZON_DAYS):
+        self.horizon_days = horizon_days
+        self._lock = threading.RLock()
+        # (ngày đầu cửa sổ, {loại phòng: Rate}, {loại phòng: mảng giá từng đêm}): dựng bản mới rồi thay cả
+        # tuple một lần, không sửa tại chỗ → luồng đọc lấy một bản ở đầu mỗi lần gọi, luôn nhất quán
+        self._state = (None, {}, {})
+        self._version = None
+
+    # ----- Dựng / làm mới -----
+
+    def _today(self):
+        return _local_date(timezone.now())
+
+    def _load_rates(self, room_type_ids=None):
+        from .models import RoomType
+
+        queryset = RoomType.objects.all()
+        if room_type_ids is not None:
+            queryset = queryset.filter(pk__in=room_type_ids)
+        return {
+            room_type_id: Rate(room_type_id, name, base_price, max_guests, Decimal(surcharge) / 100)
+            for room_type_id, name, base_price, max_guests, surcharge in queryset.values_list(
+                'id', 'name', 'base_price', 'max_guests', 'extra_guest_surcharge'
+            )
+        }
+
+    def _period_cents(self, type_rates, start_date, nights):
+        """
+        Mảng giá từng đêm [start_date, start_date + nights) cho các loại phòng:
+        khởi tạo bằng base_price rồi ghi đè bởi RatePeriod (khoảng tạo sau ghi đè sau). Một truy vấn.
+        """
+        from .models import RatePeriod
+
+        arrays = {
+            rate.room_type_id: np.full(nights, _to_cents(rate.base_price), dtype=np.int64)
+            for rate in type_rates
+        }
+        if not arrays:
+            return arrays
+
+        periods = RatePeriod.objects.filter(
+            room_type_id__in=arrays,
+            start_date__lt=start_date + timedelta(days=nights),
+            end_date__gte=start_date,
+        ).order_by('pk').values_list('room_type_id', 'start_date', 'end_date', 'price')
+        for room_type_id, period_start, period_end, price in periods:
+            lo = max((period_start - start_date).days, 0)
+            hi = min((period_end - start_date).days + 1, nights)
+            arrays[room_type_id][lo:hi] = _to_cents(price)
+        return arrays
+
+    def reload(self, version=None):
+        with self._lock:
+            version = get_version(VERSION_NAME) if version is None else version
+            # Bắt đầu từ hôm qua để phủ các lượt ở đang diễn ra
+            start = self._today() - timedelta(days=1)
+            type_rates = self._load_rates()
+            self._state = (start, type_rates, self._period_cents(type_rates.values(), start, self.horizon_days))
+            self._version = version
+            _allocate.cache_clear()
+            _calendar.cache_clear()
+
+    def ensure_fresh(self):
+        version = get_version(VERSION_NAME)
+        if version != self._version or self._state[0] != self._today() - timedelta(days=1):
+            self.reload(version)
+
+    def refresh_types(self, room_type_ids):
+        """Nạp lại giá và mảng giá từng đêm của các loại phòng vừa thay đổi (trong chính worker này)"""
+        room_type_ids = set(room_type_ids)
+        if not room_type_ids:
+            return
+        with self._lock:
+            start, current_rates, current_nightly = self._state
+            if start is None:
+                return
+            type_rates = self._load_rates(room_type_ids)
+            new_rates = {key: rate for key, rate in current_rates.items() if key not in room_type_ids}
+            new_rates.update(type_rates)
+            nightly = {key: array for key, array in current_nightly.items() if key not in room_type_ids}
+            nightly.update(self._period_cents(type_rates.values(), start, self.horizon_days))
+            self._state = (start, new_rates, nightly)
+            _calendar.cache_clear()
+
+    def types_changed(self, room_type_ids):
+        """
+        Ghi nhận thay đổi giá theo mùa: dựng lại mảng của các loại phòng đó và tăng phiên bản
+        để các worker khác nạp lại. Nếu phiên bản mới chỉ hơn phiên bản đang giữ 1 đơn vị thì
+        không có ai khác ghi xen vào → giữ nguyên bảng đã cập nhật.
+        """
+        self.refresh_types(room_type_ids)
+        new_version = bump_version(VERSION_NAME)
+        with self._lock:
+            if self._version is not None and new_version == self._version + 1:
+                self._version = new_version
+
+    def invalidate(self):
+        """
+        Gọi khi RoomType thay đổi: process hiện tại nạp lại ngay ở lần tính giá kế tiếp,
+        các worker khác nạp lại sau khi transaction commit (tăng phiên bản dùng chung)
+        """
+        with self._lock:
+            self._version = None
+        transaction.on_commit(lambda: bump_version(VERSION_NAME))
+
+    # ----- Truy vấn -----
+
+    def get(self, room_type_id):
+        rate = self._state[1].get(room_type_id)
+        if rate is None:
+            # Loại phòng vừa tạo ở worker khác mà chưa thấy phiên bản mới
+            self.reload()
+            rate = self._state[1][room_type_id]
+        return rate
+
+    def all(self):
+        """Mọi loại phòng, theo id"""
+        return sorted(self._state[1].values(), key=lambda rate: rate.room_type_id)
+
+    def nightly_cents(self, room_type_id, start_date, nights):
+        """
+        Giá từng đêm (xu) của loại phòng cho [start_date, start_date + nights).
+        Trong cửa sổ: lát cắt mảng dựng sẵn; ngoài cửa sổ (vd. hóa đơn lượt ở cũ): một truy vấn RatePeriod.
+        """
+        window_start, _, nightly = self._state
+        array = nightly.get(room_type_id)
+        if array is not None:
+            offset = (start_date - window_start).days
+            if offset >= 0 and offset + nights <= self.horizon_days:
+                return array[offset:offset + nights]
+        return self._period_cents([self.get(room_type_id)], start_date, nights)[room_type_id]
+
+    def stay_total(self, room_type_id, check_in, nights):
+        """
+        Tổng giá cơ bản (chưa phụ thu) của một phòng cho lượt ở bắt đầu từ check_in (ngày hoặc giờ
+        nhận phòng); check_in=None: base_price x số đêm
+        """
+        if check_in is None:
+            return self.get(room_type_id).base_price * nights
+        return _from_cents(self.nightly_cents(room_type_id, _local_date(check_in), nights).sum())
+
+
+rates = RateTable()
+
+
+def stay_days(check_in, check_out):
+    """Số đêm tính tiền (tối thiểu 1)"""
+    return max((check_out - check_in).days, 1)
+
+
+@lru_cache(maxsize=4096)
+def _allocate(room_type_ids, guest_count):
+    """
+    Phân bổ khách cho dãy loại phòng (đã sắp phòng lớn trước).
+    Trả về (số khách mỗi phòng, số khách vượt sức chứa mỗi phòng).
+    """
+    type_rates = [rates.get(room_type_id) for room_type_id in room_type_ids]
+
+    allocation = []
+    remaining = guest_count
+    for rate in type_rates:
+        allocated = min(remaining, rate.max_guests)
+        allocation.append(allocated)
+        remaining -= allocated
+
+    if remaining > 0:
+        base_extra, extra_remainder = divmod(remaining, len(type_rates))
+        for i in range(len(type_rates)):
+            allocation[i] += base_extra + (1 if i < extra_remainder else 0)
+
+    excess = [max(room_guests - rate.max_guests, 0) for rate, room_guests in zip(type_rates, allocation)]
+    return tuple(allocation), tuple(excess)
+
+
+def _quote(rooms, guest_count, nights, check_in=None):
+    rooms = list(rooms)
+    if not rooms or guest_count <= 0 or nights <= 0:
+        return {'total_price': Decimal('0'), 'rooms': [], 'guest_allocation': [], 'calculation_details': []}
+
+    start_date = _local_date(check_in) if check_in is not None else None
+    sorted_rooms = sorted(rooms, key=lambda room: rates.get(room.room_type_id).max_guests, reverse=True)
+    allocation, excess = _allocate(tuple(room.room_type_id for room in sorted_rooms), guest_count)
+
+    total_price = Decimal('0')
+    base_totals = {}
+    calculation_details = []
+    for room, room_guests, excess_guests in zip(sorted_rooms, allocation, excess):
+        rate = rates.get(room.room_type_id)
+        if rate.room_type_id not in base_totals:
+            base_totals[rate.room_type_id] = rates.stay_total(rate.room_type_id, start_date, nights)
+        base_total = base_totals[rate.room_type_id]
+        total_room_price = base_total + base_total * rate.surcharge_rate * excess_guests
+        total_price += total_room_price
+        calculation_details.append({
+            'room_id': room.pk,
+            'room_number': room.room_number,
+            'room_type': rate.name,
+            'guests': room_guests,
+            'max_guests': rate.max_guests,
+            'excess_guests': excess_guests,
+            # Giá theo mùa có thể khác nhau giữa các đêm → giá/đêm là trung bình của lượt ở
+            'base_price': (base_total / nights).quantize(Decimal('0.01'), rounding=ROUND_HALF_UP),
+            'base_total': base_total,
+            'room_price_per_day': (total_room_price / nights).quantize(Decimal('0.01'), rounding=ROUND_HALF_UP),
+            'total_room_price': total_room_price,
+        })
+
+    return {
+        'total_price': total_price,
+        'rooms': sorted_rooms,
+        'guest_allocation': list(allocation),
+        'calculation_details': calculation_details,
+    }
+
+
+def quote_rooms(rooms, guest_count, nights, check_in=None, check_version=True):
+    """
+    Tính giá cho một nhóm phòng.
+
+    Args:
+        rooms: Các Room (chỉ cần room_type_id, không cần nạp room_type)
+        guest_count: Tổng số khách
+        nights: Số đêm lưu trú
+        check_in: Ngày/giờ nhận phòng để áp giá theo mùa (None: giá cơ bản mọi đêm)
+        check_version: False khi người gọi đã rates.ensure_fresh() (vòng lặp tính nhiều tổ hợp)
+
+    Returns:
+        dict: {
+            'total_price': Decimal,
+            'rooms': list (đã sắp phòng lớn trước),
+            'guest_allocation': list,
+            'calculation_details': list
+        }
+    """
+    if check_version:
+        rates.ensure_fresh()
+    return _quote(rooms, guest_count, nights, check_in)
+
+
+def quote_batch(items):
+    """
+    Tính giá cho nhiều nhóm (rooms, nights, guest_count, check_in) trong một lần gọi:
+    kiểm tra phiên bản bảng giá một lần, các nhóm trùng cấu hình dùng lại kết quả memo.
+    """
+    rates.ensure_fresh()
+    return [_quote(rooms, guest_count, nights, check_in) for rooms, nights, guest_count, check_in in items]
+
+
+def invoice_items(rental):
+    """
+    Các khoản phí của một RoomRental (mỗi phòng một dòng) theo đúng quy tắc tính giá,
+    dạng dict trùng tên trường với InvoiceLine
+    """
+    cents = Decimal('0.01')
+    days = stay_days(rental.check_in_date, rental.check_out_date)
+    quote = quote_rooms(rental.rooms.all(), rental.guest_count, days, check_in=rental.check_in_date)
+    return [
+        {
+            'room_id': line['room_id'],
+            'room_number': line['room_number'],
+            'room_type': line['room_type'],
+            'guests': line['guests'],
+            'days': days,
+            'base_price': line['base_price'],
+            'surcharge': (line['total_room_price'] - line['base_total']).quantize(cents, rounding=ROUND_HALF_UP),
+            'subtotal': line['total_room_price'].quantize(cents, rounding=ROUND_HALF_UP),
+        }
+        for line in quote['calculation_details']
+    ]
+
+
+def price_calendar(start_date, days):
+    """
+    Lịch giá một phòng mỗi đêm cho mọi loại phòng, mọi ngày trong [start_date, start_date + days)
+    và mọi số khách từ 1 tới 150% sức chứa (có phụ thu).
+
+    Returns:
+        dict: {
+            'start_date': date,
+            'dates': list[date],
+            'room_types': [{'id', 'name', 'max_guests', 'max_allowed_guests',
+                            'prices': {số khách: [giá theo ngày, chuỗi 2 chữ số thập phân]}}]
+        }
+    """
+    rates.ensure_fresh()
+    return _calendar(start_date, days)
+
+
+@lru_cache(maxsize=64)
+def _calendar(start_date, days):
+    from .allocation import max_allowed_guests
+
+    type_rates = rates.all()
+    dates = [start_date + timedelta(days=offset) for offset in range(days)]
+    if not type_rates:
+        return {'start_date': start_date, 'dates': dates, 'room_types': []}
+
+    # Giá tính bằng xu, phụ thu bằng phần vạn → số học số nguyên chính xác
+    nightly = np.stack([rates.nightly_cents(rate.room_type_id, start_date, days) for rate in type_rates])
+    surcharge_bp = np.array([int(rate.surcharge_rate * 10000) for rate in type_rates], dtype=np.int64)
+    max_guests = np.array([rate.max_guests for rate in type_rates], dtype=np.int64)
+    allowed = np.array([max_allowed_guests(rate.max_guests) for rate in type_rates], dtype=np.int64)
+
+    guests = np.arange(1, int(allowed.max()) + 1, dtype=np.int64)
+    excess = np.maximum(guests[None, :] - max_guests[:, None], 0)                  # (loại, khách)
+    factor = 10000 + surcharge_bp[:, None] * excess                                # (loại, khách)
+    grid = nightly[:, :, None] * factor[:, None, :]                                # (loại, ngày, khách), xu x 10^4
+    grid = (grid + 5000) // 10000                                                  # làm tròn nửa lên
+
+    room_types = []
+    for i, rate in enumerate(type_rates):
+        room_types.append({
+            'id': rate.room_type_id,
+            'name': rate.name,
+            'max_guests': rate.max_guests,
+            'max_allowed_guests': int(allowed[i]),
+            'prices': {
+                int(guest_count): [f'{cents // 100}.{cents % 100:02d}' for cents in grid[i, :, g].tolist()]
+                for g, guest_count in enumerate(guests[:allowed[i]])
+            },
+        })
+    return {'start_date': start_date, 'dates': dates, 'room_types': room_types}
@@ -0,0 +1,257 @@
+"""
+Bảng thống kê theo ngày (DailyStat)
+
+Thay vì quét Booking / RoomRental / Payment mỗi lần xem thống kê, số liệu được gom sẵn theo
+(ngày địa phương, loại phòng): phòng-đêm đã thuê, booking tạo mới, doanh thu (theo đêm lưu trú,
+xem RevenueNight), hủy, no-show. RoomDailyStat giữ phòng-đêm thuê và doanh thu theo từng phòng.
+
+- Khi dữ liệu gốc thay đổi, signals đánh dấu các ngày bị ảnh hưởng; sau khi transaction commit
+  các ngày đó được tính lại từ dữ liệu gốc (vài truy vấn cho cả cụm ngày) và ghi đè.
+- Lệnh backfill_daily_stats tính lại cả một khoảng ngày theo từng cụm.
+- Ngày được tính theo giờ khách sạn (inventory.HOTEL_TIMEZONE), gom nhóm bằng Python để
+  không phụ thuộc bảng múi giờ của DB.
+"""
+from collections import defaultdict
+from datetime import datetime, time, timedelta
+from decimal import ROUND_HALF_UP, Decimal
+
+from django.db import IntegrityError, transaction
+from django.db.models import F, Sum
+from django.db.models.functions import TruncMonth, TruncWeek
+
+from .inventory import HOTEL_TIMEZONE, local_date, stay_nights
+from .models import Booking, BookingStatus, DailyStat, RevenueNight, RoomDailyStat, RoomRental
+
+METRICS = ('occupied_room_nights', 'bookings_created', 'revenue', 'cancellations', 'no_shows')
+
+# Các ngày bẩn cách nhau quá khoảng này được tính thành cụm riêng
+CLUSTER_GAP_DAYS = 7
+
+# Số ngày mỗi cụm khi backfill
+BACKFILL_CHUNK_DAYS = 31
+
+
+def day_start(day):
+    """Thời điểm 00:00 (giờ khách sạn) của ngày"""
+    return HOTEL_TIMEZONE.localize(datetime.combine(day, time.min))
+
+
+def _empty_metrics():
+    metrics = dict.fromkeys(METRICS, 0)
+    metrics['revenue'] = Decimal('0')
+    return metrics
+
+
+def _first_room_types(rows):
+    """
+    Gom các dòng (booking_id, thời điểm, room_id, room_type_id, ...) của phép join booking-phòng:
+    mỗi booking lấy loại phòng của phòng có id nhỏ nhất (None nếu booking chưa có phòng).
+    """
+    bookings = {}
+    for booking_id, moment, room_id, room_type_id, *extra in rows:
+        current = bookings.get(booking_id)
+        if current is None or (room_id is not None and (current[1] is None or room_id < current[1])):
+            bookings[booking_id] = (moment, room_id, room_type_id, *extra)
+    return bookings
+
+
+def split_amount(amount, weights):
+    """Chia amount theo trọng số [(key, weight)], phần dư làm tròn dồn vào phần tử cuối"""
+    total_weight = sum(weight for _, weight in weights)
+    if not total_weight:
+        weights, total_weight = [(key, 1) for key, _ in weights], len(weights)
+    shares = []
+    remaining = amount
+    for i, (key, weight) in enumerate(weights):
+        if i == len(weights) - 1:
+            share = remaining
+        else:
+            share = (amount * Decimal(weight) / Decimal(total_weight)).quantize(Decimal('0.01'), rounding=ROUND_HALF_UP)
+        remaining -= share
+        shares.append((key, share))
+    return shares
+
+
+def compute_days(start, end):
+    """
+    Tính số liệu cho các ngày [start, end) từ dữ liệu gốc.
+    Trả về (theo loại phòng, theo phòng):
+    {(date, room_type_id): {metric: value}} và {(date, room_id): {'occupied_nights', 'revenue'}}
+    (chỉ các cặp có số liệu).
+    """
+    lo, hi = day_start(start), day_start(end)
+    stats = defaultdict(_empty_metrics)
+    room_stats = defaultdict(lambda: {'occupied_nights': 0, 'revenue': Decimal('0')})
+
+    def add(day, room_type_id, metric, value=1, room_id=None, room_metric=None):
+        if start <= day < end:
+            stats[(day, room_type_id)][metric] += value
+            if room_id is not None:
+                room_stats[(day, room_id)][room_metric] += value
+
+    # Booking tạo mới (theo ngày tạo)
+    created = Booking.objects.filter(created_at__gte=lo, created_at__lt=hi).values_list(
+        'id', 'created_at', 'room_links__room_id', 'room_links__room__room_type_id'
+    )
+    for created_at, _, room_type_id in _first_room_types(created).values():
+        add(local_date(created_at), room_type_id, 'bookings_created')
+
+    # Hủy / không xuất hiện (theo ngày nhận phòng)
+    lost = Booking.objects.filter(
+        status__in=[BookingStatus.CANCELLED, BookingStatus.NO_SHOW], check_in_date__gte=lo, check_in_date__lt=hi
+    ).values_list('id', 'check_in_date', 'room_links__room_id', 'room_links__room__room_type_id', 'status')
+    for check_in, _, room_type_id, booking_status in _first_room_types(lost).values():
+        metric = 'cancellations' if booking_status == BookingStatus.CANCELLED else 'no_shows'
+        add(local_date(check_in), room_type_id, metric)
+
+    # Phòng-đêm đã thuê
+    rental_rooms = RoomRental.rooms.through.objects.filter(
+        roomrental__check_in_date__lt=hi, roomrental__check_out_date__gt=lo
+    ).values_list('roomrental__check_in_date', 'roomrental__check_out_date', 'room_id', 'room__room_type_id')
+    for check_in, check_out, room_id, room_type_id in rental_rooms:
+        for night in stay_nights(check_in, check_out):
+            add(night, room_type_id, 'occupied_room_nights', room_id=room_id, room_metric='occupied_nights')
+
+    # Doanh thu ghi nhận theo đêm lưu trú (RevenueNight)
+    for night, room_id, room_type_id, amount in RevenueNight.objects.filter(date__gte=start, date__lt=end).values(
+        'date', 'room_id', 'room_type_id'
+    ).annotate(total=Sum('amount')).values_list('date', 'room_id', 'room_type_id', 'total'):
+        add(night, room_type_id, 'revenue', amount, room_id=room_id, room_metric='revenue')
+
+    return stats, room_stats
+
+
+def _clusters(days):
+    """Tách các ngày (đã sắp xếp) thành cụm liền nhau để mỗi lần tính chỉ quét khoảng ngắn"""
+    cluster = [days[0]]
+    for day in days[1:]:
+        if (day - cluster[-1]).days > CLUSTER_GAP_DAYS:
+            yield cluster
+            cluster = []
+        cluster.append(day)
+    yield cluster
+
+
+def refresh_days(days):
+    """Tính lại và ghi đè các dòng DailyStat / RoomDailyStat của các ngày đã cho"""
+    days = sorted(set(days))
+    if not days:
+        return
+    for cluster in _clusters(days):
+        wanted = set(cluster)
+        # Hai worker cùng tính một ngày: bên ghi sau gặp unique (date, room_type) → tính lại một lần
+        for attempt in range(2):
+            stats, room_stats = compute_days(cluster[0], cluster[-1] + timedelta(days=1))
+            rows = [
+                DailyStat(date=day, room_type_id=room_type_id, **metrics)
+                for (day, room_type_id), metrics in stats.items()
+                if day in wanted
+            ]
+            room_rows = [
+                RoomDailyStat(date=day, room_id=room_id, **metrics)
+                for (day, room_id), metrics in room_stats.items()
+                if day in wanted
+            ]
+            try:
+                with transaction.atomic():
+                    DailyStat.objects.filter(date__in=cluster).delete()
+                    DailyStat.objects.bulk_create(rows)
+                    RoomDailyStat.objects.filter(date__in=cluster).delete()
+                    RoomDailyStat.objects.bulk_create(room_rows)
+                break
+            except IntegrityError:
+                if attempt:
+                    raise
+
+
+def mark_dirty(days):
+    """Đánh dấu các ngày cần tính lại; thực hiện khi transaction hiện tại commit"""
+    days = {day for day in days if day is not None}
+    if days:
+        transaction.on_commit(lambda: refresh_days(days))
+
+
+def backfill(start, end):
+    """Tính lại DailyStat / RoomDailyStat cho [start, end) theo từng cụm BACKFILL_CHUNK_DAYS ngày; trả về số cụm"""
+    chunks = 0
+    while start < end:
+        chunk_end = min(start + timedelta(days=BACKFILL_CHUNK_DAYS), end)
+        refresh_days([start + timedelta(days=i) for i in range((chunk_end - start).days)])
+        start = chunk_end
+        chunks += 1
+    return chunks
+
+
+# ----- Ngày bị ảnh hưởng bởi từng loại bản ghi -----
+
+def booking_days(check_in_date, created_at):
+    return {local_date(value) for value in (check_in_date, created_at) if value is not None}
+
+
+def rental_days(check_in_date, check_out_date):
+    if check_in_date is None or check_out_date is None:
+        return set()
+    return set(stay_nights(check_in_date, check_out_date))
+
+
+# ----- Đọc -----
+
+def totals(start, end, **filters):
+    """Tổng các chỉ số trong [start, end)"""
+    result = DailyStat.objects.filter(date__gte=start, date__lt=end, **filters).aggregate(
+        **{metric: Sum(metric) for metric in METRICS}
+    )
+    return {metric: value or 0 for metric, value in result.items()}
+
+
+def period_start(day, granularity):
+    """Ngày đầu kỳ (ngày / tuần bắt đầu thứ Hai / tháng) chứa day"""
+    if granularity == 'week':
+        return day - timedelta(days=day.weekday())
+    if granularity == 'month':
+        return day.replace(day=1)
+    return day
+
+
+def next_period(start, granularity):
+    """Ngày đầu kỳ kế tiếp"""
+    if granularity == 'week':
+        return start + timedelta(days=7)
+    if granularity == 'month':
+        return (start + timedelta(days=32)).replace(day=1)
+    return start + timedelta(days=1)
+
+
+def periods(start, end, granularity):
+    """Các kỳ phủ [start, end): [(đầu kỳ, số ngày của kỳ nằm trong khoảng)]"""
+    result = []
+    period = period_start(start, granularity)
+    while period < end:
+        following = next_period(period, granularity)
+        result.append((period, (min(following, end) - max(period, start)).days))
+        period = following
+    return result
+
+
+def period_totals(start, end, granularity, **filters):
+    """Tổng các chỉ số theo kỳ (day / week / month) trong [start, end), một truy vấn: {đầu kỳ: {metric: value}}"""
+    queryset = DailyStat.objects.filter(date__gte=start, date__lt=end, **filters)
+    if granularity == 'day':
+        queryset = queryset.annotate(period=F('date'))
+    else:
+        queryset = queryset.annotate(period=(TruncWeek if granularity == 'week' else TruncMonth)('date'))
+    rows = queryset.values('period').annotate(**{metric: Sum(metric) for metric in METRICS}).order_by('period')
+    return {row.pop('period'): {metric: value or 0 for metric, value in row.items()} for row in rows}
+
+
+def monthly_totals(start, end, **filters):
+    """Tổng các chỉ số theo tháng trong [start, end): {date đầu tháng: {metric: value}}"""
+    return period_totals(start, end, 'month', **filters)
+
+
+def room_totals(start, end, **filters):
+    """Tổng phòng-đêm thuê và doanh thu của từng phòng trong [start, end), một truy vấn: {room_id: {...}}"""
+    rows = RoomDailyStat.objects.filter(date__gte=start, date__lt=end, **filters).values('room_id').annotate(
+        occupied_nights=Sum('occupied_nights'), revenue=Sum('revenue')
+    ).order_by()
+    return {row.pop('room_id'): row for row in rows}
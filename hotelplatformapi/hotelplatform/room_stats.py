@@ -0,0 +1,49 @@
+"""
+Số phòng theo trạng thái (TaskStatusView, thống kê của RoomPaginator)
+
+- Một truy vấn GROUP BY status cho cả queryset (có thể đã lọc theo trạng thái / loại phòng / tìm kiếm)
+  thay vì một COUNT cho mỗi trạng thái.
+- Kết quả cache ngắn hạn theo (phiên bản "room_status", SQL của queryset). Lưu / xóa Room (signals) và
+  các câu UPDATE trạng thái của tác vụ định kỳ tăng phiên bản sau khi commit.
+"""
+import hashlib
+
+from django.core.cache import cache
+from django.core.exceptions import EmptyResultSet
+from django.db import transaction
+from django.db.models import Count
+
+from .cache_utils import bump_version, get_version
+from .models import Room
+
+VERSION_NAME = 'room_status'
+KEY_PREFIX = 'hotelplatform:room_status:'
+
+# Cập nhật trạng thái không qua save() / signals vẫn được phản ánh sau khoảng này
+CACHE_TIMEOUT = 60
+
+# 'maintenance' không nằm trong ROOM_STATUS nhưng có thể có trong DB và được TaskStatusView báo cáo
+STATUSES = [value for value, _ in Room.ROOM_STATUS] + ['maintenance']
+
+
+def invalidate():
+    """Đánh dấu số liệu đã cũ; thực hiện khi transaction hiện tại commit"""
+    transaction.on_commit(lambda: bump_version(VERSION_NAME))
+
+
+def counts(queryset=None):
+    """{trạng thái: số phòng} của queryset (mặc định toàn bộ phòng), đủ mọi trạng thái"""
+    queryset = (Room.objects.all() if queryset is None else queryset).order_by()
+    try:
+        sql, params = queryset.query.sql_with_params()
+    except EmptyResultSet:
+        return dict.fromkeys(STATUSES, 0)
+
+    digest = hashlib.sha1(f'{sql}|{params}'.encode()).hexdigest()
+    key = f'{KEY_PREFIX}{get_version(VERSION_NAME)}:{digest}'
+    data = cache.get(key)
+    if data is None:
+        data = dict.fromkeys(STATUSES, 0)
+        data.update(queryset.values_list('status').annotate(total=Count('id')))
+        cache.set(key, data, CACHE_TIMEOUT)
+    return data
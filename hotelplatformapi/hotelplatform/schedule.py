@@ -0,0 +1,135 @@
+"""
+Lease và lịch sử chạy cho tác vụ định kỳ (nhiều instance web / cron gọi chồng nhau)
+
+- Lease (TaskLock): cấp bằng một câu UPDATE có điều kiện "đã hết hạn" nên chỉ một bên thắng;
+  mỗi lần cấp tăng token (fencing token). Lease tự hết hạn sau ttl nếu instance giữ nó bị chết.
+- Tác vụ chạy trong một transaction; trước khi commit, dòng lease được khóa (SELECT ... FOR UPDATE)
+  và kiểm tra token vẫn là của mình. Chạy quá ttl và bên khác đã lấy lease → rollback toàn bộ,
+  không có chuyện hai bên cùng xử lý một no-show.
+- Mỗi lần chạy thật (thành công / lỗi) ghi một TaskRun: thời gian, số dòng bị ảnh hưởng, kết quả.
+  Lần bị bỏ qua vì instance khác giữ lease không ghi (cron gọi dày sẽ làm bảng phình ra); TaskRun cũ hơn
+  KEEP_RUNS bị xóa mỗi lần ghi. status() đọc lần chạy gần nhất để TaskStatusView báo cáo và phát hiện
+  scheduler ngừng chạy.
+"""
+import os
+import socket
+import time
+import uuid
+from contextlib import contextmanager
+from datetime import timedelta
+
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+
+from .models import TaskLock, TaskRun, TaskRunStatus
+
+# Thời hạn lease mặc định; tác vụ chạy lâu hơn sẽ bị rollback khi commit
+LEASE_TTL = timedelta(minutes=10)
+
+# Thời gian giữ lịch sử chạy
+KEEP_RUNS = timedelta(days=30)
+
+
+class LeaseHeld(Exception):
+    """Instance khác đang giữ lease"""
+
+
+class LeaseLost(Exception):
+    """Lease đã hết hạn và được cấp cho bên khác trong lúc tác vụ đang chạy"""
+
+
+def owner_name():
+    return f'{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}'
+
+
+def acquire(name, owner, ttl=LEASE_TTL):
+    """Lấy lease name; trả về fencing token, hoặc None nếu lease đang được giữ"""
+    now = timezone.now()
+    TaskLock.objects.get_or_create(name=name, defaults={'expires_at': now})
+    acquired = TaskLock.objects.filter(name=name, expires_at__lte=now).update(
+        owner=owner, token=F('token') + 1, acquired_at=now, expires_at=now + ttl
+    )
+    if not acquired:
+        return None
+    return TaskLock.objects.filter(name=name, owner=owner).values_list('token', flat=True).first()
+
+
+def verify(name, token):
+    """Khóa dòng lease tới hết transaction hiện tại và kiểm tra token còn hiệu lực; không → LeaseLost"""
+    held = TaskLock.objects.select_for_update().filter(
+        name=name, token=token, expires_at__gt=timezone.now()
+    ).exists()
+    if not held:
+        raise LeaseLost(f'Lease {name} (token {token}) đã hết hạn')
+
+
+def release(name, token):
+    TaskLock.objects.filter(name=name, token=token).update(owner='', expires_at=timezone.now())
+
+
+@contextmanager
+def lease(name, ttl=LEASE_TTL):
+    """Giữ lease trong khối with; trả về token. Lease đang bị giữ → LeaseHeld"""
+    token = acquire(name, owner_name(), ttl)
+    if token is None:
+        raise LeaseHeld(f'Tác vụ {name} đang chạy ở instance khác')
+    try:
+        yield token
+    finally:
+        release(name, token)
+
+
+def run(name, func, rows_affected=None, ttl=LEASE_TTL):
+    """
+    Chạy func() dưới lease name trong một transaction và ghi TaskRun.
+
+    Args:
+        rows_affected: Hàm tính số dòng bị ảnh hưởng từ kết quả của func
+
+    Returns:
+        TaskRun: status SKIPPED (không lưu) nếu instance khác đang giữ lease.
+        Lỗi của func (và LeaseLost) được ghi lại rồi raise tiếp.
+    """
+    started_at = timezone.now()
+    started = time.perf_counter()
+    record = TaskRun(name=name, started_at=started_at)
+    try:
+        with lease(name, ttl) as token:
+            record.token = token
+            with transaction.atomic():
+                result = func()
+                verify(name, token)
+    except LeaseHeld:
+        record.status = TaskRunStatus.SKIPPED
+        return record
+    except Exception as e:
+        record.status = TaskRunStatus.FAILED
+        record.error = f'{type(e).__name__}: {e}'
+        _finish(record, started)
+        raise
+    else:
+        record.status = TaskRunStatus.SUCCESS
+        record.result = result
+        record.rows_affected = rows_affected(result) if rows_affected else 0
+    _finish(record, started)
+    return record
+
+
+def _finish(record, started):
+    record.duration_ms = round((time.perf_counter() - started) * 1000, 1)
+    record.finished_at = timezone.now()
+    record.save()
+    TaskRun.objects.filter(name=record.name, started_at__lt=record.started_at - KEEP_RUNS).delete()
+
+
+def status(name, stale_after):
+    """Lần chạy gần nhất, lần thành công gần nhất và cờ stale (không thành công trong stale_after)"""
+    runs = TaskRun.objects.filter(name=name).order_by('-started_at')
+    last = runs.values('status', 'started_at', 'duration_ms', 'rows_affected', 'error').first()
+    last_success_at = runs.filter(status=TaskRunStatus.SUCCESS).values_list('finished_at', flat=True).first()
+    return {
+        'last_run': last,
+        'last_success_at': last_success_at,
+        'stale': last_success_at is None or last_success_at < timezone.now() - stale_after,
+    }
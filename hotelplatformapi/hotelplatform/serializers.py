@@ -2,14 +2,16 @@ from datetime import timedelta
 from rest_framework import serializers
 from rest_framework.serializers import ModelSerializer
 from rest_framework.exceptions import ValidationError
+from rest_framework.relations import MANY_RELATION_KWARGS
 from .models import (
     User, RoomType, Room, Booking, RoomRental, Payment, DiscountCode, Notification, RoomImage
 )
-from django.db import transaction
+from django.db import IntegrityError, transaction
 from django.utils import timezone
 from django.db.models import F
 from decimal import Decimal, ROUND_HALF_UP
 from cloudinary.utils import cloudinary_url
+from . import inventory, pricing
 
 
 # Serializer cho RoomImage
@@ -222,19 +224,55 @@ class UserListSerializer(ModelSerializer):
         instance.save()
         return instance
 
+# Field danh sách phòng: nạp toàn bộ id bằng MỘT truy vấn (kèm room_type)
+# thay vì mỗi id một truy vấn như PrimaryKeyRelatedField(many=True) mặc định
+class BulkManyRelatedField(serializers.ManyRelatedField):
+    def to_internal_value(self, data):
+        if isinstance(data, str) or not hasattr(data, '__iter__'):
+            self.fail('not_a_list', input_type=type(data).__name__)
+        if not self.allow_empty and len(data) == 0:
+            self.fail('empty')
+
+        child = self.child_relation
+        try:
+            pks = [int(getattr(item, 'pk', item)) for item in data]
+        except (TypeError, ValueError):
+            child.fail('incorrect_type', data_type=type(data).__name__)
+
+        objects = child.get_queryset().in_bulk(pks)
+        for pk in pks:
+            if pk not in objects:
+                child.fail('does_not_exist', pk_value=pk)
+        return [objects[pk] for pk in pks]
+
+
+class BulkPrimaryKeyRelatedField(serializers.PrimaryKeyRelatedField):
+    @classmethod
+    def many_init(cls, *args, **kwargs):
+        list_kwargs = {'child_relation': cls(*args, **kwargs)}
+        for key in kwargs:
+            if key in MANY_RELATION_KWARGS:
+                list_kwargs[key] = kwargs[key]
+        return BulkManyRelatedField(**list_kwargs)
+
+
 # Serializer cho Booking
 class BookingSerializer(serializers.ModelSerializer):
     customer_name = serializers.ReadOnlyField(source='customer.full_name')
     customer_phone = serializers.ReadOnlyField(source='customer.phone')
     customer_email = serializers.ReadOnlyField(source='customer.email')
     room_details = RoomSerializer(source='rooms', many=True, read_only=True)
+    rooms = BulkPrimaryKeyRelatedField(
+        many=True, queryset=Room.objects.select_related('room_type'), required=False
+    )
 
     class Meta:
         model = Booking
         fields = [
             'id', 'customer', 'customer_name', 'customer_phone', 'customer_email',
             'rooms', 'room_details', 'check_in_date', 'check_out_date', 'total_price',
-            'guest_count', 'status', 'special_requests', 'created_at', 'updated_at', 'discount_code'
+            'guest_count', 'status', 'special_requests', 'created_at', 'updated_at', 'discount_code',
+            'hold_token'
         ]
         read_only_fields = ['id', 'customer_name', 'customer_phone', 'customer_email', 'created_at', 'updated_at']
         extra_kwargs = {
@@ -253,6 +291,11 @@ class BookingSerializer(serializers.ModelSerializer):
     )
     guest_count = serializers.IntegerField(min_value=1, required=False)
     discount_code = serializers.CharField(max_length=50, required=False, write_only=True)
+    # Mã giữ phòng lấy từ /bookings/hold/ khi khách mở trang thanh toán
+    hold_token = serializers.CharField(max_length=64, required=False, write_only=True)
+
+    # Thông báo khi DB từ chối vì (phòng, đêm) đã bị booking/hold khác giữ
+    ROOM_TAKEN_MESSAGE = "Phòng vừa được đặt hoặc đang được giữ bởi khách khác. Vui lòng chọn phòng hoặc thời gian khác."
 
     def validate(self, attrs):
         # Trích xuất các thuộc tính cần thiết để xác thực
@@ -291,8 +334,6 @@ class BookingSerializer(serializers.ModelSerializer):
 
         # VALIDATION CONFLICT THỜI GIAN - LOGIC CHÍNH NGĂN TRÙNG BOOKING
         if rooms and check_in_date and check_out_date:
-            from .models import BookingStatus
-
             for room in rooms:
                 # Kiểm tra trạng thái phòng cơ bản
                 if room.status != 'available':
@@ -300,37 +341,34 @@ class BookingSerializer(serializers.ModelSerializer):
                         "rooms": f"Phòng {room.room_number} không khả dụng (trạng thái: {room.status})."
                     })
 
-                # KIỂM TRA CONFLICT THỜI GIAN VỚI CÁC BOOKING KHÁC
-                # Logic: Hai khoảng thời gian overlap nếu:
-                # - Booking khác bắt đầu trước khi chúng ta kết thúc: check_in_date__lt=check_out_date
-                # - Booking khác kết thúc sau khi chúng ta bắt đầu: check_out_date__gt=check_in_date
-                conflicting_bookings = room.bookings.filter(
-                    status__in=[BookingStatus.PENDING, BookingStatus.CONFIRMED, BookingStatus.CHECKED_IN],
-                    check_in_date__lt=check_out_date,
-                    check_out_date__gt=check_in_date
-                )
-                # Loại trừ booking hiện tại nếu đang update (để không conflict với chính mình)
-                if self.instance:
-                    conflicting_bookings = conflicting_bookings.exclude(pk=self.instance.pk)
-
+            # KIỂM TRA CONFLICT THỜI GIAN VỚI CÁC BOOKING KHÁC
+            # Một truy vấn gộp cho cả nhóm phòng (loại trừ booking hiện tại nếu đang update)
+            conflicts = inventory.find_conflicting_bookings(
+                rooms, check_in_date, check_out_date, exclude_booking=self.instance
+            )
+            for room in rooms:
+                conflict = conflicts.get(room.pk)
                 # Nếu có conflict, báo lỗi với thông tin chi tiết
-                if conflicting_bookings.exists():
-                    conflict = conflicting_bookings.first()
+                if conflict:
                     raise serializers.ValidationError({
                         "rooms": f"Phòng {room.room_number} đã được đặt từ {conflict.check_in_date.strftime('%d/%m/%Y %H:%M')} đến {conflict.check_out_date.strftime('%d/%m/%Y %H:%M')} (Booking #{conflict.id})"
                     })
 
+            # Phòng đang được khách khác giữ tạm (hold chưa hết hạn)
+            held_rooms = inventory.find_held_rooms(
+                rooms, check_in_date, check_out_date,
+                exclude_token=attrs.get('hold_token'), holder=request.user if request else None,
+            )
+            for room in rooms:
+                if room.pk in held_rooms:
+                    raise serializers.ValidationError({
+                        "rooms": f"Phòng {room.room_number} đang được khách khác giữ để thanh toán."
+                    })
+
         # VALIDATION SỐ KHÁCH - Đặt sau phần conflict để có rooms và guest_count
         if rooms and guest_count:
             if len(rooms) > 1:
                 # Logic thông minh cho nhiều phòng
-                stay_days = (check_out_date - check_in_date).days if check_in_date and check_out_date else 1
-                # Gọi hàm phân bổ khách thông minh
-                pricing_result = Booking.calculate_price_for_multiple_rooms(rooms, guest_count, stay_days)
-                # Lưu kết quả để có thể sử dụng sau này
-                attrs['_smart_pricing_result'] = pricing_result
-                attrs['total_price'] = pricing_result['total_price']
-                
                 # Kiểm tra xem có phòng nào bị quá tải không (validation linh hoạt)
                 max_total_capacity = sum(room.room_type.max_guests for room in rooms)
                 max_allowed_guests = int(max_total_capacity * 1.5)
@@ -364,22 +402,12 @@ class BookingSerializer(serializers.ModelSerializer):
 
         # Tính tổng giá với mã giảm giá
         if check_in_date and check_out_date and rooms and guest_count:
-            days = (check_out_date - check_in_date).days
-            if days <= 0:
-                days = 1
-
-            total_price = Decimal('0')
-            for room in rooms:
-                room_type = room.room_type
-                base_price = room_type.base_price
-                room_price = base_price * days
-                
-                if guest_count > room_type.max_guests:
-                    extra_guests = guest_count - room_type.max_guests
-                    surcharge = base_price * (room_type.extra_guest_surcharge / 100) * extra_guests * days
-                    room_price += surcharge
-                
-                total_price += room_price
+            days = pricing.stay_days(check_in_date, check_out_date)
+            # Phân bổ khách thông minh (phòng lớn trước, khách dư tính phụ thu)
+            pricing_result = pricing.quote_rooms(rooms, guest_count, days, check_in=check_in_date)
+            # Lưu kết quả để có thể sử dụng sau này
+            attrs['_smart_pricing_result'] = pricing_result
+            total_price = pricing_result['total_price']
 
             if discount_code:
                 try:
@@ -409,16 +437,24 @@ class BookingSerializer(serializers.ModelSerializer):
         validated_data.pop('discount_code', None)
         validated_data.pop('_smart_pricing_result', None)
         rooms_data = validated_data.pop('rooms', None)
+        hold_token = validated_data.pop('hold_token', None)
 
-        with transaction.atomic():
-            # Tạo booking mới
-            booking = Booking.objects.create(**validated_data)
-        
-            # Gán danh sách phòng nếu có
-            if rooms_data is not None:
-                booking.rooms.set(rooms_data)
-        
-            return booking
+        try:
+            with transaction.atomic():
+                # Tạo booking mới
+                booking = Booking.objects.create(**validated_data)
+
+                # Chuyển các đêm đang hold thành của booking trước khi gán phòng
+                inventory.claim_hold(hold_token, booking, self.context['request'].user)
+
+                # Gán danh sách phòng nếu có
+                if rooms_data is not None:
+                    booking.rooms.set(rooms_data)
+        except IntegrityError:
+            # unique (room, date) trong sổ phòng: request khác đã giữ đêm này trước
+            raise serializers.ValidationError({"rooms": self.ROOM_TAKEN_MESSAGE})
+
+        return booking
 
     def update(self, instance, validated_data):
         # Trích xuất dữ liệu cần thiết
@@ -438,22 +474,8 @@ class BookingSerializer(serializers.ModelSerializer):
             guest_count = validated_data.get('guest_count', instance.guest_count)
 
             if check_in_date and check_out_date and rooms and guest_count:
-                days = (check_out_date - check_in_date).days
-                if days <= 0:
-                    days = 1
-
-                total_price = Decimal('0')
-                for room in rooms:
-                    room_type = room.room_type
-                    base_price = room_type.base_price
-                    room_price = base_price * days
-                    
-                    if guest_count > room_type.max_guests:
-                        extra_guests = guest_count - room_type.max_guests
-                        surcharge = base_price * (room_type.extra_guest_surcharge / 100) * extra_guests * days
-                        room_price += surcharge
-                    
-                    total_price += room_price
+                days = pricing.stay_days(check_in_date, check_out_date)
+                total_price = pricing.quote_rooms(rooms, guest_count, days, check_in=check_in_date)['total_price']
 
                 if discount_code:
                     try:
@@ -475,16 +497,84 @@ class BookingSerializer(serializers.ModelSerializer):
 
                 validated_data['total_price'] = total_price.quantize(Decimal('0.01'), rounding=ROUND_HALF_UP)
 
-        with transaction.atomic():
-            # Cập nhật các trường của instance
-            for attr, value in validated_data.items():
-                setattr(instance, attr, value)
-            if rooms_data is not None:
-                instance.rooms.set(rooms_data)
-            instance.save()
+        hold_token = validated_data.pop('hold_token', None)
+        try:
+            with transaction.atomic():
+                inventory.claim_hold(hold_token, instance, self.context['request'].user)
+                # Cập nhật các trường của instance
+                for attr, value in validated_data.items():
+                    setattr(instance, attr, value)
+                if rooms_data is not None:
+                    instance.rooms.set(rooms_data)
+                instance.save()
+        except IntegrityError:
+            raise serializers.ValidationError({"rooms": self.ROOM_TAKEN_MESSAGE})
         return instance
 
 
+# Serializer cho yêu cầu giữ phòng tạm thời (hold) khi khách mở trang thanh toán
+class BookingHoldSerializer(serializers.Serializer):
+    rooms = BulkPrimaryKeyRelatedField(many=True, queryset=Room.objects.all(), allow_empty=False)
+    check_in_date = serializers.DateTimeField()
+    check_out_date = serializers.DateTimeField()
+
+    def validate(self, attrs):
+        # Cùng quy tắc với BookingSerializer / calculate-price: hold chỉ giữ phòng mà booking được phép đặt
+        if inventory.local_date(attrs['check_in_date']) < inventory.local_date(timezone.now()):
+            raise serializers.ValidationError({
+                "check_in_date": "Ngày nhận phòng không được ở quá khứ."
+            })
+        if attrs['check_in_date'] >= attrs['check_out_date']:
+            raise serializers.ValidationError({
+                "check_out_date": "Ngày trả phòng phải sau ngày nhận phòng."
+            })
+        if attrs['check_in_date'] > timezone.now() + timedelta(days=28):
+            raise serializers.ValidationError({
+                "check_in_date": "Ngày nhận phòng không được vượt quá 28 ngày kể từ thời điểm đặt."
+            })
+        for room in attrs['rooms']:
+            if room.status != 'available':
+                raise serializers.ValidationError({
+                    "rooms": f"Phòng {room.room_number} không khả dụng (trạng thái: {room.status})."
+                })
+        return attrs
+
+
+def validate_rental(attrs, instance=None):
+    """
+    Kiểm tra chung của RoomRentalSerializer / RoomRentalDetailSerializer: thứ tự ngày, sức chứa phòng,
+    phòng không trùng booking khác (trừ booking gốc của rental)
+    """
+    check_in_date = attrs.get('check_in_date', timezone.now())
+    check_out_date = attrs.get('check_out_date')
+    actual_check_out_date = attrs.get('actual_check_out_date')
+    rooms = attrs.get('rooms', [])
+    guest_count = attrs.get('guest_count')
+
+    if check_in_date and check_out_date and check_in_date >= check_out_date:
+        raise serializers.ValidationError("Ngày nhận phòng phải trước ngày trả phòng.")
+    if actual_check_out_date and actual_check_out_date < check_in_date:
+        raise serializers.ValidationError("Ngày trả phòng thực tế phải sau ngày nhận phòng.")
+
+    for room in rooms:
+        if guest_count and guest_count > room.room_type.max_guests:
+            raise serializers.ValidationError(f"Phòng {room.room_number} chỉ chứa tối đa {room.room_type.max_guests} khách.")
+
+    if rooms and check_in_date and check_out_date:
+        booking = attrs.get('booking') or (instance.booking if instance else None)
+        conflicts = inventory.find_conflicting_bookings(
+            rooms, check_in_date, check_out_date, exclude_booking=booking
+        )
+        for room in rooms:
+            conflict = conflicts.get(room.pk)
+            if conflict:
+                raise serializers.ValidationError(
+                    f"Phòng {room.room_number} đã được đặt từ {conflict.check_in_date.strftime('%d/%m/%Y %H:%M')} đến {conflict.check_out_date.strftime('%d/%m/%Y %H:%M')} (Booking #{conflict.id})"
+                )
+
+    return attrs
+
+
 # Serializer cho RoomRental
 class RoomRentalSerializer(ModelSerializer):
     customer_name = serializers.ReadOnlyField(source='customer.full_name')
@@ -492,6 +582,7 @@ class RoomRentalSerializer(ModelSerializer):
     customer_email = serializers.ReadOnlyField(source='customer.email')
     room_details = RoomSerializer(source='rooms', many=True, read_only=True)
     booking_id = serializers.ReadOnlyField(source='booking.id')
+    rooms = BulkPrimaryKeyRelatedField(many=True, queryset=Room.objects.select_related('room_type'))
 
     class Meta:
         model = RoomRental
@@ -508,22 +599,7 @@ class RoomRentalSerializer(ModelSerializer):
     guest_count = serializers.IntegerField(min_value=1, required=False)
 
     def validate(self, attrs):
-        check_in_date = attrs.get('check_in_date', timezone.now())
-        check_out_date = attrs.get('check_out_date')
-        actual_check_out_date = attrs.get('actual_check_out_date')
-        rooms = attrs.get('rooms', [])
-        guest_count = attrs.get('guest_count')
-
-        if check_in_date and check_out_date and check_in_date >= check_out_date:
-            raise serializers.ValidationError("Ngày nhận phòng phải trước ngày trả phòng.")
-        if actual_check_out_date and actual_check_out_date < check_in_date:
-            raise serializers.ValidationError("Ngày trả phòng thực tế phải sau ngày nhận phòng.")
-
-        for room in rooms:
-            if guest_count and guest_count > room.room_type.max_guests:
-                raise serializers.ValidationError(f"Phòng {room.room_number} chỉ chứa tối đa {room.room_type.max_guests} khách.")
-
-        return attrs
+        return validate_rental(attrs, self.instance)
 
     def update(self, instance, validated_data):
         rooms_data = validated_data.pop('rooms', None)
@@ -579,25 +655,36 @@ class PaymentSerializer(serializers.ModelSerializer):
         }
 
     def get_items(self, obj):
-        """Tạo danh sách khoản phí từ RoomRental"""
-        rental = obj.rental
-        actual_days = max((rental.check_out_date - rental.check_in_date).days, 1)
-        items = []
-        for room in rental.rooms.all():
-            room_price = room.room_type.base_price * actual_days
-            surcharge = Decimal('0')
-            if rental.guest_count > room.room_type.max_guests:
-                extra_guests = rental.guest_count - room.room_type.max_guests
-                surcharge = room.room_type.base_price * (room.room_type.extra_guest_surcharge / 100) * extra_guests * actual_days
-            items.append({
-                'room_id': room.id,
-                'room_type': room.room_type.name,
-                'base_price': float(room.room_type.base_price),
-                'days': actual_days,
-                'surcharge': float(surcharge),
-                'subtotal': float(room_price + surcharge)
-            })
-        return items
+        """
+        Khoản phí đã chụp lúc check-out (InvoiceLine, nên prefetch 'lines');
+        thanh toán cũ chưa có dòng hóa đơn thì tính lại từ RoomRental
+        """
+        lines = obj.lines.all()
+        if lines:
+            items = [
+                {
+                    'room_id': line.room_id,
+                    'room_type': line.room_type,
+                    'base_price': line.base_price,
+                    'days': line.days,
+                    'surcharge': line.surcharge,
+                    'subtotal': line.subtotal,
+                }
+                for line in lines
+            ]
+        else:
+            items = pricing.invoice_items(obj.rental)
+        return [
+            {
+                'room_id': item['room_id'],
+                'room_type': item['room_type'],
+                'base_price': float(item['base_price']),
+                'days': item['days'],
+                'surcharge': float(item['surcharge']),
+                'subtotal': float(item['subtotal'])
+            }
+            for item in items
+        ]
 
     def get_amount(self, obj):
         amount = obj.rental.total_price
@@ -676,19 +763,7 @@ class RoomRentalDetailSerializer(ModelSerializer):
     payments = PaymentSerializer(many=True, read_only=True)
 
     def validate(self, attrs):
-        check_in_date = attrs.get('check_in_date', timezone.now())
-        check_out_date = attrs.get('check_out_date')
-        rooms = attrs.get('rooms', [])
-        guest_count = attrs.get('guest_count')
-
-        if check_in_date and check_out_date and check_in_date >= check_out_date:
-            raise serializers.ValidationError("Ngày nhận phòng phải trước ngày trả phòng.")
-
-        for room in rooms:
-            if guest_count and guest_count > room.room_type.max_guests:
-                raise serializers.ValidationError(f"Phòng {room.room_number} chỉ chứa tối đa {room.room_type.max_guests} khách.")
-
-        return attrs
+        return validate_rental(attrs, self.instance)
 
     def create(self, validated_data):
         customer = self.context['request'].user
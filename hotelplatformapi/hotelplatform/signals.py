@@ -1,9 +1,13 @@
-from django.db.models.signals import post_save, pre_save, post_migrate, m2m_changed
+from django.db.models.signals import post_save, post_delete, pre_save, pre_delete, post_migrate, m2m_changed
 from django.dispatch import receiver
+from django.db import transaction
 from django.contrib.auth import get_user_model
 from django.apps import apps
-from django.utils import timezone
-from .models import Booking, BookingStatus, Notification, RoomRental, Payment, Room
+from .models import Booking, BookingStatus, RoomRental, Payment, Room, RoomNight, RoomType, RatePeriod
+from .inventory import sync_booking_nights, sync_booking_rooms
+from .availability import notify_rooms_changed
+from .pricing import rates
+from . import dashboard, jobs, rollup, room_stats
 
 User = get_user_model()
 
@@ -40,27 +44,27 @@ def booking_pre_save(sender, instance, **kwargs):
     """
     Signal xử lý trước khi booking được lưu
     """
-    # Nếu booking được hủy, giải phóng phòng
-    if instance.pk:
-        try:
-            old_instance = Booking.objects.get(pk=instance.pk)
-            if old_instance.status != BookingStatus.CANCELLED and instance.status == BookingStatus.CANCELLED:
-                # Giải phóng phòng
-                for room in instance.rooms.all():
-                    # Chỉ cập nhật nếu phòng không phải 'occupied'
-                    if room.status != 'occupied':
-                        room.status = 'available'
-                        room.save()
-                
-                # Tạo thông báo hủy booking
-                Notification.objects.create(
-                    user=instance.customer,
-                    notification_type='booking_confirmation',
-                    title='Booking đã bị hủy',
-                    message=f'Booking {instance.id} đã bị hủy.'
-                )
-        except Booking.DoesNotExist:
-            pass
+    # Nếu booking được hủy, giải phóng phòng (so với giá trị lúc nạp, không SELECT lại)
+    original = instance.loaded_values()
+    if original and original['status'] != BookingStatus.CANCELLED and instance.status == BookingStatus.CANCELLED:
+        # Giải phóng phòng
+        for room in instance.rooms.all():
+            # Chỉ cập nhật nếu phòng không phải 'occupied'
+            if room.status != 'occupied':
+                room.status = 'available'
+                room.save()
+        
+        # Tạo thông báo hủy booking (tác vụ nền)
+        jobs.enqueue(
+            'notify', user_id=instance.customer_id,
+            title='Booking đã bị hủy',
+            message=f'Booking {instance.id} đã bị hủy.'
+        )
+
+
+def enqueue_customer_stats(user_id):
+    """Tính lại thống kê khách hàng ở tác vụ nền; nhiều lần trong lúc job chờ chỉ chạy một lần"""
+    jobs.enqueue('refresh_customer_stats', dedup_key=f'customer_stats:{user_id}', user_id=user_id)
 
 
 @receiver(post_save, sender=Booking)
@@ -69,29 +73,22 @@ def booking_post_save(sender, instance, created, **kwargs):
     Signal xử lý sau khi booking được lưu
     """
     if created:
-        # Tạo thông báo cho customer khi booking mới được tạo
-        Notification.objects.create(
-            user=instance.customer,
-            notification_type='booking_confirmation',
+        # Tạo thông báo cho customer khi booking mới được tạo (tác vụ nền)
+        jobs.enqueue(
+            'notify', user_id=instance.customer_id,
             title='Đặt phòng thành công',
             message=f'Đặt phòng của bạn đã được tạo thành công. Mã booking: {instance.id}'
         )
         
         # CÂP NHẬT TOTAL BOOKINGS VÀ CUSTOMER TYPE CHO USER
-        # Cập nhật tự động số lần booking và loại khách hàng khi tạo booking mới
+        # Cập nhật tự động số lần booking và loại khách hàng khi tạo booking mới (tác vụ nền)
         if instance.customer and instance.customer.role == 'customer':
-            try:
-                # Gọi method refresh_customer_stats để cập nhật toàn bộ thống kê customer
-                instance.customer.refresh_customer_stats()
-                print(f"✅ Updated customer stats for {instance.customer.full_name}: total_bookings={instance.customer.total_bookings}, customer_type={instance.customer.customer_type}")
-            except Exception as e:
-                print(f"❌ Error updating customer stats for booking {instance.id}: {e}")
+            enqueue_customer_stats(instance.customer_id)
     
     # Tạo thông báo khi booking được xác nhận
     if instance.status == BookingStatus.CONFIRMED:
-        Notification.objects.create(
-            user=instance.customer,
-            notification_type='booking_confirmation',
+        jobs.enqueue(
+            'notify', user_id=instance.customer_id,
             title='Booking đã được xác nhận',
             message=f'Booking của bạn đã được xác nhận. Vui lòng chuẩn bị để check-in.'
         )
@@ -144,11 +141,14 @@ def booking_pre_save_status_tracking(sender, instance, **kwargs):
     Signal để track status change trước khi save
     """
     if instance.pk:
-        try:
-            old_instance = Booking.objects.get(pk=instance.pk)
+        # Giá trị lúc nạp từ DB (Booking.loaded_values), không SELECT lại
+        original = instance.loaded_values()
+        if original:
             # Lưu trạng thái cũ vào custom attribute để sử dụng trong post_save
-            instance._original_status = old_instance.status
-        except Booking.DoesNotExist:
+            instance._original_status = original['status']
+            # Ngày thống kê cũ (đổi ngày nhận phòng → ngày cũ cũng phải tính lại)
+            instance._original_rollup_days = rollup.booking_days(original['check_in_date'], original['created_at'])
+        else:
             instance._original_status = None
 
 
@@ -206,38 +206,77 @@ def booking_rooms_changed(sender, instance, action, **kwargs):
                 pass
 
 
+@receiver(post_save, sender=Booking)
+def booking_room_nights_post_save(sender, instance, **kwargs):
+    """
+    Đồng bộ BookingRoom và sổ phòng theo đêm (RoomNight) khi booking được tạo/cập nhật
+    (đổi ngày, hủy, no-show, check-out đều giải phóng hoặc dịch chuyển các đêm đang giữ)
+    """
+    sync_booking_rooms(instance)
+    sync_booking_nights(instance)
+
+
+@receiver(m2m_changed, sender=Booking.rooms.through)
+def booking_room_nights_rooms_changed(sender, instance, action, **kwargs):
+    """
+    Đồng bộ BookingRoom (dòng mới thêm chưa có ngày) và sổ phòng theo đêm
+    khi danh sách phòng của booking thay đổi
+    """
+    if action not in ("post_add", "post_remove", "post_clear"):
+        return
+
+    if isinstance(instance, Booking):
+        if action == "post_add":
+            sync_booking_rooms(instance)
+        sync_booking_nights(instance)
+    elif action == "post_clear":
+        # room.bookings.clear(): phòng không còn thuộc booking nào
+        RoomNight.objects.filter(room=instance).delete()
+        notify_rooms_changed([instance.pk])
+    else:
+        # room.bookings.add()/remove(): đồng bộ từng booking bị ảnh hưởng
+        for booking in Booking.objects.filter(pk__in=kwargs.get('pk_set') or []):
+            if action == "post_add":
+                sync_booking_rooms(booking)
+            sync_booking_nights(booking)
+
+
+@receiver(pre_delete, sender=Booking)
+def booking_room_nights_pre_delete(sender, instance, **kwargs):
+    """
+    Các đêm của booking bị xóa theo cascade (không qua sync) → báo cho chỉ mục phòng trống
+    """
+    notify_rooms_changed(instance.room_nights.values_list('room_id', flat=True))
+
+
+@receiver(post_save, sender=RoomType)
+@receiver(post_delete, sender=RoomType)
+def room_type_rates_changed(sender, instance, **kwargs):
+    """
+    Giá / sức chứa / phụ thu của loại phòng thay đổi → làm mới bảng giá của engine tính giá
+    """
+    rates.invalidate()
+
+
+@receiver(post_save, sender=RatePeriod)
+@receiver(post_delete, sender=RatePeriod)
+def rate_period_changed(sender, instance, **kwargs):
+    """
+    Giá theo mùa thay đổi → dựng lại mảng giá từng đêm của loại phòng đó khi transaction commit
+    """
+    room_type_id = instance.room_type_id
+    transaction.on_commit(lambda: rates.types_changed([room_type_id]))
+
+
 @receiver(post_save, sender=RoomRental)
 def room_rental_post_save(sender, instance, created, **kwargs):
     """
     Signal xử lý sau khi RoomRental được lưu
     """
     # Tự động tạo Payment khi RoomRental được check-out (có actual_check_out_date)
+    # Tác vụ nền kiểm tra lại: luồng check-out thường đã tạo Payment trong cùng transaction
     if not created and instance.actual_check_out_date:
-        # Kiểm tra xem đã có Payment chưa
-        existing_payment = Payment.objects.filter(rental=instance).first()
-        if not existing_payment:
-            # Tạo Payment record
-            try:
-                payment = Payment.objects.create(
-                    customer=instance.customer,
-                    rental=instance,
-                    amount=instance.total_price,
-                    status=False,  # Chưa thanh toán, cần thanh toán tại quầy
-                    payment_method='cash',  # Mặc định thanh toán tiền mặt
-                    transaction_id=f"PAY_{instance.id}_{timezone.now().strftime('%Y%m%d_%H%M%S')}"
-                )
-                print(f"✅ Auto-created Payment {payment.id} for RoomRental {instance.id}: {payment.amount} VND")
-                
-                # Tạo thông báo cho khách hàng
-                Notification.objects.create(
-                    user=instance.customer,
-                    notification_type='booking_confirmation',
-                    title='Hóa đơn đã được tạo',
-                    message=f'Hóa đơn thanh toán {payment.transaction_id} đã được tạo. Số tiền: {payment.amount:,.0f} VND. Vui lòng thanh toán tại quầy.'
-                )
-                
-            except Exception as e:
-                print(f"❌ Error creating Payment for RoomRental {instance.id}: {e}")
+        jobs.enqueue('create_rental_payment', dedup_key=f'rental_payment:{instance.id}', rental_id=instance.id)
     
     # RoomRental không ảnh hưởng total_bookings count nên không cần refresh stats
 
@@ -250,13 +289,106 @@ def payment_post_save(sender, instance, created, **kwargs):
     # Chỉ refresh customer stats khi payment status = True (đã thanh toán)
     # vì chỉ khi đó mới ảnh hưởng total_spent
     if instance.customer and instance.customer.role == 'customer' and instance.status:
-        instance.customer.refresh_customer_stats()
+        enqueue_customer_stats(instance.customer_id)
         
     # Tạo thông báo khi thanh toán thành công
     if created and instance.status:
-        Notification.objects.create(
-            user=instance.customer,
-            notification_type='booking_confirmation',
+        jobs.enqueue(
+            'notify', user_id=instance.customer_id,
             title='Thanh toán thành công',
             message=f'Thanh toán {instance.transaction_id} đã được xử lý thành công. Số tiền: {instance.amount:,.0f} VND'
-        )
\ No newline at end of file
+        )
+
+
+# ===================== Thống kê theo ngày (DailyStat) =====================
+# Chỉ đánh dấu ngày bị ảnh hưởng; việc tính lại chạy sau khi transaction commit (rollup.mark_dirty)
+
+@receiver(post_save, sender=Booking)
+@receiver(post_delete, sender=Booking)
+def booking_rollup_changed(sender, instance, **kwargs):
+    days = rollup.booking_days(instance.check_in_date, instance.created_at)
+    rollup.mark_dirty(days | getattr(instance, '_original_rollup_days', set()))
+
+
+@receiver(m2m_changed, sender=Booking.rooms.through)
+def booking_rooms_rollup_changed(sender, instance, action, **kwargs):
+    if action not in ("post_add", "post_remove", "post_clear") or not isinstance(instance, Booking):
+        return
+    rollup.mark_dirty(rollup.booking_days(instance.check_in_date, instance.created_at))
+
+
+@receiver(pre_save, sender=RoomRental)
+def room_rental_rollup_pre_save(sender, instance, update_fields=None, **kwargs):
+    """Ghi nhớ khoảng lưu trú cũ khi ngày thuê có thể thay đổi (RoomRental.loaded_values, không SELECT lại)"""
+    if not instance.pk or (update_fields is not None and not set(RoomRental.TRACKED_FIELDS) & set(update_fields)):
+        return
+    old = instance.loaded_values()
+    if old:
+        instance._original_rollup_days = rollup.rental_days(old['check_in_date'], old['check_out_date'])
+
+
+@receiver(post_save, sender=RoomRental)
+@receiver(post_delete, sender=RoomRental)
+def room_rental_rollup_changed(sender, instance, **kwargs):
+    days = rollup.rental_days(instance.check_in_date, instance.check_out_date)
+    rollup.mark_dirty(days | getattr(instance, '_original_rollup_days', set()))
+
+
+@receiver(m2m_changed, sender=RoomRental.rooms.through)
+def room_rental_rooms_rollup_changed(sender, instance, action, **kwargs):
+    if action not in ("post_add", "post_remove", "post_clear") or not isinstance(instance, RoomRental):
+        return
+    rollup.mark_dirty(rollup.rental_days(instance.check_in_date, instance.check_out_date))
+
+
+@receiver(pre_save, sender=Payment)
+def payment_rollup_pre_save(sender, instance, **kwargs):
+    """Trạng thái / số tiền / phiếu thuê có đổi so với DB không (Payment.loaded_values, không SELECT lại)"""
+    original = instance.loaded_values()
+    instance._revenue_changed = original is None or any(
+        original[name] != getattr(instance, name) for name in Payment.TRACKED_FIELDS
+    )
+
+
+@receiver(post_save, sender=Payment)
+def payment_rollup_changed(sender, instance, created, **kwargs):
+    # Doanh thu theo đêm ghi lại khi thanh toán hoàn tất / đổi số tiền (xóa nếu thanh toán bị hủy);
+    # lưu các trường khác (paid_at, discount_code...) không chạm RevenueNight
+    if not getattr(instance, '_revenue_changed', True) or (created and not instance.status):
+        return
+    rollup.mark_dirty(instance.recognize_revenue())
+
+
+@receiver(pre_delete, sender=Payment)
+def payment_rollup_deleted(sender, instance, **kwargs):
+    # RevenueNight bị xóa theo cascade → ghi nhớ các đêm trước khi mất
+    rollup.mark_dirty(set(instance.revenue_nights.values_list('date', flat=True)))
+
+
+# ===================== Cache thống kê dashboard =====================
+# Đăng ký sau các receiver DailyStat: on_commit chạy theo thứ tự đăng ký nên bảng thống kê
+# được tính lại trước khi phiên bản cache tăng
+
+@receiver(post_save, sender=Booking)
+@receiver(post_delete, sender=Booking)
+@receiver(post_save, sender=RoomRental)
+@receiver(post_delete, sender=RoomRental)
+@receiver(post_save, sender=Payment)
+@receiver(post_delete, sender=Payment)
+def dashboard_source_changed(sender, **kwargs):
+    dashboard.invalidate()
+
+
+@receiver(m2m_changed, sender=Booking.rooms.through)
+@receiver(m2m_changed, sender=RoomRental.rooms.through)
+def dashboard_rooms_changed(sender, action, **kwargs):
+    if action in ("post_add", "post_remove", "post_clear"):
+        dashboard.invalidate()
+
+
+# ===================== Số phòng theo trạng thái =====================
+
+@receiver(post_save, sender=Room)
+@receiver(post_delete, sender=Room)
+def room_status_changed(sender, **kwargs):
+    room_stats.invalidate()
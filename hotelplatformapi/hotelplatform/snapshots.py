@@ -0,0 +1,232 @@
+"""
+Ảnh chụp dữ liệu dạng cột (Parquet / Arrow) cho phân tích offline
+
+Mỗi bảng (booking, liên kết booking-phòng, phiếu thuê, thanh toán, thống kê khách hàng) được ghi
+thành các phân vùng theo tháng (giờ khách sạn) dạng hive: <thư mục>/<bảng>/month=YYYY-MM/part.<đuôi>,
+đọc thẳng bằng pandas.read_parquet(<thư mục>/<bảng>) hoặc pyarrow.dataset.
+
+Xuất tăng dần: _manifest.json lưu watermark (thời điểm bắt đầu lần xuất trước) và số dòng từng
+phân vùng của mỗi bảng. Lần sau chỉ ghi lại các tháng có dòng thay đổi từ watermark
+(updated_at / created_at) hoặc có số dòng khác trước (bắt được bản ghi bị xóa).
+
+pyarrow là phụ thuộc tùy chọn, chỉ cần khi xuất. Trang admin không xuất trong request mà ghi job
+'export_snapshots' cho worker (jobs.py).
+"""
+import json
+import os
+from collections import namedtuple
+from datetime import datetime, timedelta
+from zoneinfo import ZoneInfo
+
+from django.conf import settings
+from django.db import models
+from django.db.models import Count, F
+from django.db.models.functions import Coalesce, TruncMonth
+from django.utils import timezone
+
+from .inventory import HOTEL_TIMEZONE
+from .models import Booking, BookingRoom, Payment, RoomRental, User
+from .rollup import day_start, next_period
+
+FORMATS = ('parquet', 'arrow')
+EXTENSIONS = {'parquet': 'parquet', 'arrow': 'arrow'}
+MANIFEST_NAME = '_manifest.json'
+
+# Dòng được sửa ngay trước watermark nhưng commit sau đó vẫn được bắt ở lần xuất kế tiếp
+WATERMARK_OVERLAP = timedelta(minutes=5)
+
+Table = namedtuple('Table', 'name model queryset columns partition_field changed_at')
+
+TABLES = (
+    Table(
+        'bookings', Booking, lambda: Booking.objects.all(),
+        ('id', 'customer_id', 'check_in_date', 'check_out_date', 'guest_count', 'status', 'total_price',
+         'created_at', 'updated_at'),
+        'created_at', F('updated_at'),
+    ),
+    Table(
+        'booking_rooms', BookingRoom, lambda: BookingRoom.objects.all(),
+        ('id', 'booking_id', 'room_id', 'room__room_number', 'room__room_type_id', 'check_in_date',
+         'check_out_date', 'is_active'),
+        # Liên kết không có mốc thời gian riêng: đi theo booking
+        'booking__created_at', F('booking__updated_at'),
+    ),
+    Table(
+        'rentals', RoomRental, lambda: RoomRental.objects.all(),
+        ('id', 'booking_id', 'customer_id', 'check_in_date', 'check_out_date', 'actual_check_out_date',
+         'guest_count', 'total_price', 'created_at', 'updated_at'),
+        'created_at', F('updated_at'),
+    ),
+    Table(
+        'payments', Payment, lambda: Payment.objects.all(),
+        ('id', 'rental_id', 'customer_id', 'amount', 'payment_method', 'status', 'paid_at', 'transaction_id',
+         'discount_code_id', 'created_at'),
+        # Payment không có updated_at: hoàn tất thanh toán luôn gán paid_at
+        'created_at', Coalesce('paid_at', 'created_at'),
+    ),
+    Table(
+        'customers', User, lambda: User.objects.filter(role='customer'),
+        ('id', 'username', 'full_name', 'customer_type', 'total_bookings', 'total_spent', 'is_active',
+         'created_at', 'updated_at'),
+        'created_at', F('updated_at'),
+    ),
+)
+
+
+def _pyarrow():
+    try:
+        import pyarrow
+        import pyarrow.feather
+        import pyarrow.parquet
+    except ImportError:
+        raise ImportError('Cần cài pyarrow để xuất snapshot (pip install pyarrow)') from None
+    return pyarrow
+
+
+def check_format(file_format):
+    """Định dạng hợp lệ và đã cài pyarrow; không → ValueError / ImportError. Trả về module pyarrow"""
+    if file_format not in FORMATS:
+        raise ValueError(f'Định dạng phải là một trong: {", ".join(FORMATS)}')
+    return _pyarrow()
+
+
+def default_directory():
+    return getattr(settings, 'ANALYTICS_SNAPSHOT_DIR', os.path.join(settings.BASE_DIR, 'snapshots'))
+
+
+def _resolve_field(model, path):
+    """Field cuối của đường dẫn lookup (vd. 'room__room_type_id')"""
+    *relations, name = path.split('__')
+    for relation in relations:
+        model = model._meta.get_field(relation).related_model
+    for field in model._meta.concrete_fields:
+        if name in (field.name, field.attname):
+            return field
+    raise ValueError(f'Không tìm thấy trường {path}')
+
+
+def _arrow_type(pa, field):
+    """Kiểu Arrow cố định theo kiểu trường Django để mọi phân vùng cùng schema"""
+    if isinstance(field, models.DateTimeField):
+        return pa.timestamp('us', tz='UTC')
+    if isinstance(field, models.DateField):
+        return pa.date32()
+    if isinstance(field, models.DecimalField):
+        return pa.decimal128(field.max_digits, field.decimal_places)
+    if isinstance(field, models.BooleanField):
+        return pa.bool_()
+    if isinstance(field, (models.IntegerField, models.AutoField, models.ForeignKey)):
+        return pa.int64()
+    return pa.string()
+
+
+def _schema(pa, table):
+    return pa.schema([
+        (column.replace('__', '_'), _arrow_type(pa, _resolve_field(table.model, column))) for column in table.columns
+    ])
+
+
+def _month_key(value):
+    return value.strftime('%Y-%m')
+
+
+def _partition_path(directory, table, month, file_format):
+    return os.path.join(directory, table.name, f'month={month}', f'part.{EXTENSIONS[file_format]}')
+
+
+def _write_json(path, data):
+    temp_path = f'{path}.tmp'
+    with open(temp_path, 'w', encoding='utf-8') as file:
+        json.dump(data, file, ensure_ascii=False, indent=2)
+    os.replace(temp_path, path)
+
+
+def load_manifest(directory=None):
+    path = os.path.join(directory or default_directory(), MANIFEST_NAME)
+    try:
+        with open(path, encoding='utf-8') as file:
+            return json.load(file)
+    except FileNotFoundError:
+        return {'format': None, 'tables': {}}
+
+
+def _changed_months(table, state, tz):
+    """Các tháng cần ghi lại và số dòng hiện tại của mọi tháng (hai truy vấn gom nhóm)"""
+    month = TruncMonth(table.partition_field, tzinfo=tz)
+    rows = table.queryset().annotate(month=month).values('month').annotate(rows=Count('pk')).order_by()
+    counts = {_month_key(row['month']): row['rows'] for row in rows}
+
+    previous = state.get('partitions', {})
+    changed = {key for key in counts.keys() | previous.keys() if counts.get(key) != previous.get(key)}
+    if state.get('watermark') is None:
+        return changed | counts.keys(), counts
+    since = datetime.fromisoformat(state['watermark']) - WATERMARK_OVERLAP
+    updated = table.queryset().annotate(changed_at=table.changed_at).filter(changed_at__gte=since).annotate(
+        month=month
+    ).values_list('month', flat=True).order_by().distinct()
+    return changed | {_month_key(value) for value in updated}, counts
+
+
+def _write_partition(pa, table, schema, month, path, file_format):
+    """Ghi một tháng; trả về False nếu tháng không còn dòng nào (file cũ bị xóa)"""
+    start = datetime.strptime(month, '%Y-%m').date()
+    rows = table.queryset().filter(**{
+        f'{table.partition_field}__gte': day_start(start),
+        f'{table.partition_field}__lt': day_start(next_period(start, 'month')),
+    }).order_by('pk').values_list(*table.columns)
+    columns = list(zip(*rows.iterator())) or [[] for _ in table.columns]
+    if not columns[0]:
+        if os.path.exists(path):
+            os.remove(path)
+        return False
+
+    arrow_table = pa.Table.from_arrays(
+        [pa.array(values, type=field.type) for values, field in zip(columns, schema)], schema=schema
+    )
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    temp_path = f'{path}.tmp'
+    if file_format == 'parquet':
+        pa.parquet.write_table(arrow_table, temp_path)
+    else:
+        pa.feather.write_feather(arrow_table, temp_path)
+    os.replace(temp_path, path)
+    return True
+
+
+def export(directory=None, file_format='parquet', full=False, tables=None):
+    """
+    Xuất ảnh chụp tăng dần.
+
+    Args:
+        directory: Thư mục đích (mặc định settings.ANALYTICS_SNAPSHOT_DIR)
+        file_format: 'parquet' hoặc 'arrow'
+        full: Ghi lại mọi phân vùng, bỏ qua watermark
+        tables: Tên các bảng cần xuất (mặc định tất cả)
+
+    Returns:
+        dict: {tên bảng: danh sách tháng đã ghi lại}
+    """
+    pa = check_format(file_format)
+    directory = directory or default_directory()
+    os.makedirs(directory, exist_ok=True)
+    manifest = load_manifest(directory)
+    # Đổi định dạng → các file cũ không dùng lại được
+    full = full or manifest.get('format') != file_format
+    manifest['format'] = file_format
+    tz = ZoneInfo(HOTEL_TIMEZONE.zone)
+
+    summary = {}
+    for table in TABLES:
+        if tables and table.name not in tables:
+            continue
+        started = timezone.now()
+        state = {} if full else manifest['tables'].get(table.name, {})
+        months, counts = _changed_months(table, state, tz)
+        schema = _schema(pa, table)
+        for month in sorted(months):
+            _write_partition(pa, table, schema, month, _partition_path(directory, table, month, file_format), file_format)
+        manifest['tables'][table.name] = {'watermark': started.isoformat(), 'partitions': counts}
+        # Lưu sau mỗi bảng: bị dừng giữa chừng thì lần sau làm tiếp từ bảng chưa xong
+        _write_json(os.path.join(directory, MANIFEST_NAME), manifest)
+        summary[table.name] = sorted(months)
+    return summary
@@ -0,0 +1,191 @@
+"""
+Tác vụ định kỳ cập nhật trạng thái phòng / booking (gọi từ RoomStatusUpdateTaskView)
+
+Mỗi giai đoạn là các câu UPDATE theo tập id (chia lô CHUNK_SIZE để danh sách IN không quá dài)
+thay vì save() từng phòng / booking, nên không kích hoạt signals. Những gì signals vốn làm cho
+booking no-show được làm trực tiếp theo lô: BookingRoom hết hiệu lực, giải phóng RoomNight,
+thông báo cho khách (job 'notify', ghi một lô khi commit), đánh dấu DailyStat, cache dashboard và số phòng theo trạng thái cần tính lại.
+
+Xử lý tăng dần: mỗi giai đoạn lưu mốc (TaskWatermark) là thời điểm lần chạy gần nhất. Lần sau chỉ xét
+booking có check-in vượt ngưỡng của giai đoạn trong khoảng giữa hai lần chạy, cộng với booking / phòng
+được sửa từ mốc đó (đổi ngày nhận phòng, phòng vừa trả lại). full=True bỏ qua mốc và quét toàn bộ.
+
+run_room_status_task() chạy dưới lease (schedule.py) nên nhiều instance / cron gọi chồng nhau
+không xử lý trùng, và ghi lịch sử chạy (TaskRun).
+"""
+import time
+from datetime import timedelta
+
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from . import dashboard, jobs, rollup, room_stats, schedule
+from .inventory import local_date, release_booking_nights
+from .models import Booking, BookingRoom, BookingStatus, Room, TaskWatermark
+
+# Số id mỗi câu lệnh
+CHUNK_SIZE = 500
+
+# Booking chưa check-in sau mốc này tính là no-show
+NO_SHOW_GRACE = timedelta(hours=6)
+
+WAITING_STATUSES = (BookingStatus.PENDING, BookingStatus.CONFIRMED)
+
+# Tên lease / lịch sử chạy của tác vụ cập nhật trạng thái
+LOCK_NAME = 'room_status'
+
+# Không có lần chạy thành công trong khoảng này → scheduler coi như đã ngừng (cron chạy hằng ngày)
+STALE_AFTER = timedelta(hours=26)
+
+# Bản ghi sửa ngay trước mốc nhưng commit sau đó vẫn được xét ở lần chạy kế tiếp
+WATERMARK_OVERLAP = timedelta(minutes=5)
+
+
+def _chunks(ids, size=CHUNK_SIZE):
+    for start in range(0, len(ids), size):
+        yield ids[start:start + size]
+
+
+def _no_show_threshold(moment):
+    return moment - NO_SHOW_GRACE
+
+
+def _due_threshold(moment):
+    """Đầu ngày mai (giờ khách sạn): booking nhận phòng trước mốc này là đến hạn"""
+    return rollup.day_start(local_date(moment) + timedelta(days=1))
+
+
+def get_watermark(name):
+    return TaskWatermark.objects.filter(name=name).values_list('value', flat=True).first()
+
+
+def set_watermark(name, value):
+    TaskWatermark.objects.update_or_create(name=name, defaults={'value': value})
+
+
+def _since(last, threshold, prefix=''):
+    """
+    Q cho booking vượt ngưỡng kể từ lần chạy trước (last) hoặc được sửa từ đó.
+    last=None (chưa chạy lần nào / full) → không giới hạn.
+    """
+    if last is None:
+        return Q()
+    return (
+        Q(**{f'{prefix}check_in_date__gte': threshold(last)})
+        | Q(**{f'{prefix}updated_at__gte': last - WATERMARK_OVERLAP})
+    )
+
+
+def mark_no_shows(now, last=None):
+    """
+    Booking chờ check-in quá NO_SHOW_GRACE → NO_SHOW, giải phóng phòng và đêm đang giữ.
+    last: mốc lần chạy trước; chỉ xét booking vượt ngưỡng sau mốc đó.
+    Trả về (số booking, số phòng chuyển về available).
+    """
+    overdue = list(Booking.objects.filter(
+        _since(last, _no_show_threshold),
+        status__in=WAITING_STATUSES, check_in_date__lt=_no_show_threshold(now),
+    ).values_list('id', 'customer_id', 'check_in_date', 'created_at'))
+
+    bookings = rooms = 0
+    for chunk in _chunks(overdue):
+        ids = [booking_id for booking_id, *_ in chunk]
+        bookings += Booking.objects.filter(id__in=ids, status__in=WAITING_STATUSES).update(
+            status=BookingStatus.NO_SHOW, updated_at=now
+        )
+        BookingRoom.objects.filter(booking_id__in=ids).update(is_active=False)
+        release_booking_nights(ids)
+        rooms += Room.objects.filter(status='booked', booking_links__booking_id__in=ids).update(
+            status='available', updated_at=now
+        )
+        jobs.enqueue_many('notify', [
+            dict(
+                user_id=customer_id,
+                notification_type='booking_confirmation',
+                title='Booking đã bị hủy - No Show',
+                message=f'Booking {booking_id} đã bị hủy do không check-in đúng thời gian.'
+            )
+            for booking_id, customer_id, _, _ in chunk
+        ])
+        rollup.mark_dirty(set().union(*(rollup.booking_days(check_in, created) for _, _, check_in, created in chunk)))
+
+    if overdue:
+        dashboard.invalidate()
+    if rooms:
+        room_stats.invalidate()
+    return bookings, rooms
+
+
+def mark_rooms_booked(now, last=None):
+    """
+    Phòng còn 'available' của booking chờ check-in đã đến ngày nhận phòng (giờ khách sạn) → 'booked'.
+    last: mốc lần chạy trước; ngoài booking mới đến hạn còn xét phòng đổi trạng thái từ mốc đó
+    (vd. phòng vừa trả trong ngày của một booking đến hạn đã xét ở lần trước).
+    Trả về (số booking mới đến hạn, số phòng cập nhật).
+    """
+    tomorrow = _due_threshold(now)
+    due = Booking.objects.filter(status__in=WAITING_STATUSES, check_in_date__lt=tomorrow)
+    rooms_changed = Q() if last is None else Q(updated_at__gte=last - WATERMARK_OVERLAP)
+    room_ids = list(Room.objects.filter(
+        _since(last, _due_threshold, 'booking_links__booking__') | rooms_changed,
+        status='available', booking_links__booking__in=due,
+    ).values_list('id', flat=True).distinct())
+
+    rooms = 0
+    for chunk in _chunks(room_ids):
+        rooms += Room.objects.filter(id__in=chunk, status='available').update(status='booked', updated_at=now)
+    if rooms:
+        room_stats.invalidate()
+    return due.filter(_since(last, _due_threshold)).count(), rooms
+
+
+# (tên giai đoạn / mốc, hàm xử lý, khóa số phòng trong kết quả) theo thứ tự chạy
+PHASES = (
+    ('no_show', mark_no_shows, 'rooms_released'),
+    ('check_in_due', mark_rooms_booked, 'rooms_booked'),
+)
+
+
+def update_room_statuses(now=None, full=False):
+    """
+    Chạy các giai đoạn trong một transaction, mỗi giai đoạn từ mốc của lần chạy trước.
+    No-show chạy trước để phòng vừa được giải phóng nhưng còn booking khác đến hạn vẫn là 'booked'.
+
+    Args:
+        now: Thời điểm chạy (mặc định hiện tại)
+        full: Bỏ qua mốc, quét toàn bộ booking đang chờ
+
+    Returns:
+        dict: Số lượng, thời gian (ms) và mốc trước đó của từng giai đoạn
+    """
+    now = now or timezone.now()
+    phases = {}
+    with transaction.atomic():
+        for name, run, rooms_key in PHASES:
+            started = time.perf_counter()
+            last = None if full else get_watermark(name)
+            # Mốc lùi (đồng hồ chạy ngược / now truyền vào cũ hơn) → quét lại từ đầu cho chắc
+            if last is not None and last > now:
+                last = None
+            bookings, rooms = run(now, last)
+            set_watermark(name, now)
+            phases[name] = {
+                'bookings': bookings, rooms_key: rooms,
+                'since': last.isoformat() if last else None,
+                'duration_ms': round((time.perf_counter() - started) * 1000, 1),
+            }
+    return phases
+
+
+def rows_affected(phases):
+    """Tổng số booking và phòng được cập nhật của các giai đoạn"""
+    return sum(phases[name]['bookings'] + phases[name][rooms_key] for name, _, rooms_key in PHASES)
+
+
+def run_room_status_task(now=None, full=False):
+    """
+    update_room_statuses dưới lease LOCK_NAME, ghi TaskRun.
+    Trả về TaskRun (status SKIPPED nếu instance khác đang chạy; result là kết quả từng giai đoạn).
+    """
+    return schedule.run(LOCK_NAME, lambda: update_room_statuses(now, full), rows_affected)
@@ -1,3 +1,1211 @@
-from django.test import TestCase
+import csv
+import importlib
+import importlib.util
+import io
+import json
+import os
+import tempfile
+from datetime import date, timedelta
+from decimal import Decimal
+from types import SimpleNamespace
+from unittest import mock, skipUnless
 
-# Create your tests here.
+from django.apps import apps as django_apps
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from . import (
+    allocation, availability, dashboard, inventory, jobs, pricing, room_stats, rollup, schedule, snapshots, tasks,
+)
+from .models import (
+    Booking, BookingRoom, BookingStatus, DailyStat, InvoiceLine, Job, JobStatus, Notification, Payment, RatePeriod,
+    RevenueNight, Room, RoomNight, RoomRental, RoomType, TaskLock, TaskRun, TaskRunStatus, TaskWatermark, User,
+)
+from .cache_utils import bump_version
+from .serializers import BookingHoldSerializer, BookingSerializer
+
+
+class HotelTestCase(TestCase):
+    """Dữ liệu dùng chung: một khách hàng, một loại phòng; phòng tạo theo nhu cầu của từng test"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.customer = cls.create_user('customer')
+        cls.room_type = cls.create_room_type('Standard')
+
+    @classmethod
+    def create_user(cls, username, role='customer', **fields):
+        return User.objects.create_user(
+            username=username, email=f'{username}@example.com', password='x',
+            full_name=username.replace('_', ' ').title(), role=role, **fields
+        )
+
+    @classmethod
+    def create_room_type(cls, name, base_price=Decimal('500000'), max_guests=2, **fields):
+        return RoomType.objects.create(name=name, base_price=base_price, max_guests=max_guests, **fields)
+
+    @classmethod
+    def create_room(cls, room_number, room_type=None, **fields):
+        return Room.objects.create(room_number=room_number, room_type=room_type or cls.room_type, **fields)
+
+
+class BookingConflictValidationTests(HotelTestCase):
+    """Kiểm tra trùng lịch khi tạo booking nhiều phòng dùng số truy vấn cố định"""
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        Room.objects.bulk_create([
+            Room(room_number=f'C{i:03d}', room_type=cls.room_type) for i in range(20)
+        ])
+        cls.rooms = list(Room.objects.order_by('room_number'))
+
+        now = timezone.now()
+        cls.check_in = now + timedelta(days=3)
+        cls.check_out = now + timedelta(days=5)
+
+        # Mỗi phòng có một booking khác ngày → bitmap không loại được, buộc kiểm tra bằng DB
+        for offset, room in enumerate(cls.rooms):
+            booking = Booking.objects.create(
+                customer=cls.customer, check_in_date=now + timedelta(days=10 + offset % 5),
+                check_out_date=now + timedelta(days=11 + offset % 5),
+                total_price=Decimal('0'), guest_count=1, status=BookingStatus.CONFIRMED,
+            )
+            booking.rooms.add(room)
+        # Signal chuyển phòng sang 'booked'; chỉ kiểm tra trùng lịch theo thời gian
+        Room.objects.update(status='available')
+        cls.rooms = list(Room.objects.order_by('room_number'))
+
+    def setUp(self):
+        # on_commit không chạy trong TestCase → dựng lại chỉ mục từ dữ liệu hiện tại
+        availability.index.rebuild()
+
+    def validate(self, rooms, check_in=None, check_out=None):
+        serializer = BookingSerializer(
+            data={
+                'rooms': [room.pk for room in rooms],
+                'check_in_date': (check_in or self.check_in).isoformat(),
+                'check_out_date': (check_out or self.check_out).isoformat(),
+                'guest_count': len(rooms),
+            },
+            context={'request': SimpleNamespace(user=self.customer, data={})},
+        )
+        with CaptureQueriesContext(connection) as queries:
+            valid = serializer.is_valid()
+        return valid, serializer, len(queries)
+
+    def test_query_count_does_not_grow_with_room_count(self):
+        valid_small, _, small_queries = self.validate(self.rooms[:2], check_out=self.check_in + timedelta(days=10))
+        valid_large, _, large_queries = self.validate(self.rooms, check_out=self.check_in + timedelta(days=10))
+
+        self.assertFalse(valid_small)
+        self.assertFalse(valid_large)
+        self.assertEqual(small_queries, large_queries)
+
+    def test_reports_first_conflicting_booking(self):
+        conflict = Booking.objects.filter(rooms=self.rooms[0]).get()
+        valid, serializer, _ = self.validate(
+            self.rooms[:3], check_in=conflict.check_in_date - timedelta(hours=2),
+            check_out=conflict.check_in_date + timedelta(hours=2),
+        )
+
+        self.assertFalse(valid)
+        self.assertIn(f'Booking #{conflict.id}', str(serializer.errors['rooms']))
+
+    def test_free_rooms_pass_validation(self):
+        valid, serializer, _ = self.validate(self.rooms)
+
+        self.assertTrue(valid, serializer.errors)
+
+    def quote_batch(self, items):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post('/api/bookings/calculate-price-batch/', {'items': items}, content_type='application/json')
+        self.assertEqual(response.status_code, 200, response.content)
+        return response.json()['results'], len(queries)
+
+    def test_batch_quote_uses_fixed_query_count(self):
+        conflict = Booking.objects.filter(rooms=self.rooms[0]).get()
+        check_in = conflict.check_in_date.strftime('%Y-%m-%d')
+        check_out = (conflict.check_in_date + timedelta(days=2)).strftime('%Y-%m-%d')
+        item = {'check_in_date': check_in, 'check_out_date': check_out, 'guest_count': 3}
+
+        self.quote_batch([{**item, 'room_id': self.rooms[1].pk}])  # nạp bảng giá / phiên bản cache
+        _, small_queries = self.quote_batch([{**item, 'room_id': self.rooms[1].pk}])
+        results, large_queries = self.quote_batch(
+            [{**item, 'room_id': room.pk} for room in self.rooms] + [{**item, 'room_type': self.room_type.pk}]
+        )
+
+        self.assertEqual(small_queries, large_queries)
+        self.assertFalse(results[0]['available'])
+        self.assertIn('đã được đặt', results[0]['reason'])
+        # 3 khách / phòng 2 chỗ: 1 khách dư → phụ thu 25% mặc định, 2 đêm
+        self.assertEqual(results[1]['total_price'], 1250000.0)
+        self.assertTrue(results[-1]['available'])
+        self.assertEqual(results[-1]['total_price'], 1250000.0)
+
+    def test_batch_quote_validates_each_item_and_caps_size(self):
+        today = inventory.local_date(timezone.now())
+        item = {'room_id': self.rooms[1].pk, 'guest_count': 1}
+        results, _ = self.quote_batch([
+            {**item, 'check_in_date': str(today - timedelta(days=1)), 'check_out_date': str(today + timedelta(days=1))},
+            {**item, 'check_in_date': str(today + timedelta(days=2)), 'check_out_date': str(today + timedelta(days=2))},
+            {**item, 'check_in_date': str(today + timedelta(days=1)), 'check_out_date': str(today + timedelta(days=2))},
+        ])
+        self.assertIn('quá khứ', results[0]['error'])
+        self.assertIn('trước ngày trả phòng', results[1]['error'])
+        self.assertNotIn('error', results[2])
+
+        items = [{**item, 'check_in_date': str(today), 'check_out_date': str(today + timedelta(days=1))}]
+        response = self.client.post(
+            '/api/bookings/calculate-price-batch/', {'items': items * 51}, content_type='application/json'
+        )
+        self.assertEqual(response.status_code, 400)
+
+
+class AvailabilityIndexTests(HotelTestCase):
+    """Chỉ mục bitmap phòng trống: dựng lại khi lệch phiên bản, không chạm DB giữa hai lần kiểm tra"""
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        cls.room = cls.create_room('I001')
+
+    def setUp(self):
+        self.check_in = timezone.now() + timedelta(days=3)
+        self.check_out = self.check_in + timedelta(days=2)
+        self.nights = (inventory.local_date(self.check_in), inventory.local_date(self.check_out))
+
+    def _book_elsewhere(self, check_in, check_out):
+        """Booking do "process khác" ghi: on_commit (cập nhật chỉ mục cục bộ) không chạy"""
+        with self.captureOnCommitCallbacks(execute=False):
+            booking = Booking.objects.create(
+                customer=self.customer, check_in_date=check_in, check_out_date=check_out,
+                total_price=Decimal('0'), guest_count=1,
+            )
+            booking.rooms.add(self.room)
+        return booking
+
+    def test_stale_version_triggers_rebuild(self):
+        index = availability.AvailabilityIndex(version_check=0)
+        index.rebuild()
+        with mock.patch.object(index, 'rebuild', wraps=index.rebuild) as rebuild:
+            index.ensure_fresh()
+            rebuild.assert_not_called()
+            bump_version(availability.VERSION_NAME)
+            index.ensure_fresh()
+            rebuild.assert_called_once()
+
+    def test_booking_from_another_process_is_seen_after_version_bump(self):
+        index = availability.AvailabilityIndex(version_check=0)
+        index.rebuild()
+        self._book_elsewhere(self.check_in, self.check_out)
+        self.assertEqual(index.free_among({self.room.pk}, *self.nights), {self.room.pk})
+
+        bump_version(availability.VERSION_NAME)
+        self.assertEqual(index.free_among({self.room.pk}, *self.nights), set())
+        self.assertEqual(index.busy_room_ids(*self.nights), {self.room.pk})
+
+    def test_version_checks_are_throttled(self):
+        index = availability.AvailabilityIndex(version_check=60)
+        index.rebuild()
+        bump_version(availability.VERSION_NAME)
+        with self.assertNumQueries(0):
+            for _ in range(5):
+                index.free_among({self.room.pk}, *self.nights)
+
+    def test_dates_outside_window_fall_back_to_database(self):
+        now = timezone.now()
+        past = self._book_elsewhere(now - timedelta(days=6), now - timedelta(days=4))
+        availability.index.rebuild()
+        start, end = inventory.local_date(past.check_in_date), inventory.local_date(past.check_out_date)
+
+        self.assertIsNone(availability.index.free_among({self.room.pk}, start, end))
+        self.assertEqual(inventory.rooms_to_verify({self.room.pk}, past.check_in_date, past.check_out_date), {self.room.pk})
+        conflicts = inventory.find_conflicting_bookings([self.room], past.check_in_date, past.check_out_date)
+        self.assertEqual(conflicts[self.room.pk].pk, past.pk)
+
+
+class BookingRoomSyncTests(HotelTestCase):
+    """BookingRoom sao chép khoảng lưu trú và trạng thái của booking"""
+
+    def test_stay_window_and_active_flag_follow_booking(self):
+        room = self.create_room('S001')
+        now = timezone.now()
+        booking = Booking.objects.create(
+            customer=self.customer, check_in_date=now + timedelta(days=1),
+            check_out_date=now + timedelta(days=2), total_price=Decimal('0'), guest_count=1,
+        )
+        booking.rooms.add(room)
+
+        link = BookingRoom.objects.get(booking=booking, room=room)
+        self.assertEqual(link.check_in_date, booking.check_in_date)
+        self.assertEqual(link.check_out_date, booking.check_out_date)
+        self.assertTrue(link.is_active)
+
+        booking.check_out_date = now + timedelta(days=3)
+        booking.status = BookingStatus.CANCELLED
+        booking.save()
+
+        link.refresh_from_db()
+        self.assertEqual(link.check_out_date, booking.check_out_date)
+        self.assertFalse(link.is_active)
+
+    def test_save_does_not_refetch_booking(self):
+        room = self.create_room('S101')
+        now = timezone.now()
+        created = Booking.objects.create(
+            customer=self.customer, check_in_date=now + timedelta(days=1),
+            check_out_date=now + timedelta(days=2), total_price=Decimal('0'), guest_count=1,
+        )
+        created.rooms.add(room)
+
+        booking = Booking.objects.get(pk=created.pk)
+        booking.status = BookingStatus.CHECKED_IN
+        with CaptureQueriesContext(connection) as queries:
+            booking.save(update_fields=['status', 'updated_at'])
+        booking_selects = [
+            query for query in queries
+            if query['sql'].startswith('SELECT') and 'FROM "hotelplatform_booking"' in query['sql']
+        ]
+        self.assertEqual(booking_selects, [])
+        # Thay đổi trạng thái vẫn được nhận ra từ giá trị lúc nạp
+        self.assertEqual(booking._original_status, BookingStatus.PENDING)
+        self.assertEqual(Room.objects.get(pk=room.pk).status, 'occupied')
+
+        # Lần lưu tiếp theo so với giá trị vừa ghi
+        booking.status = BookingStatus.CHECKED_OUT
+        booking.save(update_fields=['status', 'updated_at'])
+        self.assertEqual(booking._original_status, BookingStatus.CHECKED_IN)
+        self.assertEqual(Room.objects.get(pk=room.pk).status, 'available')
+
+
+class RoomNightLedgerTests(HotelTestCase):
+    """Sổ phòng theo đêm đi theo booking (tạo, đổi ngày, hủy) và là nguồn cho /rooms/available/"""
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        cls.room = cls.create_room('L001')
+        cls.free_room = cls.create_room('L002')
+
+    def setUp(self):
+        availability.index.rebuild()
+
+    def book(self, check_in, check_out):
+        with self.captureOnCommitCallbacks(execute=True):
+            booking = Booking.objects.create(
+                customer=self.customer, check_in_date=check_in, check_out_date=check_out,
+                total_price=Decimal('0'), guest_count=1,
+            )
+            booking.rooms.add(self.room)
+        # Tín hiệu đổi trạng thái phòng sang 'booked'; trả lại để chỉ sổ phòng quyết định phòng trống
+        Room.objects.filter(pk=self.room.pk).update(status='available')
+        return booking
+
+    def nights(self, booking):
+        return list(RoomNight.objects.filter(booking=booking).order_by('date').values_list('room_id', 'date'))
+
+    def test_nights_follow_booking_create_redate_and_cancel(self):
+        now = timezone.now()
+        booking = self.book(now + timedelta(days=2), now + timedelta(days=4))
+        start = inventory.local_date(booking.check_in_date)
+        self.assertEqual(self.nights(booking), [(self.room.pk, start), (self.room.pk, start + timedelta(days=1))])
+
+        booking.check_in_date += timedelta(days=1)
+        booking.check_out_date += timedelta(days=2)
+        booking.save()
+        self.assertEqual(
+            self.nights(booking),
+            [(self.room.pk, start + timedelta(days=i)) for i in (1, 2, 3)],
+        )
+
+        booking.status = BookingStatus.CANCELLED
+        booking.save()
+        self.assertEqual(self.nights(booking), [])
+
+    def available_ids(self, check_in, check_out):
+        response = APIClient().get('/rooms/available/', {'check_in': check_in, 'check_out': check_out})
+        self.assertEqual(response.status_code, 200)
+        return {room['id'] for room in response.json()}
+
+    def test_available_endpoint_excludes_booked_rooms(self):
+        now = timezone.now()
+        # Trong cửa sổ chỉ mục bitmap và trước cửa sổ (anti-join trên DB)
+        for offset in (2, -6):
+            booking = self.book(now + timedelta(days=offset), now + timedelta(days=offset + 2))
+            check_in, check_out = inventory.local_date(booking.check_in_date), inventory.local_date(booking.check_out_date)
+
+            self.assertEqual(self.available_ids(check_in, check_out), {self.free_room.pk})
+            self.assertEqual(self.available_ids(check_out, check_out + timedelta(days=1)), {self.room.pk, self.free_room.pk})
+
+    def test_backfill_migration_rebuilds_ledger(self):
+        now = timezone.now()
+        active = self.book(now + timedelta(days=2), now + timedelta(days=4))
+        cancelled = self.book(now + timedelta(days=6), now + timedelta(days=7))
+        cancelled.status = BookingStatus.CANCELLED
+        cancelled.save()
+        expected = set(RoomNight.objects.values_list('room_id', 'booking_id', 'date'))
+        self.assertEqual({booking_id for _, booking_id, _ in expected}, {active.pk})
+
+        RoomNight.objects.all().delete()
+        migration = importlib.import_module('hotelplatform.migrations.0003_roomnight')
+        migration.backfill_room_nights(django_apps, connection.schema_editor())
+
+        self.assertEqual(set(RoomNight.objects.values_list('room_id', 'booking_id', 'date')), expected)
+
+
+class RoomHoldTests(HotelTestCase):
+    """Hold tạm thời và ràng buộc unique (room, date) của sổ phòng"""
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        cls.other = cls.create_user('hold_other')
+        cls.room = cls.create_room('H001')
+
+    def setUp(self):
+        now = timezone.now()
+        self.check_in = now + timedelta(days=2)
+        self.check_out = now + timedelta(days=4)
+        availability.index.rebuild()
+
+    def book(self, hold_token=None, user=None):
+        data = {
+            'rooms': [self.room.pk],
+            'check_in_date': self.check_in.isoformat(),
+            'check_out_date': self.check_out.isoformat(),
+            'guest_count': 1,
+        }
+        if hold_token:
+            data['hold_token'] = hold_token
+        return BookingSerializer(data=data, context={'request': SimpleNamespace(user=user or self.customer, data=data)})
+
+    def test_second_hold_on_same_nights_conflicts(self):
+        inventory.acquire_hold([self.room], self.check_in, self.check_out, self.customer)
+
+        with self.assertRaises(inventory.HoldConflict) as ctx:
+            inventory.acquire_hold([self.room], self.check_in + timedelta(days=1), self.check_out, self.other)
+        self.assertEqual(ctx.exception.room_ids, {self.room.pk})
+
+    def test_new_hold_releases_previous_hold_of_same_user(self):
+        other_room = self.create_room('H002')
+        first_token, _ = inventory.acquire_hold([self.room], self.check_in, self.check_out, self.customer)
+        second_token, _ = inventory.acquire_hold([other_room], self.check_in, self.check_out, self.customer)
+
+        self.assertFalse(RoomNight.objects.filter(hold_token=first_token).exists())
+        self.assertEqual(RoomNight.objects.filter(held_by=self.customer).count(), 2)
+        self.assertEqual(
+            set(RoomNight.objects.filter(hold_token=second_token).values_list('room_id', flat=True)), {other_room.pk}
+        )
+        # Phòng của hold cũ giữ được bởi người khác
+        inventory.acquire_hold([self.room], self.check_in, self.check_out, self.other)
+
+    def test_only_holder_can_claim_or_release_hold(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            hold_token, _ = inventory.acquire_hold([self.room], self.check_in, self.check_out, self.customer)
+
+        self.assertEqual(inventory.release_hold(hold_token, self.other), 0)
+        # Token của người khác không miễn kiểm tra hold
+        self.assertEqual(
+            inventory.find_held_rooms([self.room], self.check_in, self.check_out, hold_token, holder=self.other),
+            {self.room.pk},
+        )
+        self.assertEqual(inventory.release_hold(hold_token, self.customer), 2)
+
+    def test_booking_claims_own_hold_and_rejects_others(self):
+        # Chỉ mục phòng trống cập nhật khi commit
+        with self.captureOnCommitCallbacks(execute=True):
+            hold_token, _ = inventory.acquire_hold([self.room], self.check_in, self.check_out, self.customer)
+
+        self.assertFalse(self.book().is_valid())
+        self.assertFalse(self.book(hold_token, user=self.other).is_valid())
+
+        serializer = self.book(hold_token)
+        self.assertTrue(serializer.is_valid(), serializer.errors)
+        booking = serializer.save()
+
+        self.assertFalse(RoomNight.objects.filter(hold_token=hold_token).exists())
+        self.assertEqual(RoomNight.objects.filter(booking=booking).count(), 2)
+
+    def hold_serializer(self, **overrides):
+        data = {
+            'rooms': [self.room.pk],
+            'check_in_date': self.check_in.isoformat(),
+            'check_out_date': self.check_out.isoformat(),
+            **overrides,
+        }
+        return BookingHoldSerializer(data=data)
+
+    def test_hold_rejects_past_check_in(self):
+        self.assertTrue(self.hold_serializer().is_valid())
+        serializer = self.hold_serializer(check_in_date=(timezone.now() - timedelta(days=1)).isoformat())
+        self.assertFalse(serializer.is_valid())
+        self.assertIn('check_in_date', serializer.errors)
+
+    def test_hold_rejects_unavailable_room(self):
+        Room.objects.filter(pk=self.room.pk).update(status='maintenance')
+        serializer = self.hold_serializer()
+        self.assertFalse(serializer.is_valid())
+        self.assertIn('rooms', serializer.errors)
+
+    def test_expired_hold_does_not_block_booking(self):
+        inventory.acquire_hold([self.room], self.check_in, self.check_out, self.customer, ttl_seconds=-1)
+
+        serializer = self.book()
+        self.assertTrue(serializer.is_valid(), serializer.errors)
+        booking = serializer.save()
+        self.assertEqual(RoomNight.objects.filter(room=self.room).count(), 2)
+        self.assertTrue(RoomNight.objects.filter(booking=booking).exists())
+
+
+class SuggestCombinationsTests(HotelTestCase):
+    """Gợi ý tổ hợp phòng rẻ nhất dùng cùng quy tắc phân bổ khách"""
+
+    def test_returns_cheapest_combinations_in_price_order(self):
+        single = self.create_room_type('Single', base_price=Decimal('300000'), max_guests=1)
+        double = self.create_room_type('Double')
+        family = self.create_room_type('Family', base_price=Decimal('900000'), max_guests=4)
+        rooms = [
+            self.create_room(f'{room_type.name}-{i}', room_type)
+            for room_type in (single, double, family) for i in range(3)
+        ]
+        for room in rooms:
+            room.room_type.refresh_from_db()
+
+        combinations = allocation.suggest_combinations(rooms, guest_count=4, stay_days=2, k=3)
+
+        prices = [combination['total_price'] for combination in combinations]
+        self.assertEqual(len(combinations), 3)
+        self.assertEqual(prices, sorted(prices))
+        # 4 khách: 1 phòng Family (900k x 2 đêm) rẻ hơn 2 phòng Double (1.000k x 2 đêm)
+        self.assertEqual([room.room_type for room in combinations[0]['rooms']], [family])
+        self.assertEqual(prices[0], Decimal('1800000'))
+        for combination in combinations:
+            expected = Booking.calculate_price_for_multiple_rooms(combination['rooms'], 4, 2)
+            self.assertEqual(combination['total_price'], expected['total_price'])
+            self.assertNotIn(0, combination['guest_allocation'])
+
+
+class PricingEngineTests(HotelTestCase):
+    """Engine tính giá dùng chung: phân bổ khách giữa các phòng và làm mới khi loại phòng đổi giá"""
+
+    @classmethod
+    def setUpTestData(cls):
+        # Không cần khách hàng; loại phòng riêng có phụ thu
+        cls.room_type = cls.create_room_type(
+            'Pricing', base_price=Decimal('400000'), extra_guest_surcharge=Decimal('25')
+        )
+        cls.rooms = [cls.create_room(f'P{i:03d}') for i in range(2)]
+
+    def test_surcharge_applies_only_to_allocated_excess_guests(self):
+        quote = pricing.quote_rooms(self.rooms, guest_count=5, nights=2)
+
+        # 5 khách / 2 phòng x 2 chỗ: chỉ 1 khách dư → phụ thu 25% một lần mỗi đêm
+        self.assertEqual(quote['guest_allocation'], [3, 2])
+        self.assertEqual(quote['total_price'], Decimal('1800000'))
+
+    def test_room_type_change_refreshes_rates(self):
+        pricing.quote_rooms(self.rooms, guest_count=2, nights=1)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.room_type.base_price = Decimal('600000')
+            self.room_type.save()
+
+        self.assertEqual(pricing.quote_rooms(self.rooms, guest_count=2, nights=1)['total_price'], Decimal('1200000'))
+
+    def test_refresh_publishes_new_state_without_mutating_old(self):
+        table = pricing.RateTable()
+        table.reload()
+        before = table._state
+        start, old_rates, old_nightly = before
+        old_array = old_nightly[self.room_type.pk]
+
+        RoomType.objects.filter(pk=self.room_type.pk).update(base_price=Decimal('600000'))
+        table.refresh_types([self.room_type.pk])
+
+        # Luồng đọc đang giữ bản cũ vẫn thấy bảng đầy đủ, nhất quán
+        self.assertIs(before[2], old_nightly)
+        self.assertIs(old_nightly[self.room_type.pk], old_array)
+        self.assertEqual(old_rates[self.room_type.pk].base_price, Decimal('400000'))
+        self.assertIsNot(table._state, before)
+        self.assertEqual(table._state[0], start)
+        self.assertEqual(table.stay_total(self.room_type.pk, start + timedelta(days=1), 2), Decimal('1200000'))
+
+    def test_price_calendar_matches_single_room_quote(self):
+        response = self.client.get('/room-types/price-calendar/', {'days': 3})
+        self.assertEqual(response.status_code, 200, response.content)
+
+        room_type = next(item for item in response.json()['room_types'] if item['id'] == self.room_type.pk)
+        self.assertEqual(room_type['max_allowed_guests'], 3)
+        for guest_count, prices in room_type['prices'].items():
+            expected = pricing.quote_rooms(self.rooms[:1], int(guest_count), 1)['total_price']
+            self.assertEqual(prices, [f'{expected:.2f}'] * 3)
+
+    def test_rate_period_overrides_nightly_price(self):
+        check_in = timezone.now() + timedelta(days=5)
+        start = inventory.local_date(check_in)
+        pricing.quote_rooms(self.rooms, guest_count=2, nights=1)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            RatePeriod.objects.create(
+                room_type=self.room_type, name='Cao điểm', price=Decimal('700000'),
+                start_date=start + timedelta(days=1), end_date=start + timedelta(days=2),
+            )
+
+        # 4 đêm: 400k, 700k, 700k, 400k
+        quote = pricing.quote_rooms(self.rooms[:1], guest_count=2, nights=4, check_in=check_in)
+        self.assertEqual(quote['total_price'], Decimal('2200000'))
+        # Ngoài cửa sổ dựng sẵn (hóa đơn lượt ở cũ) vẫn áp đúng khoảng giá
+        old_check_in = check_in - timedelta(days=365)
+        RatePeriod.objects.create(
+            room_type=self.room_type, price=Decimal('100000'),
+            start_date=start - timedelta(days=365), end_date=start - timedelta(days=365),
+        )
+        quote = pricing.quote_rooms(self.rooms[:1], guest_count=3, nights=2, check_in=old_check_in)
+        self.assertEqual(quote['total_price'], Decimal('625000'))
+
+
+class InvoiceLineTests(HotelTestCase):
+    """Khoản phí hóa đơn được chụp lúc thanh toán, không tính lại khi đọc"""
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.customer)
+
+    def create_payment(self, index):
+        room = self.create_room(f'I{index:03d}')
+        now = timezone.now()
+        rental = RoomRental.objects.create(
+            customer=self.customer, check_in_date=now - timedelta(days=2), check_out_date=now,
+            total_price=Decimal('0'), guest_count=3,
+        )
+        rental.rooms.add(room)
+        payment = Payment.objects.create(
+            rental=rental, customer=self.customer, amount=Decimal('1250000'),
+            payment_method='cash', status=True, transaction_id=f'INV-{index}',
+        )
+        payment.snapshot_lines()
+        return payment
+
+    def list_invoices(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get('/invoices/')
+        self.assertEqual(response.status_code, 200, response.content)
+        return response.json(), len(queries)
+
+    def test_lines_are_snapshotted_and_listed_with_fixed_queries(self):
+        payment = self.create_payment(0)
+        line = InvoiceLine.objects.get(payment=payment)
+        # 3 khách / phòng 2 chỗ, 2 đêm: 1.000.000 + phụ thu 25%
+        self.assertEqual((line.surcharge, line.subtotal), (Decimal('250000'), Decimal('1250000')))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.room_type.base_price = Decimal('900000')
+            self.room_type.save()
+        invoices, one_query_count = self.list_invoices()
+        self.assertEqual(invoices[0]['items'][0]['subtotal'], 1250000.0)
+
+        for index in range(1, 4):
+            self.create_payment(index)
+        invoices, many_query_count = self.list_invoices()
+        self.assertEqual(len(invoices), 4)
+        self.assertEqual(one_query_count, many_query_count)
+
+    def export_invoices(self, file_format):
+        response = self.client.get(f'/invoices/export/?file_format={file_format}')
+        self.assertEqual(response.status_code, 200)
+        with CaptureQueriesContext(connection) as queries:
+            content = b''.join(response.streaming_content).decode()
+        return content, len(queries)
+
+    def test_export_streams_rows_with_fixed_queries(self):
+        self.create_payment(0)
+        content, one_query_count = self.export_invoices('jsonl')
+        row = json.loads(content.splitlines()[0])
+        self.assertEqual((row['rooms'], row['subtotal']), ('I000', '1250000.00'))
+
+        for index in range(1, 4):
+            self.create_payment(index)
+        content, many_query_count = self.export_invoices('csv')
+        rows = list(csv.DictReader(io.StringIO(content)))
+        self.assertEqual(len(rows), 4)
+        self.assertEqual(one_query_count, many_query_count)
+        self.assertEqual(self.client.get('/invoices/export/?file_format=xml').status_code, 400)
+
+
+class DailyStatRollupTests(HotelTestCase):
+    """Bảng thống kê theo ngày được cập nhật qua signals và khớp với backfill"""
+
+    def test_rollup_tracks_changes_and_matches_backfill(self):
+        rooms = [self.create_room(f'R{i:03d}') for i in range(2)]
+        now = timezone.now()
+        today = inventory.local_date(now)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            booking = Booking.objects.create(
+                customer=self.customer, check_in_date=now + timedelta(days=3), check_out_date=now + timedelta(days=5),
+                total_price=Decimal('0'), guest_count=2,
+            )
+            booking.rooms.add(*rooms)
+        with self.captureOnCommitCallbacks(execute=True):
+            rental = RoomRental.objects.create(
+                customer=self.customer, check_in_date=now - timedelta(days=2), check_out_date=now,
+                total_price=Decimal('0'), guest_count=2,
+            )
+            rental.rooms.add(*rooms)
+            Payment.objects.create(
+                rental=rental, customer=self.customer, amount=Decimal('2000000'),
+                payment_method='cash', status=True, transaction_id='ROLLUP-1',
+            ).snapshot_lines()
+
+        window = (today - timedelta(days=5), today + timedelta(days=10))
+        stats = rollup.totals(*window, room_type=self.room_type)
+        self.assertEqual(stats['bookings_created'], 1)
+        self.assertEqual(stats['occupied_room_nights'], 4)
+        self.assertEqual(stats['revenue'], Decimal('2000000'))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            booking.status = BookingStatus.CANCELLED
+            booking.save()
+        self.assertEqual(rollup.totals(*window)['cancellations'], 1)
+
+        fields = ('date', 'room_type_id', *rollup.METRICS)
+        incremental = sorted(DailyStat.objects.values_list(*fields))
+        DailyStat.objects.all().delete()
+        rollup.backfill(*window)
+        self.assertEqual(sorted(DailyStat.objects.values_list(*fields)), incremental)
+
+    def test_revenue_is_recognized_per_night_across_months(self):
+        room = self.create_room('N001')
+        check_in = rollup.day_start(date(2026, 1, 31)) + timedelta(hours=14)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            rental = RoomRental.objects.create(
+                customer=self.customer, check_in_date=check_in, check_out_date=check_in + timedelta(days=2),
+                total_price=Decimal('0'), guest_count=1,
+            )
+            rental.rooms.add(room)
+            Payment.objects.create(
+                rental=rental, customer=self.customer, amount=Decimal('1000001'),
+                payment_method='cash', status=True, transaction_id='NIGHT-1',
+            ).snapshot_lines()
+
+        self.assertEqual(
+            list(RevenueNight.objects.values_list('date', 'room_type_id', 'amount')),
+            [
+                (date(2026, 1, 31), self.room_type.id, Decimal('500000.50')),
+                (date(2026, 2, 1), self.room_type.id, Decimal('500000.50')),
+            ]
+        )
+        by_month = rollup.monthly_totals(date(2026, 1, 1), date(2026, 3, 1))
+        self.assertEqual([data['revenue'] for data in by_month.values()], [Decimal('500000.50')] * 2)
+
+    def test_payment_and_rental_saves_use_loaded_values(self):
+        room = self.create_room('G001')
+        now = timezone.now()
+        with self.captureOnCommitCallbacks(execute=True):
+            rental = RoomRental.objects.create(
+                customer=self.customer, check_in_date=now - timedelta(days=2), check_out_date=now,
+                total_price=Decimal('0'), guest_count=1,
+            )
+            rental.rooms.add(room)
+            Payment.objects.create(
+                rental=rental, customer=self.customer, amount=Decimal('1000000'),
+                payment_method='cash', status=True, transaction_id='GATE-1',
+            )
+
+        payment = Payment.objects.get(transaction_id='GATE-1')
+        payment.payment_method = 'vnpay'
+        with CaptureQueriesContext(connection) as queries:
+            payment.save()
+        self.assertFalse([query for query in queries if 'hotelplatform_revenuenight' in query['sql']])
+
+        payment.amount = Decimal('1200000')
+        payment.save()
+        self.assertEqual(sum(RevenueNight.objects.values_list('amount', flat=True)), Decimal('1200000'))
+
+        rental = RoomRental.objects.get(pk=rental.pk)
+        rental.check_out_date = now + timedelta(days=1)
+        with CaptureQueriesContext(connection) as queries:
+            rental.save(update_fields=['check_out_date', 'updated_at'])
+        self.assertFalse([
+            query for query in queries
+            if query['sql'].startswith('SELECT') and 'FROM "hotelplatform_roomrental"' in query['sql']
+        ])
+        self.assertEqual(
+            rental._original_rollup_days, rollup.rental_days(now - timedelta(days=2), now)
+        )
+
+
+@override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'stats'}})
+class StatsViewQueryBudgetTests(HotelTestCase):
+    """StatsView dùng số truy vấn cố định, không phụ thuộc lượng dữ liệu; kết quả được cache"""
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        cls.owner = cls.create_user('stats_owner', role='owner')
+
+    def setUp(self):
+        cache.clear()
+        dashboard.reset_counters()
+        self.client = APIClient()
+        self.client.force_authenticate(self.owner)
+
+    def add_rentals(self, start, count):
+        with self.captureOnCommitCallbacks(execute=True):
+            self._add_rentals(start, count)
+
+    def _add_rentals(self, start, count):
+        now = timezone.now()
+        for i in range(start, start + count):
+            room = self.create_room(f'S{i:03d}')
+            booking = Booking.objects.create(
+                customer=self.customer, check_in_date=now + timedelta(days=1), check_out_date=now + timedelta(days=2),
+                total_price=Decimal('500000'), guest_count=1,
+            )
+            booking.rooms.add(room)
+            rental = RoomRental.objects.create(
+                customer=self.customer, check_in_date=now - timedelta(days=1), check_out_date=now,
+                total_price=Decimal('500000'), guest_count=1,
+            )
+            rental.rooms.add(room)
+            Payment.objects.create(
+                rental=rental, customer=self.customer, amount=Decimal('500000'),
+                payment_method='cash', status=True, transaction_id=f'STATS-{i}',
+            )
+
+    def test_query_count_is_fixed(self):
+        # Khách sạn dùng giờ Việt Nam: tháng hiện tại của DailyStat là tháng theo giờ địa phương
+        today = inventory.local_date(timezone.now())
+        url = f'/api/stats/?year={today.year}&month={today.month}'
+        self.add_rentals(0, 1)
+        with self.assertNumQueries(7):
+            response = self.client.get(url)
+        self.assertEqual(len(response.json()['topRooms']), 1)
+
+        self.add_rentals(1, 8)
+        with self.assertNumQueries(7):
+            response = self.client.get(url)
+        self.assertEqual(len(response.json()['topRooms']), 5)
+        self.assertEqual(len(response.json()['recentBookings']), 5)
+
+    def test_snapshot_is_cached_and_invalidated_on_save(self):
+        today = inventory.local_date(timezone.now())
+        url = f'/api/stats/?year={today.year}&month={today.month}'
+        self.add_rentals(0, 1)
+        self.assertEqual(self.client.get(url)['X-Cache'], 'MISS')
+        with self.assertNumQueries(0):
+            response = self.client.get(url)
+        self.assertEqual(response['X-Cache'], 'HIT')
+
+        # Owner không được bỏ qua cache; admin thì được
+        self.assertEqual(self.client.get(url + '&fresh=1')['X-Cache'], 'HIT')
+        self.owner.role = 'admin'
+        self.assertEqual(self.client.get(url + '&fresh=1')['X-Cache'], 'MISS')
+
+        self.add_rentals(1, 1)
+        response = self.client.get(url)
+        self.assertEqual(response['X-Cache'], 'MISS')
+        self.assertEqual(response.json()['totalBookings'], 2)
+        counters = self.client.get('/api/stats/cache/').json()
+        self.assertEqual((counters['hits'], counters['misses']), (2, 3))
+
+    def test_out_of_range_year_falls_back_to_current_year(self):
+        today = inventory.local_date(timezone.now())
+        expected = self.client.get(f'/api/stats/?year={today.year}&month=1').json()
+        for year in (0, 1, 9999, 10000):
+            response = self.client.get(f'/api/stats/?year={year}&month=1')
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(response['X-Cache'], 'HIT')
+            self.assertEqual(response.json(), expected)
+
+    def test_series_buckets_partial_periods_in_fixed_queries(self):
+        self.add_rentals(0, 2)
+        today = inventory.local_date(timezone.now())
+        start = today - timedelta(days=400)
+        url = f'/api/stats/series/?from={start}&to={today}&granularity=month&metric=revenue,occupancy'
+        with self.assertNumQueries(2):
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200, response.content)
+        series = response.json()['series']
+        # Kỳ đầu bắt đầu từ đầu tháng chứa from, liên tục từng tháng, không trùng / thiếu
+        self.assertEqual(series[0]['period'], start.replace(day=1).isoformat())
+        self.assertEqual(len({point['period'] for point in series}), len(series))
+        self.assertEqual(set(series[-1]), {'period', 'revenue', 'occupancy'})
+        self.assertEqual(sum(point['revenue'] for point in series), 1000000.0)
+
+        bad = self.client.get(f'/api/stats/series/?from={today}&to={start}')
+        self.assertEqual(bad.status_code, 400)
+
+    def test_low_performance_ranks_rooms_against_peers(self):
+        self.add_rentals(0, 3)
+        idle = self.create_room('S999')
+        with self.assertNumQueries(2):
+            response = self.client.get('/rooms/low_performance/?days=30&limit=2')
+        self.assertEqual(response.status_code, 200, response.content)
+        rooms = response.json()['rooms']
+        self.assertEqual(len(rooms), 2)
+        self.assertEqual((rooms[0]['room_id'], rooms[0]['rank'], rooms[0]['occupied_nights']), (idle.id, 1, 0))
+        # 1 phòng trống / 4 phòng cùng loại → percentile 12.5; phòng có khách: (1 + 3/2) / 4
+        self.assertEqual(rooms[0]['occupancy_percentile'], 12.5)
+        self.assertEqual(rooms[1]['occupancy_percentile'], 62.5)
+        self.assertEqual(rooms[1]['revenue'], 500000.0)
+
+
+@skipUnless(importlib.util.find_spec('pyarrow'), 'cần pyarrow')
+class AnalyticsSnapshotTests(HotelTestCase):
+    """Snapshot Parquet chỉ ghi lại các tháng thay đổi từ lần xuất trước"""
+
+    def test_incremental_export_rewrites_only_changed_months(self):
+        now = timezone.now()
+        booking = Booking.objects.create(
+            customer=self.customer, check_in_date=now + timedelta(days=1), check_out_date=now + timedelta(days=2),
+            total_price=Decimal('0'), guest_count=1,
+        )
+        month = inventory.local_date(booking.created_at).strftime('%Y-%m')
+        with tempfile.TemporaryDirectory() as directory:
+            self.assertEqual(snapshots.export(directory)['bookings'], [month])
+            path = os.path.join(directory, 'bookings', f'month={month}', 'part.parquet')
+            self.assertTrue(os.path.exists(path))
+
+            # Dời watermark quá thời điểm tạo (hơn WATERMARK_OVERLAP) → lần xuất sau không có dòng nào mới sửa
+            manifest = snapshots.load_manifest(directory)
+            for state in manifest['tables'].values():
+                state['watermark'] = (now + timedelta(hours=1)).isoformat()
+            with open(os.path.join(directory, snapshots.MANIFEST_NAME), 'w') as file:
+                json.dump(manifest, file)
+            self.assertEqual(snapshots.export(directory)['bookings'], [])
+
+            # Bản ghi bị xóa không có updated_at → phát hiện qua số dòng của tháng
+            booking.delete()
+            self.assertEqual(snapshots.export(directory)['bookings'], [month])
+            self.assertFalse(os.path.exists(path))
+
+    def test_admin_export_is_queued_for_worker(self):
+        admin = User.objects.create_superuser(
+            username='snapshot_admin', email='snapshot_admin@example.com', password='x', full_name='Snapshot Admin'
+        )
+        self.client.force_login(admin)
+        url = '/hotel-admin/analytics-snapshots/'
+        with tempfile.TemporaryDirectory() as directory, self.settings(ANALYTICS_SNAPSHOT_DIR=directory):
+            self.assertEqual(self.client.post(url, {'format': 'csv'}).status_code, 400)
+            with self.captureOnCommitCallbacks(execute=True):
+                response = self.client.post(url, {'format': 'parquet'})
+            self.assertEqual(response.status_code, 202)
+            self.assertEqual(self.client.get(url).json()['export']['status'], JobStatus.PENDING)
+            self.assertFalse(os.path.exists(os.path.join(directory, snapshots.MANIFEST_NAME)))
+
+            self.assertEqual(jobs.work('test'), 1)
+            data = self.client.get(url).json()
+            self.assertEqual(data['export']['status'], JobStatus.DONE)
+            self.assertEqual(data['format'], 'parquet')
+
+
+class RoomStatusTaskTests(HotelTestCase):
+    """Tác vụ cập nhật trạng thái phòng chạy theo lô với số truy vấn không đổi theo lượng dữ liệu"""
+
+    def setUp(self):
+        self.now = timezone.now()
+
+    def _booking(self, number, check_in):
+        room = self.create_room(number)
+        booking = Booking.objects.create(
+            customer=self.customer, check_in_date=check_in, check_out_date=check_in + timedelta(days=2),
+            total_price=Decimal('0'), guest_count=1,
+        )
+        booking.rooms.add(room)
+        Room.objects.filter(pk=room.pk).update(status='booked')
+        return booking, room
+
+    def test_no_shows_released_and_due_rooms_booked(self):
+        overdue, released = self._booking('T001', self.now - timedelta(days=1))
+        due, _ = self._booking('T002', self.now + timedelta(minutes=1))
+        Room.objects.filter(booking_links__booking=due).update(status='available')
+        self.assertTrue(RoomNight.objects.filter(booking=overdue).exists())
+
+        with self.captureOnCommitCallbacks(execute=True):
+            response = APIClient().post(
+                '/api/tasks/update-room-status/', HTTP_X_API_KEY='hotel-platform-cron-2025'
+            )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['phases']['no_show']['bookings'], 1)
+        self.assertEqual(response.data['summary']['total_rooms_updated'], 2)
+
+        overdue.refresh_from_db()
+        released.refresh_from_db()
+        self.assertEqual(overdue.status, BookingStatus.NO_SHOW)
+        self.assertEqual(released.status, 'available')
+        self.assertFalse(RoomNight.objects.filter(booking=overdue).exists())
+        # Thông báo no-show do worker gửi
+        self.assertFalse(Notification.objects.filter(user=self.customer, title__contains='No Show').exists())
+        while jobs.work('test'):
+            pass
+        self.assertEqual(Notification.objects.filter(user=self.customer, title__contains='No Show').count(), 1)
+        self.assertEqual(Room.objects.get(booking_links__booking=due).status, 'booked')
+
+    def test_query_count_does_not_grow_with_bookings(self):
+        tasks.update_room_statuses(self.now, full=True)  # Tạo sẵn các mốc
+        self._booking('T010', self.now - timedelta(days=1))
+        with CaptureQueriesContext(connection) as single:
+            tasks.update_room_statuses(self.now, full=True)
+
+        for i in range(5):
+            self._booking(f'T02{i}', self.now - timedelta(days=1))
+        with CaptureQueriesContext(connection) as many:
+            tasks.update_room_statuses(self.now, full=True)
+        self.assertEqual(len(many), len(single))
+
+    def test_watermark_skips_bookings_already_past_threshold(self):
+        tasks.update_room_statuses(self.now - timedelta(hours=1))
+        stale, _ = self._booking('T030', self.now - timedelta(days=1))
+        crossed, _ = self._booking('T031', self.now - tasks.NO_SHOW_GRACE - timedelta(minutes=30))
+        # Đã quá ngưỡng từ trước lần chạy trước và không bị sửa từ đó → không xét lại
+        Booking.objects.filter(pk=stale.pk).update(updated_at=self.now - timedelta(days=1))
+        Booking.objects.filter(pk=crossed.pk).update(updated_at=self.now - timedelta(days=1))
+
+        phases = tasks.update_room_statuses(self.now)
+        self.assertEqual(phases['no_show']['bookings'], 1)
+        self.assertEqual(Booking.objects.get(pk=crossed.pk).status, BookingStatus.NO_SHOW)
+        self.assertEqual(Booking.objects.get(pk=stale.pk).status, BookingStatus.PENDING)
+
+        tasks.update_room_statuses(self.now, full=True)
+        self.assertEqual(Booking.objects.get(pk=stale.pk).status, BookingStatus.NO_SHOW)
+
+    def test_management_command_runs_once(self):
+        overdue, _ = self._booking('T040', self.now - timedelta(days=1))
+        out = io.StringIO()
+        call_command('run_status_tasks', stdout=out)
+        self.assertIn('no-show: 1 booking', out.getvalue())
+        self.assertEqual(Booking.objects.get(pk=overdue.pk).status, BookingStatus.NO_SHOW)
+        self.assertTrue(TaskWatermark.objects.filter(name='no_show').exists())
+
+
+@override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'rooms'}})
+class RoomStatusCountTests(HotelTestCase):
+    """Số phòng theo trạng thái: một truy vấn GROUP BY theo danh sách đã lọc, có cache"""
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        cls.standard = cls.room_type
+        deluxe = cls.create_room_type('Deluxe', base_price=Decimal('900000'))
+        for number, room_type, room_status in [
+            ('N001', cls.standard, 'available'), ('N002', cls.standard, 'booked'),
+            ('N003', deluxe, 'occupied'), ('N004', deluxe, 'available'),
+        ]:
+            cls.create_room(number, room_type, status=room_status)
+
+    def setUp(self):
+        cache.clear()
+
+    def test_paginator_stats_follow_filters_and_are_cached(self):
+        response = APIClient().get('/rooms/', {'room_type': self.standard.pk})
+        self.assertEqual(response.data['stats'], {
+            'total_rooms': 2, 'available_rooms': 1, 'booked_rooms': 1, 'occupied_rooms': 0,
+        })
+
+        with CaptureQueriesContext(connection) as queries:
+            APIClient().get('/rooms/', {'room_type': self.standard.pk})
+        self.assertFalse([query for query in queries if 'GROUP BY' in query['sql']])
+
+    def test_room_save_invalidates_counts(self):
+        self.assertEqual(room_stats.counts()['available'], 2)
+        with self.captureOnCommitCallbacks(execute=True):
+            room = Room.objects.get(room_number='N001')
+            room.status = 'occupied'
+            room.save()
+        self.assertEqual(room_stats.counts(), {'available': 1, 'booked': 1, 'occupied': 2, 'maintenance': 0})
+
+        status = APIClient().get('/api/tasks/status/').data['room_status']
+        self.assertEqual(status, {'available': 1, 'booked': 1, 'occupied': 2, 'maintenance': 0})
+
+
+class ScheduledTaskLeaseTests(TestCase):
+    """Lease cho tác vụ định kỳ: một bên chạy, token cũ không commit được, lịch sử chạy"""
+
+    def test_overlapping_run_is_skipped(self):
+        with schedule.lease(tasks.LOCK_NAME):
+            skipped = tasks.run_room_status_task()
+            response = APIClient().post('/api/tasks/update-room-status/', HTTP_X_API_KEY='hotel-platform-cron-2025')
+        self.assertEqual(skipped.status, TaskRunStatus.SKIPPED)
+        self.assertEqual(response.status_code, 409)
+        self.assertFalse(TaskWatermark.objects.exists())
+
+        ran = tasks.run_room_status_task()
+        self.assertEqual(ran.status, TaskRunStatus.SUCCESS)
+        self.assertEqual(set(ran.result), {'no_show', 'check_in_due'})
+        # Lần bị bỏ qua không ghi lịch sử
+        self.assertEqual(list(TaskRun.objects.filter(name=tasks.LOCK_NAME).values_list('status', flat=True)),
+                         [TaskRunStatus.SUCCESS])
+
+        status = APIClient().get('/api/tasks/status/').data['scheduled_tasks'][tasks.LOCK_NAME]
+        self.assertEqual(status['last_run']['status'], TaskRunStatus.SUCCESS)
+        self.assertFalse(status['stale'])
+
+    def test_old_runs_are_pruned(self):
+        started_at = timezone.now() - schedule.KEEP_RUNS - timedelta(days=1)
+        old = TaskRun.objects.create(
+            name='test_task', status=TaskRunStatus.SUCCESS, started_at=started_at, finished_at=started_at,
+        )
+        schedule.run('test_task', dict)
+        self.assertFalse(TaskRun.objects.filter(pk=old.pk).exists())
+        self.assertEqual(TaskRun.objects.filter(name='test_task').count(), 1)
+
+    def test_expired_lease_cannot_commit(self):
+        def overrun():
+            # Lease hết hạn giữa chừng và được cấp cho bên khác
+            TaskLock.objects.filter(name='test_task').update(expires_at=timezone.now())
+            self.assertIsNotNone(schedule.acquire('test_task', 'other'))
+            TaskWatermark.objects.create(name='test_task', value=timezone.now())
+            return {}
+
+        with self.assertRaises(schedule.LeaseLost):
+            schedule.run('test_task', overrun)
+        self.assertFalse(TaskWatermark.objects.filter(name='test_task').exists())
+        self.assertEqual(TaskRun.objects.get(name='test_task').status, TaskRunStatus.FAILED)
+        self.assertTrue(schedule.status('test_task', timedelta(hours=1))['stale'])
+
+
+class JobQueueTests(HotelTestCase):
+    """Tác vụ nền: ghi khi commit, chống trùng theo dedup_key, thử lại với backoff"""
+
+    def setUp(self):
+        self.calls = []
+
+    def _booking(self):
+        now = timezone.now()
+        return Booking.objects.create(
+            customer=self.customer, check_in_date=now + timedelta(days=1),
+            check_out_date=now + timedelta(days=2), total_price=Decimal('0'), guest_count=1,
+        )
+
+    def test_signals_enqueue_side_effects_on_commit(self):
+        with self.captureOnCommitCallbacks(execute=False) as callbacks:
+            self._booking()
+            self._booking()
+        self.assertFalse(Job.objects.exists())
+        self.assertFalse(Notification.objects.filter(user=self.customer).exists())
+
+        for callback in callbacks:
+            callback()
+        # Hai thông báo, thống kê khách hàng chỉ một job nhờ dedup_key
+        self.assertEqual(Job.objects.filter(name='notify').count(), 2)
+        self.assertEqual(Job.objects.filter(name='refresh_customer_stats').count(), 1)
+
+        while jobs.work('test'):
+            pass
+        self.assertEqual(Notification.objects.filter(user=self.customer).count(), 2)
+        self.customer.refresh_from_db()
+        self.assertEqual(self.customer.total_bookings, 2)
+        self.assertFalse(Job.objects.exclude(status=JobStatus.DONE).exists())
+
+    def test_failed_job_retries_with_backoff_then_fails(self):
+        def flaky(**payload):
+            self.calls.append(payload)
+            raise RuntimeError('boom')
+        jobs.HANDLERS['test_flaky'] = flaky
+        self.addCleanup(jobs.HANDLERS.pop, 'test_flaky')
+
+        with self.captureOnCommitCallbacks(execute=True):
+            jobs.enqueue('test_flaky', max_attempts=2, value=1)
+        job = Job.objects.get(name='test_flaky')
+
+        self.assertEqual(jobs.work('test'), 1)
+        job.refresh_from_db()
+        self.assertEqual(job.status, JobStatus.PENDING)
+        self.assertGreater(job.run_at, timezone.now())
+        self.assertIn('boom', job.last_error)
+        self.assertEqual(jobs.work('test'), 0)  # Chưa tới hạn thử lại
+
+        Job.objects.filter(pk=job.pk).update(run_at=timezone.now())
+        self.assertEqual(jobs.work('test'), 1)
+        job.refresh_from_db()
+        self.assertEqual(job.status, JobStatus.FAILED)
+        self.assertEqual(job.attempts, 2)
+        self.assertEqual(self.calls, [{'value': 1}, {'value': 1}])
+
+    def test_dedup_key_only_blocks_pending_jobs(self):
+        def flaky(**payload):
+            raise RuntimeError('boom')
+        jobs.HANDLERS['test_flaky'] = flaky
+        self.addCleanup(jobs.HANDLERS.pop, 'test_flaky')
+
+        with self.captureOnCommitCallbacks(execute=True):
+            jobs.enqueue('test_flaky', dedup_key='k')
+            jobs.enqueue('test_flaky', dedup_key='k')
+        self.assertEqual(Job.objects.count(), 1)
+
+        first, = jobs.claim('test')
+        self.assertIsNone(first.pending_key)
+        # Job đầu đã được nhận → key được ghi job mới
+        with self.captureOnCommitCallbacks(execute=True):
+            jobs.enqueue('test_flaky', dedup_key='k')
+        self.assertEqual(Job.objects.filter(status=JobStatus.PENDING, pending_key='k').count(), 1)
+
+        # Job đầu lỗi không quay lại hàng đợi vì job mới cùng key làm thay
+        jobs.run(first)
+        first.refresh_from_db()
+        self.assertEqual(first.status, JobStatus.DONE)
+        self.assertIn('boom', first.last_error)
+        self.assertEqual(Job.objects.filter(status=JobStatus.PENDING).count(), 1)
+
+    def test_stale_running_job_is_requeued(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            jobs.enqueue('refresh_customer_stats', user_id=self.customer.pk)
+        claimed, = jobs.claim('dead-worker')
+        self.assertEqual(jobs.claim('other-worker'), [])
+
+        Job.objects.filter(pk=claimed.pk).update(locked_at=timezone.now() - jobs.STALE_AFTER - timedelta(seconds=1))
+        self.assertEqual(jobs.requeue_stale(), 1)
+        self.assertEqual([job.pk for job in jobs.claim('other-worker')], [claimed.pk])
+
+        # Worker cũ chạy xong muộn không ghi đè job worker mới đang giữ
+        self.assertTrue(jobs.run(claimed))
+        self.assertEqual(Job.objects.get(pk=claimed.pk).status, JobStatus.RUNNING)
+
+    def test_long_job_has_own_stale_timeout(self):
+        job = Job.objects.create(name='export_snapshots', payload={'file_format': 'arrow'})
+        claimed, = jobs.claim('export-worker')
+
+        Job.objects.filter(pk=claimed.pk).update(locked_at=timezone.now() - jobs.STALE_AFTER - timedelta(seconds=1))
+        self.assertEqual(jobs.requeue_stale(), 0)
+
+        stale_after = jobs.STALE_AFTER_BY_NAME['export_snapshots']
+        Job.objects.filter(pk=claimed.pk).update(locked_at=timezone.now() - stale_after - timedelta(seconds=1))
+        self.assertEqual(jobs.requeue_stale(), 1)
+        self.assertEqual(Job.objects.get(pk=job.pk).status, JobStatus.PENDING)
+
+    def test_non_atomic_handler_runs_outside_job_transaction(self):
+        savepoints = []
+
+        def long_running(**payload):
+            savepoints.append(len(connection.savepoint_ids))
+        jobs.handler('test_long_running', atomic=False)(long_running)
+        jobs.handler('test_atomic')(long_running)
+        for name in ('test_long_running', 'test_atomic'):
+            self.addCleanup(jobs.HANDLERS.pop, name)
+        self.addCleanup(jobs.NON_ATOMIC.discard, 'test_long_running')
+
+        Job.objects.bulk_create([Job(name='test_long_running'), Job(name='test_atomic')])
+        outside = len(connection.savepoint_ids)
+        self.assertEqual(jobs.work('test'), 2)
+        self.assertEqual(savepoints, [outside, outside + 1])
+
+    def test_prune_removes_old_finished_jobs(self):
+        now = timezone.now()
+        old_done = Job.objects.create(name='notify', status=JobStatus.DONE, finished_at=now - timedelta(days=8))
+        old_failed = Job.objects.create(name='notify', status=JobStatus.FAILED, finished_at=now - timedelta(days=8))
+        recent = Job.objects.create(name='notify', status=JobStatus.DONE, finished_at=now - timedelta(days=1))
+        pending = Job.objects.create(name='notify')
+
+        self.assertEqual(jobs.prune(now), 1)
+        self.assertEqual(
+            set(Job.objects.values_list('pk', flat=True)), {old_failed.pk, recent.pk, pending.pk}
+        )
+        self.assertFalse(Job.objects.filter(pk=old_done.pk).exists())
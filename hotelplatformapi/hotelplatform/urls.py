@@ -24,9 +24,12 @@ urlpatterns = [
     
     # Booking calculate price endpoint
     path('api/bookings/calculate-price/', views.BookingViewSet.as_view({'post': 'calculate_price'}), name='calculate-price'),
+    path('api/bookings/calculate-price-batch/', views.BookingViewSet.as_view({'post': 'calculate_price_batch'}), name='calculate-price-batch'),
     
     # Stats endpoint
     path('api/stats/', views.StatsView.as_view(), name='stats'),
+    path('api/stats/cache/', views.StatsCacheView.as_view(), name='stats-cache'),
+    path('api/stats/series/', views.StatsSeriesView.as_view(), name='stats-series'),
     
     # Room status update task endpoint
     path('api/tasks/update-room-status/', views.RoomStatusUpdateTaskView.as_view(), name='update-room-status-task'),
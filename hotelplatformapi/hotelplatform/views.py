@@ -1,4 +1,5 @@
-from datetime import datetime, timedelta
+from bisect import bisect_left, bisect_right
+from datetime import date, datetime, timedelta
 import hashlib
 import hmac
 import pytz
@@ -9,6 +10,7 @@ from django.views.decorators.csrf import csrf_exempt
 from django.views.decorators.http import require_http_methods
 import urllib
 import logging
+import time
 from decimal import Decimal, ROUND_HALF_UP
 
 # Thiết lập logger
@@ -41,13 +43,14 @@ from django.core.exceptions import ValidationError
 
 # Local imports
 from .models import (
-    User, RoomType, Room, RoomImage, Booking, RoomRental, Payment, DiscountCode, Notification,
-    BookingStatus, CustomerType
+    User, RoomType, Room, RoomImage, Booking, RoomRental, Payment, RevenueNight, DiscountCode, Notification,
+    BookingStatus, CustomerType, TaskRunStatus
 )
 from .serializers import (
     UserSerializer, UserDetailSerializer, UserListSerializer, RoomTypeSerializer, RoomSerializer, RoomDetailSerializer,
     BookingSerializer, BookingDetailSerializer, RoomRentalSerializer, RoomRentalDetailSerializer,
-    PaymentSerializer, DiscountCodeSerializer, NotificationSerializer, RoomImageSerializer, InvoiceSerializer
+    PaymentSerializer, DiscountCodeSerializer, NotificationSerializer, RoomImageSerializer, InvoiceSerializer,
+    BookingHoldSerializer
 )
 from .permissions import (
     IsAdminUser, IsOwnerUser, IsStaffUser, IsCustomerUser, IsAdminOrOwner, IsAdminOrOwnerOrStaff,
@@ -58,6 +61,7 @@ from .permissions import (
     CanCreateBooking
 )
 from .paginators import ItemPaginator, UserPaginator, RoomPaginator, RoomTypePaginator
+from . import allocation, dashboard, exports, inventory, pricing, rollup, room_stats, schedule, tasks
 
 # Create your views here.
 def home(request):
@@ -309,12 +313,41 @@ class RoomTypeViewSet(viewsets.ViewSet, generics.ListAPIView, generics.RetrieveA
     ordering = ['base_price']
 
     def get_permissions(self):
-        if self.action in ['list', 'retrieve']:
-            return [AllowAny()]  # Chỉ cho phép guest xem danh sách và chi tiết
+        if self.action in ['list', 'retrieve', 'price_calendar']:
+            return [AllowAny()]  # Chỉ cho phép guest xem danh sách, chi tiết và lịch giá
         elif self.action in ['create', 'update', 'partial_update', 'destroy']:
             return [CanModifyRoomType()]
         return [IsAuthenticated()]  # Các action khác cần authentication
 
+    # Cửa sổ đặt phòng: nhận phòng tối đa 28 ngày kể từ hiện tại
+    PRICE_CALENDAR_MAX_DAYS = 28
+
+    @action(detail=False, methods=['get'], url_path='price-calendar')
+    def price_calendar(self, request):
+        """
+        Giá mỗi đêm của một phòng theo loại phòng x ngày x số khách (1 tới 150% sức chứa)
+        cho cửa sổ đặt phòng. Query params: start (YYYY-MM-DD, mặc định hôm nay), days (1-28).
+        """
+        today = inventory.local_date(timezone.now())
+        try:
+            start = request.query_params.get('start')
+            start_date = datetime.strptime(start, '%Y-%m-%d').date() if start else today
+            days = int(request.query_params.get('days', self.PRICE_CALENDAR_MAX_DAYS))
+        except ValueError:
+            return Response(
+                {"error": "start phải có dạng YYYY-MM-DD và days phải là số nguyên"},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        if start_date < today:
+            return Response({"error": "Ngày bắt đầu không được ở quá khứ"}, status=status.HTTP_400_BAD_REQUEST)
+        if not 1 <= days <= self.PRICE_CALENDAR_MAX_DAYS:
+            return Response(
+                {"error": f"days phải từ 1 đến {self.PRICE_CALENDAR_MAX_DAYS}"},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        return Response(pricing.price_calendar(start_date, days))
+
     def create(self, request):
         """
         Tạo room type mới (chỉ admin/owner)
@@ -364,6 +397,8 @@ class RoomViewSet(viewsets.ViewSet, generics.ListAPIView, generics.RetrieveAPIVi
             return [CanManageRooms()]
         elif self.action == 'low_performance':
             return [CanViewStats()]
+        elif self.action == 'suggest_combinations':
+            return [CanManageBookings()]  # Lễ tân tìm tổ hợp phòng cho đoàn khách
         return [IsAuthenticated()]  # Các action khác cần authentication
 
     def get_queryset(self):
@@ -421,8 +456,8 @@ class RoomViewSet(viewsets.ViewSet, generics.ListAPIView, generics.RetrieveAPIVi
 
         #  AVAILABLE ROOMS LOGIC - Enhanced for booking conflicts
         try:
-            check_in_date = datetime.strptime(check_in, '%Y-%m-%d')
-            check_out_date = datetime.strptime(check_out, '%Y-%m-%d')
+            check_in_date = datetime.strptime(check_in, '%Y-%m-%d').date()
+            check_out_date = datetime.strptime(check_out, '%Y-%m-%d').date()
             if check_in_date >= check_out_date:
                 return Response(
                     {"error": "Ngày nhận phòng phải trước ngày trả phòng"},
@@ -435,19 +470,14 @@ class RoomViewSet(viewsets.ViewSet, generics.ListAPIView, generics.RetrieveAPIVi
             )
 
         #  BOOKING CONFLICT DETECTION LOGIC
-        # Tìm các phòng đã được đặt trong khoảng thời gian yêu cầu
-        # Logic: Hai khoảng thời gian overlap nếu:
-        # - Ngày bắt đầu của booking mới < ngày kết thúc của booking hiện tại
-        # - Ngày kết thúc của booking mới > ngày bắt đầu của booking hiện tại
-        booked_rooms = Booking.objects.filter(
-            status__in=['pending', 'confirmed', 'checked_in'],  # Chỉ các booking còn active
-            check_in_date__lt=check_out_date,  # Booking hiện tại bắt đầu trước khi booking mới kết thúc
-            check_out_date__gt=check_in_date   # Booking hiện tại kết thúc sau khi booking mới bắt đầu
-        ).values_list('rooms__id', flat=True)
-
+        # Dựa trên sổ phòng theo đêm (RoomNight): phòng trống khi không có đêm nào trong
+        # [check_in, check_out) bị booking còn hiệu lực giữ → một anti-join trên index (room, date)
         #  LỌC PHÒNG AVAILABLE
         # Chỉ lấy phòng có status='available' và không bị conflict với booking khác
-        available_rooms = Room.objects.filter(status='available').exclude(id__in=booked_rooms)
+        available_rooms = inventory.available_rooms(
+            check_in_date, check_out_date,
+            queryset=Room.objects.select_related('room_type').filter(status='available')
+        )
 
         if room_type:
             available_rooms = available_rooms.filter(room_type__id=room_type)
@@ -472,34 +502,159 @@ class RoomViewSet(viewsets.ViewSet, generics.ListAPIView, generics.RetrieveAPIVi
         serializer = RoomSerializer(available_rooms, many=True)
         return Response(serializer.data)
 
+    @action(detail=False, methods=['get'], url_path='suggest-combinations')
+    def suggest_combinations(self, request):
+        """
+        Gợi ý k tổ hợp phòng trống rẻ nhất đủ chỗ cho guest_count khách
+        (cùng quy tắc phân bổ với calculate_price_for_multiple_rooms)
+        """
+        check_in = request.query_params.get('check_in')
+        check_out = request.query_params.get('check_out')
+        guest_count = request.query_params.get('guest_count')
+
+        if not all([check_in, check_out, guest_count]):
+            return Response(
+                {"error": "Cần cung cấp check_in, check_out và guest_count"},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        try:
+            check_in_date = datetime.strptime(check_in, '%Y-%m-%d').date()
+            check_out_date = datetime.strptime(check_out, '%Y-%m-%d').date()
+        except ValueError:
+            return Response(
+                {"error": "Định dạng ngày không hợp lệ, sử dụng YYYY-MM-DD"},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        if check_in_date >= check_out_date:
+            return Response(
+                {"error": "Ngày nhận phòng phải trước ngày trả phòng"},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        try:
+            guest_count = int(guest_count)
+            k = min(int(request.query_params.get('k', 5)), 20)
+            max_rooms = request.query_params.get('max_rooms')
+            max_rooms = int(max_rooms) if max_rooms else None
+        except ValueError:
+            return Response(
+                {"error": "guest_count, k và max_rooms phải là số nguyên"},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        if guest_count <= 0 or k <= 0:
+            return Response(
+                {"error": "guest_count và k phải lớn hơn 0"},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        rooms = inventory.available_rooms(
+            check_in_date, check_out_date,
+            queryset=Room.objects.select_related('room_type').filter(status='available').order_by('room_number')
+        )
+        stay_days = (check_out_date - check_in_date).days
+        combinations = allocation.suggest_combinations(
+            list(rooms), guest_count, stay_days, k=k, max_rooms=max_rooms, check_in=check_in_date
+        )
+
+        return Response({
+            "check_in": check_in,
+            "check_out": check_out,
+            "guest_count": guest_count,
+            "stay_days": stay_days,
+            "combinations": [
+                {
+                    "total_price": float(combination['total_price']),
+                    "room_ids": [room.id for room in combination['rooms']],
+                    "guest_allocation": combination['guest_allocation'],
+                    "calculation_details": [
+                        {**detail, 'base_price': float(detail['base_price']),
+                         'room_price_per_day': float(detail['room_price_per_day']),
+                         'total_room_price': float(detail['total_room_price'])}
+                        for detail in combination['calculation_details']
+                    ],
+                }
+                for combination in combinations
+            ],
+        })
+
     @action(detail=False, methods=['get'])
     def low_performance(self, request):
         """
         Phân tích phòng ít được thuê
-        """
-        start_date = request.query_params.get('start_date')
-        end_date = request.query_params.get('end_date')
 
+        Query params:
+            start_date, end_date: Khoảng ngày (YYYY-MM-DD, end_date không tính); hoặc
+            days: Số ngày gần nhất (mặc định 365)
+            room_type: Chỉ xét một loại phòng
+            limit: Số phòng trả về (mặc định 10, tối đa 100)
+
+        Mỗi phòng gồm hạng (1 = thấp nhất), tỷ lệ lấp đầy, doanh thu và percentile so với các phòng
+        cùng loại. Tính từ RoomDailyStat: một truy vấn danh sách phòng + một truy vấn gom nhóm.
+        """
+        today = inventory.local_date(timezone.now())
         try:
-            start_date = datetime.strptime(start_date, '%Y-%m-%d') if start_date else timezone.now() - timedelta(days=365)
-            end_date = datetime.strptime(end_date, '%Y-%m-%d') if end_date else timezone.now()
+            days = int(request.query_params.get('days', 365))
+            limit = min(max(int(request.query_params.get('limit', 10)), 1), 100)
+            room_type = request.query_params.get('room_type')
+            room_type = int(room_type) if room_type else None
+            start_date = request.query_params.get('start_date')
+            end_date = request.query_params.get('end_date')
+            end_date = datetime.strptime(end_date, '%Y-%m-%d').date() if end_date else today
+            start_date = datetime.strptime(start_date, '%Y-%m-%d').date() if start_date else end_date - timedelta(days=days)
         except ValueError:
             return Response(
-                {"error": "Định dạng ngày không hợp lệ, sử dụng YYYY-MM-DD"},
+                {"error": "Tham số không hợp lệ (ngày dùng định dạng YYYY-MM-DD, days / limit / room_type là số)"},
                 status=status.HTTP_400_BAD_REQUEST
             )
+        window_days = (end_date - start_date).days
+        if window_days <= 0:
+            return Response({"error": "start_date phải trước end_date"}, status=status.HTTP_400_BAD_REQUEST)
 
-        room_usage = Room.objects.annotate(
-            booking_count=Count('bookings', filter=Q(
-                bookings__check_in_date__gte=start_date,
-                bookings__check_out_date__lte=end_date
-            ))
-        ).order_by('booking_count')[:10]
+        rooms = Room.objects.order_by('room_number')
+        if room_type:
+            rooms = rooms.filter(room_type_id=room_type)
+        rooms = list(rooms.values('id', 'room_number', 'status', 'room_type_id', 'room_type__name'))
+        totals = rollup.room_totals(start_date, end_date)
+
+        entries = []
+        for room in rooms:
+            data = totals.get(room['id'], {})
+            occupied = data.get('occupied_nights') or 0
+            entries.append({
+                'room_id': room['id'],
+                'room_number': room['room_number'],
+                'room_type': room['room_type__name'],
+                'room_type_id': room['room_type_id'],
+                'status': room['status'],
+                'occupied_nights': occupied,
+                'occupancy': round(occupied / window_days * 100, 1),
+                'revenue': data.get('revenue') or Decimal('0'),
+            })
+
+        # Percentile so với các phòng cùng loại: (số phòng thấp hơn + nửa số phòng bằng) / tổng
+        peers = {}
+        for entry in entries:
+            peers.setdefault(entry['room_type_id'], []).append(entry)
+        for group in peers.values():
+            for metric in ('occupancy', 'revenue'):
+                values = sorted(entry[metric] for entry in group)
+                for entry in group:
+                    below = bisect_left(values, entry[metric])
+                    equal = bisect_right(values, entry[metric]) - below
+                    entry[f'{metric}_percentile'] = round((below + equal / 2) / len(values) * 100, 1)
+                    entry['peers'] = len(values)
+
+        entries.sort(key=lambda entry: (entry['occupancy'], entry['revenue'], entry['room_number']))
+        for rank, entry in enumerate(entries, 1):
+            entry['rank'] = rank
+            entry['revenue'] = float(entry['revenue'])
 
-        serializer = RoomDetailSerializer(room_usage, many=True)
         return Response({
             'message': 'Phòng có hiệu suất thấp',
-            'rooms': serializer.data
+            'start_date': start_date.isoformat(),
+            'end_date': end_date.isoformat(),
+            'rooms': entries[:limit]
         })
 
 class BookingViewSet(viewsets.ViewSet, generics.ListAPIView, generics.RetrieveAPIView):
@@ -522,13 +677,13 @@ class BookingViewSet(viewsets.ViewSet, generics.ListAPIView, generics.RetrieveAP
 
     def get_permissions(self):
         """
-        Override để đảm bảo calculate_price không yêu cầu xác thực
+        Override để đảm bảo calculate_price / calculate_price_batch không yêu cầu xác thực
         """
-        if self.action == 'calculate_price':
+        if self.action in ['calculate_price', 'calculate_price_batch']:
             return [AllowAny()]
-        elif self.action in ['list', 'retrieve']:
+        elif self.action in ['list', 'retrieve', 'export']:
             return [CanAccessAllBookings()]
-        elif self.action == 'create':
+        elif self.action in ['create', 'hold', 'release_hold']:
             return [CanCreateBooking()]
         elif self.action in ['confirm', 'checkin']:
             return [CanConfirmBooking()]
@@ -565,6 +720,20 @@ class BookingViewSet(viewsets.ViewSet, generics.ListAPIView, generics.RetrieveAP
 
         return queryset
 
+    @action(detail=False, methods=['get'])
+    def export(self, request):
+        """
+        Xuất danh sách booking dạng luồng, cùng bộ lọc / tìm kiếm / sắp xếp với danh sách
+        ?file_format=csv (mặc định) | jsonl
+        """
+        file_format = request.query_params.get('file_format', 'csv')
+        if file_format not in exports.FORMATS:
+            return Response(
+                {"error": f"file_format phải là một trong: {', '.join(exports.FORMATS)}"},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        return exports.stream(self.filter_queryset(self.get_queryset()), exports.booking_row, 'bookings', file_format)
+
     def create(self, request):
         """Tạo booking mới với logic tính giá thông minh"""
         serializer = BookingSerializer(data=request.data, context={'request': request})
@@ -957,6 +1126,9 @@ class BookingViewSet(viewsets.ViewSet, generics.ListAPIView, generics.RetrieveAP
                     discount_code=discount_code,
                 )
                 logger.info(f"Created Payment {payment.id} with method {payment_method}, amount {final_price}")
+
+                # Chụp khoản phí hóa đơn theo giá hiện tại (cùng transaction)
+                payment.snapshot_lines()
                 
                 # Step 2: Handle different payment methods
                 if payment_method == 'cash':
@@ -1219,6 +1391,50 @@ class BookingViewSet(viewsets.ViewSet, generics.ListAPIView, generics.RetrieveAP
                 status=status.HTTP_500_INTERNAL_SERVER_ERROR
             )
 
+    @action(detail=False, methods=['post'])
+    def hold(self, request):
+        """
+        Giữ phòng tạm thời khi khách mở trang thanh toán.
+        Trả về hold_token để gửi kèm khi tạo booking; hold tự hết hạn sau TTL.
+        Mỗi người dùng một hold: giữ phòng mới thì hold trước đó được trả lại.
+        """
+        serializer = BookingHoldSerializer(data=request.data)
+        if not serializer.is_valid():
+            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
+        rooms = serializer.validated_data['rooms']
+        check_in_date = serializer.validated_data['check_in_date']
+        check_out_date = serializer.validated_data['check_out_date']
+
+        # Booking đã tồn tại chồng lấn thì không cần giữ
+        conflicts = inventory.find_conflicting_bookings(rooms, check_in_date, check_out_date)
+        try:
+            if conflicts:
+                raise inventory.HoldConflict(conflicts.keys())
+            hold_token, expires_at = inventory.acquire_hold(rooms, check_in_date, check_out_date, request.user)
+        except inventory.HoldConflict as e:
+            taken = [room.room_number for room in rooms if room.pk in e.room_ids]
+            return Response(
+                {"error": f"Phòng {', '.join(taken)} đã được đặt hoặc đang được giữ bởi khách khác", "rooms": sorted(e.room_ids)},
+                status=status.HTTP_409_CONFLICT
+            )
+
+        logger.info(f"Hold created for rooms {[room.pk for room in rooms]} until {expires_at}")
+        return Response({
+            "hold_token": hold_token,
+            "expires_at": expires_at,
+            "rooms": [room.pk for room in rooms],
+        }, status=status.HTTP_201_CREATED)
+
+    @action(detail=False, methods=['post'], url_path='release-hold')
+    def release_hold(self, request):
+        """Trả lại phòng đang giữ khi khách rời trang thanh toán (chỉ người giữ)"""
+        hold_token = request.data.get('hold_token')
+        if not hold_token:
+            return Response({"error": "Cần cung cấp hold_token"}, status=status.HTTP_400_BAD_REQUEST)
+        released = inventory.release_hold(hold_token, request.user)
+        return Response({"message": "Đã trả lại phòng", "released_nights": released})
+
     @action(detail=False, methods=['post'], url_path='calculate-price')
     def calculate_price(self, request):
         """
@@ -1237,29 +1453,13 @@ class BookingViewSet(viewsets.ViewSet, generics.ListAPIView, generics.RetrieveAP
             )
 
         try:
-            # Convert dates and make them timezone-aware
-            check_in_date = timezone.make_aware(
-                datetime.strptime(check_in_date, '%Y-%m-%d'),
-                timezone.get_default_timezone()
-            )
-            check_out_date = timezone.make_aware(
-                datetime.strptime(check_out_date, '%Y-%m-%d'),
-                timezone.get_default_timezone()
-            )
+            # Convert and validate dates (cùng quy tắc với calculate-price-batch)
+            try:
+                check_in_date, check_out_date = self._parse_stay(check_in_date, check_out_date)
+            except ValueError as e:
+                return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
             guest_count = int(guest_count)
 
-            # Validate dates
-            if check_in_date >= check_out_date:
-                return Response(
-                    {"error": "Ngày nhận phòng phải trước ngày trả phòng"},
-                    status=status.HTTP_400_BAD_REQUEST
-                )
-            if check_in_date > timezone.now() + timedelta(days=28):
-                return Response(
-                    {"error": "Ngày nhận phòng không được vượt quá 28 ngày kể từ thời điểm hiện tại"},
-                    status=status.HTTP_400_BAD_REQUEST
-                )
-
             # Get room
             room = get_object_or_404(Room, pk=room_id)
             if room.status != 'available':
@@ -1268,15 +1468,9 @@ class BookingViewSet(viewsets.ViewSet, generics.ListAPIView, generics.RetrieveAP
                     status=status.HTTP_400_BAD_REQUEST
                 )
 
-            # Check for overlapping bookings
-            overlapping_bookings = Booking.objects.filter(
-                rooms=room,
-                check_in_date__lt=check_out_date,
-                check_out_date__gt=check_in_date,
-                status__in=['pending', 'confirmed', 'checked_in']
-            )
-            if overlapping_bookings.exists():
-                overlap = overlapping_bookings.first()
+            # Check for overlapping bookings (bitmap trong bộ nhớ trước, DB khi cần)
+            overlap = inventory.find_conflicting_bookings([room], check_in_date, check_out_date).get(room.pk)
+            if overlap:
                 overlap_start = max(check_in_date, overlap.check_in_date)
                 overlap_end = min(check_out_date, overlap.check_out_date)
                 return Response(
@@ -1284,21 +1478,12 @@ class BookingViewSet(viewsets.ViewSet, generics.ListAPIView, generics.RetrieveAP
                     status=status.HTTP_400_BAD_REQUEST
                 )
 
-            # Calculate number of days
-            days = (check_out_date - check_in_date).days
-            if days <= 0:
-                days = 1  # Minimum 1 day
-
-            # Calculate base price
-            room_type = room.room_type
-            base_price = room_type.base_price
-            total_price = base_price * days
+            # Calculate number of days (minimum 1 day)
+            days = pricing.stay_days(check_in_date, check_out_date)
 
-            # Add surcharge for extra guests
-            if guest_count > room_type.max_guests:
-                extra_guests = guest_count - room_type.max_guests
-                surcharge = base_price * (room_type.extra_guest_surcharge / 100) * extra_guests * days
-                total_price += surcharge
+            # Base price + surcharge for extra guests
+            line = pricing.quote_rooms([room], guest_count, days, check_in=check_in_date)['calculation_details'][0]
+            total_price = line['total_room_price']
 
             # Apply discount if provided
             discount_info = None
@@ -1326,7 +1511,7 @@ class BookingViewSet(viewsets.ViewSet, generics.ListAPIView, generics.RetrieveAP
 
             return Response({
                 "message": "Tính giá thành công",
-                "original_price": float(base_price * days),
+                "original_price": float(line['base_total']),
                 "total_price": float(total_price),
                 "discount_info": discount_info,
                 "days": days,
@@ -1346,6 +1531,185 @@ class BookingViewSet(viewsets.ViewSet, generics.ListAPIView, generics.RetrieveAP
                 status=status.HTTP_400_BAD_REQUEST
             )
 
+    # Số phần tử tối đa của một request calculate-price-batch
+    MAX_BATCH_QUOTES = 50
+
+    def _parse_stay(self, check_in, check_out):
+        """Ngày nhận / trả phòng (YYYY-MM-DD) của calculate-price và từng item calculate-price-batch; sai → ValueError"""
+        try:
+            check_in_date, check_out_date = (
+                timezone.make_aware(datetime.strptime(value, '%Y-%m-%d'), timezone.get_default_timezone())
+                for value in (check_in, check_out)
+            )
+        except (TypeError, ValueError):
+            raise ValueError("Định dạng ngày không hợp lệ, sử dụng YYYY-MM-DD")
+        if check_in_date.date() < inventory.local_date(timezone.now()):
+            raise ValueError("Ngày nhận phòng không được ở quá khứ")
+        if check_in_date >= check_out_date:
+            raise ValueError("Ngày nhận phòng phải trước ngày trả phòng")
+        if check_in_date > timezone.now() + timedelta(days=28):
+            raise ValueError("Ngày nhận phòng không được vượt quá 28 ngày kể từ thời điểm hiện tại")
+        return check_in_date, check_out_date
+
+    def _parse_quote_item(self, item):
+        """Đọc một phần tử của calculate-price-batch (cùng quy tắc với calculate_price)"""
+        room_id = item.get('room_id')
+        room_type_id = item.get('room_type')
+        if bool(room_id) == bool(room_type_id):
+            raise ValueError("Cần cung cấp đúng một trong room_id hoặc room_type")
+        if not all([item.get('check_in_date'), item.get('check_out_date'), item.get('guest_count')]):
+            raise ValueError("Cần cung cấp check_in_date, check_out_date và guest_count")
+
+        check_in_date, check_out_date = self._parse_stay(item['check_in_date'], item['check_out_date'])
+
+        try:
+            guest_count = int(item['guest_count'])
+            room_id = int(room_id) if room_id else None
+            room_type_id = int(room_type_id) if room_type_id else None
+        except (TypeError, ValueError):
+            raise ValueError("room_id, room_type và guest_count phải là số nguyên")
+        if guest_count <= 0:
+            raise ValueError("Số khách phải lớn hơn 0")
+
+        return {
+            'room_id': room_id,
+            'room_type': room_type_id,
+            'check_in_date': check_in_date,
+            'check_out_date': check_out_date,
+            'guest_count': guest_count,
+            'discount_code': item.get('discount_code') or None,
+        }
+
+    @action(detail=False, methods=['post'], url_path='calculate-price-batch')
+    def calculate_price_batch(self, request):
+        """
+        Tính giá tạm tính cho nhiều lựa chọn (phòng hoặc loại phòng, ngày, số khách, mã giảm giá)
+        trong một request: một truy vấn phòng, một truy vấn trùng lịch, một truy vấn mã giảm giá
+        và một lần kiểm tra bảng giá cho cả lô.
+
+        Body: {"items": [{"room_id" | "room_type", "check_in_date", "check_out_date",
+                          "guest_count", "discount_code"?}, ...]}
+        Kết quả trả theo thứ tự items; phần tử lỗi có "error" thay vì giá.
+        """
+        items = request.data.get('items')
+        if not isinstance(items, list) or not items:
+            return Response({"error": "Cần cung cấp danh sách items"}, status=status.HTTP_400_BAD_REQUEST)
+        if len(items) > self.MAX_BATCH_QUOTES:
+            return Response(
+                {"error": f"Tối đa {self.MAX_BATCH_QUOTES} items mỗi request"},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        results = [None] * len(items)
+        parsed = {}
+        for index, item in enumerate(items):
+            try:
+                if not isinstance(item, dict):
+                    raise ValueError("Mỗi item phải là một object")
+                parsed[index] = self._parse_quote_item(item)
+            except ValueError as e:
+                results[index] = {"index": index, "error": str(e)}
+
+        # Một truy vấn cho mọi phòng được hỏi trực tiếp hoặc thuộc loại phòng được hỏi
+        room_ids = {quote['room_id'] for quote in parsed.values() if quote['room_id']}
+        room_type_ids = {quote['room_type'] for quote in parsed.values() if quote['room_type']}
+        rooms = list(
+            Room.objects.filter(Q(pk__in=room_ids) | Q(room_type_id__in=room_type_ids))
+            .only('id', 'room_number', 'room_type_id', 'status').order_by('room_number')
+        )
+        rooms_by_id = {room.pk: room for room in rooms}
+        rooms_by_type = {}
+        for room in rooms:
+            rooms_by_type.setdefault(room.room_type_id, []).append(room)
+
+        # Ứng viên của từng phần tử: phòng được hỏi, hoặc các phòng đang sẵn sàng của loại phòng
+        candidates = {}
+        for index, quote in list(parsed.items()):
+            if quote['room_id']:
+                room = rooms_by_id.get(quote['room_id'])
+                if room is None:
+                    results[index] = {"index": index, "error": "Không tìm thấy phòng"}
+                    del parsed[index]
+                    continue
+                candidates[index] = [room] if room.status == 'available' else []
+            else:
+                if quote['room_type'] not in rooms_by_type:
+                    results[index] = {"index": index, "error": "Không có phòng thuộc loại phòng này"}
+                    del parsed[index]
+                    continue
+                candidates[index] = [room for room in rooms_by_type[quote['room_type']] if room.status == 'available']
+
+        indexes = list(parsed)
+        conflicts = inventory.find_conflicts_many([
+            (candidates[index], parsed[index]['check_in_date'], parsed[index]['check_out_date'])
+            for index in indexes
+        ])
+
+        # Chọn phòng trống đầu tiên; phòng tính giá = phòng được chọn, hoặc phòng bất kỳ cùng loại
+        selections = []
+        for index, overlaps in zip(indexes, conflicts):
+            quote = parsed[index]
+            free = [room for room in candidates[index] if room.pk not in overlaps]
+            priced_room = rooms_by_id[quote['room_id']] if quote['room_id'] else (free or rooms_by_type[quote['room_type']])[0]
+            selections.append((free, overlaps, priced_room))
+
+        quotes = pricing.quote_batch([
+            ([priced_room], pricing.stay_days(parsed[index]['check_in_date'], parsed[index]['check_out_date']),
+             parsed[index]['guest_count'], parsed[index]['check_in_date'])
+            for index, (_, _, priced_room) in zip(indexes, selections)
+        ])
+
+        codes = {quote['discount_code'] for quote in parsed.values() if quote['discount_code']}
+        discounts = {discount.code: discount for discount in DiscountCode.objects.filter(code__in=codes)}
+
+        for index, (free, overlaps, priced_room), quote_result in zip(indexes, selections, quotes):
+            quote = parsed[index]
+            line = quote_result['calculation_details'][0]
+            days = pricing.stay_days(quote['check_in_date'], quote['check_out_date'])
+            total_price = line['total_room_price']
+
+            discount_info = None
+            if quote['discount_code']:
+                discount = discounts.get(quote['discount_code'])
+                if discount is None:
+                    results[index] = {"index": index, "error": "Mã giảm giá không tồn tại"}
+                    continue
+                if not discount.is_valid():
+                    results[index] = {"index": index, "error": "Mã giảm giá không hợp lệ hoặc đã hết hạn"}
+                    continue
+                discount_amount = total_price * (discount.discount_percentage / 100)
+                total_price -= discount_amount
+                discount_info = {
+                    'code': discount.code,
+                    'discount_percentage': float(discount.discount_percentage),
+                    'amount_saved': float(discount_amount)
+                }
+
+            result = {
+                "index": index,
+                "room_id": free[0].pk if free else quote['room_id'],
+                "room_type": priced_room.room_type_id,
+                "available": bool(free),
+                "original_price": float(line['base_total']),
+                "total_price": float(total_price),
+                "discount_info": discount_info,
+                "days": days,
+                "guest_count": quote['guest_count'],
+            }
+            if quote['room_type']:
+                result["available_rooms"] = len(free)
+            elif not free:
+                overlap = overlaps.get(priced_room.pk)
+                if overlap:
+                    overlap_start = max(quote['check_in_date'], overlap.check_in_date)
+                    overlap_end = min(quote['check_out_date'], overlap.check_out_date)
+                    result["reason"] = f"Phòng {priced_room.room_number} đã được đặt từ {overlap_start.date()} đến {overlap_end.date()}"
+                else:
+                    result["reason"] = f"Phòng {priced_room.room_number} không khả dụng"
+            results[index] = result
+
+        return Response({"message": "Tính giá thành công", "results": results})
+
     @action(detail=False, methods=['get'], url_path='my-bookings')
     def my_bookings(self, request):
         """
@@ -1404,6 +1768,20 @@ class RoomRentalViewSet(viewsets.ViewSet, generics.ListAPIView, generics.Retriev
         
         return queryset
 
+    @action(detail=False, methods=['get'])
+    def export(self, request):
+        """
+        Xuất danh sách phiếu thuê dạng luồng, cùng bộ lọc / tìm kiếm / sắp xếp với danh sách
+        ?file_format=csv (mặc định) | jsonl
+        """
+        file_format = request.query_params.get('file_format', 'csv')
+        if file_format not in exports.FORMATS:
+            return Response(
+                {"error": f"file_format phải là một trong: {', '.join(exports.FORMATS)}"},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        return exports.stream(self.filter_queryset(self.get_queryset()), exports.rental_row, 'rentals', file_format)
+
     def create(self, request):
         """Tạo rental mới"""
         serializer = RoomRentalSerializer(data=request.data, context={'request': request})
@@ -1445,7 +1823,7 @@ class PaymentViewSet(viewsets.ViewSet, generics.ListAPIView, generics.RetrieveAP
     """
     ViewSet quản lý Payment
     """
-    queryset = Payment.objects.all()
+    queryset = Payment.objects.select_related('rental__customer', 'discount_code').prefetch_related('lines')
     serializer_class = PaymentSerializer
     permission_classes = [IsAuthenticated]
     filter_backends = [SearchFilter, OrderingFilter]
@@ -1694,7 +2072,25 @@ class StatsView(APIView):
         except (ValueError, TypeError):
             year = timezone.now().year
             month = int(month) if month else timezone.now().month
+        if not 1 <= month <= 12:
+            month = timezone.now().month
+        # compute() dùng cả tháng trước và tháng sau: năm phải cách date.min / date.max ít nhất một năm
+        if not date.min.year < year < date.max.year:
+            year = timezone.now().year
         
+        # ?fresh=1: admin bỏ qua ảnh chụp trong cache
+        fresh = request.GET.get('fresh') == '1' and (request.user.is_superuser or request.user.role == 'admin')
+        data, cached = dashboard.get_snapshot(
+            f'month:{year}-{month:02d}', lambda: self.compute(year, month), fresh=fresh
+        )
+        response = Response(data)
+        response['X-Cache'] = 'HIT' if cached else 'MISS'
+        return response
+
+    def compute(self, year, month):
+        """
+        Tính thống kê của tháng (year, month)
+        """
         # Tháng trước để so sánh
         if month == 1:
             prev_year = year - 1
@@ -1703,38 +2099,31 @@ class StatsView(APIView):
             prev_year = year
             prev_month = month - 1
         
-        # Thống kê tháng hiện tại
-        total_users = User.objects.filter(role='customer').count()
+        # Khoảng thời gian nửa mở [đầu tháng, đầu tháng sau) theo giờ khách sạn để DB dùng được index created_at
+        month_start, month_end = date(year, month, 1), date(year + month // 12, month % 12 + 1, 1)
+        prev_month_start = date(prev_year, prev_month, 1)
+        month_range = (rollup.day_start(month_start), rollup.day_start(month_end))
+        
+        # Khách hàng: tổng + mới trong tháng trước trong một truy vấn
+        customers = User.objects.filter(role='customer').aggregate(
+            total=Count('id'),
+            prev_new=Count('id', filter=Q(
+                created_at__gte=rollup.day_start(prev_month_start), created_at__lt=month_range[0]
+            )),
+        )
+        total_users = customers['total']
+        prev_total_customers = customers['prev_new']
         total_rooms = Room.objects.count()
-        total_bookings = Booking.objects.filter(
-            created_at__year=year, 
-            created_at__month=month
-        ).count()
         
-        # Thống kê doanh thu
-        total_revenue = Payment.objects.filter(
-            status=True,
-            paid_at__year=year,
-            paid_at__month=month
-        ).aggregate(total=Sum('amount'))['total'] or 0
-        
-        # Thống kê tháng trước để tính trend
-        prev_total_bookings = Booking.objects.filter(
-            created_at__year=prev_year,
-            created_at__month=prev_month
-        ).count()
-        
-        prev_total_revenue = Payment.objects.filter(
-            status=True,
-            paid_at__year=prev_year,
-            paid_at__month=prev_month
-        ).aggregate(total=Sum('amount'))['total'] or 0
-        
-        prev_total_customers = User.objects.filter(
-            role='customer',
-            created_at__year=prev_year,
-            created_at__month=prev_month
-        ).count()
+        # Booking / doanh thu / phòng-đêm của tháng này và tháng trước: một truy vấn trên DailyStat
+        compared = rollup.monthly_totals(prev_month_start, month_end)
+        empty = dict.fromkeys(rollup.METRICS, 0)
+        current = compared.get(month_start, empty)
+        previous = compared.get(prev_month_start, empty)
+        total_bookings = current['bookings_created']
+        total_revenue = current['revenue']
+        prev_total_bookings = previous['bookings_created']
+        prev_total_revenue = previous['revenue']
         
         # Tính trend percentages
         def calculate_trend(current, previous):
@@ -1746,110 +2135,55 @@ class StatsView(APIView):
         bookings_trend = calculate_trend(total_bookings, prev_total_bookings)
         customers_trend = calculate_trend(total_users, prev_total_customers)
         
-        # Tỷ lệ lấp đầy phòng trong tháng được chọn (dựa trên RoomRental)
-        from datetime import date
-        from calendar import monthrange
-        
-        # Tính số ngày trong tháng
-        days_in_month = monthrange(year, month)[1]
-        prev_days_in_month = monthrange(prev_year, prev_month)[1]
-        
+        # Tỷ lệ lấp đầy phòng trong tháng được chọn (phòng-đêm đã thuê nằm trong tháng)
         # Tổng số "phòng-ngày" có thể cho thuê trong tháng
-        total_room_days = total_rooms * days_in_month
-        prev_total_room_days = total_rooms * prev_days_in_month
-        
-        # Tổng số "phòng-ngày" đã được thuê trong tháng
-        occupied_room_days = 0
-        rentals_in_month = RoomRental.objects.filter(
-            check_in_date__year=year,
-            check_in_date__month=month
-        ).prefetch_related('rooms')
-        
-        for rental in rentals_in_month:
-            # Tính số ngày thuê trong tháng này
-            check_in = rental.check_in_date.date() if rental.check_in_date.date().month == month else date(year, month, 1)
-            check_out = rental.check_out_date.date() if rental.check_out_date.date().month == month else date(year, month, days_in_month)
-            
-            if check_out > check_in:
-                rental_days = (check_out - check_in).days
-                room_count = rental.rooms.count()
-                occupied_room_days += rental_days * room_count
-        
-        # Tỷ lệ lấp đầy tháng trước
-        prev_occupied_room_days = 0
-        prev_rentals = RoomRental.objects.filter(
-            check_in_date__year=prev_year,
-            check_in_date__month=prev_month
-        ).prefetch_related('rooms')
-        
-        for rental in prev_rentals:
-            check_in = rental.check_in_date.date() if rental.check_in_date.date().month == prev_month else date(prev_year, prev_month, 1)
-            check_out = rental.check_out_date.date() if rental.check_out_date.date().month == prev_month else date(prev_year, prev_month, prev_days_in_month)
-            
-            if check_out > check_in:
-                rental_days = (check_out - check_in).days
-                room_count = rental.rooms.count()
-                prev_occupied_room_days += rental_days * room_count
+        total_room_days = total_rooms * (month_end - month_start).days
+        prev_total_room_days = total_rooms * (month_start - prev_month_start).days
+        occupied_room_days = current['occupied_room_nights']
+        prev_occupied_room_days = previous['occupied_room_nights']
         
         # Tỷ lệ lấp đầy = (phòng-ngày đã thuê / tổng phòng-ngày có thể) * 100
         occupancy_rate = (occupied_room_days / total_room_days * 100) if total_room_days > 0 else 0
         prev_occupancy_rate = (prev_occupied_room_days / prev_total_room_days * 100) if prev_total_room_days > 0 else 0
         occupancy_trend = calculate_trend(occupancy_rate, prev_occupancy_rate)
         
-        # Thống kê doanh thu theo tháng (6 tháng gần nhất)
+        # Thống kê doanh thu theo tháng (6 tháng gần nhất), một truy vấn trên DailyStat
+        this_month = inventory.local_date(timezone.now()).replace(day=1)
+        first_month = this_month
+        for _ in range(5):
+            first_month = (first_month - timedelta(days=1)).replace(day=1)
+        next_month = (this_month + timedelta(days=32)).replace(day=1)
+        by_month = rollup.monthly_totals(first_month, next_month)
         monthly_revenue = []
-        current_date = timezone.now().replace(day=1)
-        for i in range(6):
-            month_date = current_date - timedelta(days=30 * i)
-            revenue = Payment.objects.filter(
-                status=True,
-                paid_at__year=month_date.year,
-                paid_at__month=month_date.month
-            ).aggregate(total=Sum('amount'))['total'] or 0
-            
-            bookings = Booking.objects.filter(
-                created_at__year=month_date.year,
-                created_at__month=month_date.month
-            ).count()
-            
+        month_date = first_month
+        while month_date < next_month:
+            data = by_month.get(month_date, {})
             monthly_revenue.append({
                 'month': f'T{month_date.month}',
-                'revenue': float(revenue),
-                'bookings': bookings
+                'revenue': float(data.get('revenue', 0)),
+                'bookings': data.get('bookings_created', 0)
             })
+            month_date = (month_date + timedelta(days=32)).replace(day=1)
         
-        monthly_revenue.reverse()
-        
-        # Top phòng theo doanh thu
-        top_rooms = []
-        room_revenues = {}
-        rentals = RoomRental.objects.filter(
-            created_at__year=year,
-            created_at__month=month
-        ).select_related('booking')
-        
-        for rental in rentals:
-            for room in rental.rooms.all():
-                if room.room_number not in room_revenues:
-                    room_revenues[room.room_number] = {'revenue': 0, 'bookings': 0}
-                room_revenues[room.room_number]['revenue'] += float(rental.total_price or 0)
-                room_revenues[room.room_number]['bookings'] += 1
-        
-        # Sắp xếp và lấy top 5
-        sorted_rooms = sorted(room_revenues.items(), key=lambda x: x[1]['revenue'], reverse=True)[:5]
+        # Top phòng theo doanh thu ghi nhận trong tháng (RevenueNight, tổng nhóm trên index ngày)
         top_rooms = [
             {
-                'room_number': room_number,
-                'revenue': data['revenue'],
-                'bookings': data['bookings']
+                'room_number': row['room__room_number'],
+                'revenue': float(row['revenue'] or 0),
+                'bookings': row['bookings']
             }
-            for room_number, data in sorted_rooms
+            for row in RevenueNight.objects.filter(
+                date__gte=month_start, date__lt=month_end, room__isnull=False
+            ).values('room__room_number').annotate(
+                revenue=Sum('amount'),
+                bookings=Count('payment_id', distinct=True)
+            ).order_by('-revenue', 'room__room_number')[:5]
         ]
         
         # Đặt phòng gần đây
         recent_bookings = Booking.objects.filter(
-            created_at__year=year,
-            created_at__month=month
+            created_at__gte=month_range[0],
+            created_at__lt=month_range[1]
         ).select_related('customer').prefetch_related('rooms').order_by('-created_at')[:5]
         
         recent_bookings_data = []
@@ -1863,7 +2197,7 @@ class StatsView(APIView):
                 'created_at': booking.created_at.date().isoformat()
             })
         
-        return Response({
+        return {
             "totalRevenue": float(total_revenue),
             "totalBookings": total_bookings,
             "totalCustomers": total_users,
@@ -1878,7 +2212,92 @@ class StatsView(APIView):
                 "customersTrend": customers_trend,
                 "occupancyTrend": occupancy_trend
             }
+        }
+
+
+class StatsCacheView(APIView):
+    """
+    Bộ đếm hit / miss của cache thống kê dashboard (của process trả lời request)
+    """
+    permission_classes = [CanViewStats]
+
+    def get(self, request):
+        return Response(dashboard.counters())
+
+
+class StatsSeriesView(APIView):
+    """
+    Chuỗi thời gian doanh thu / công suất cho khoảng ngày bất kỳ
+
+    GET /api/stats/series/?from=YYYY-MM-DD&to=YYYY-MM-DD&granularity=day|week|month&metric=revenue,occupancy,adr,revpar
+    - to được tính cả ngày cuối; kỳ đầu / cuối chỉ tính phần nằm trong khoảng
+    - Tính từ DailyStat: một truy vấn gom nhóm theo kỳ + đếm phòng, kết quả được cache như StatsView
+    """
+    permission_classes = [CanViewStats]
+
+    GRANULARITIES = ('day', 'week', 'month')
+    METRICS = ('revenue', 'occupancy', 'adr', 'revpar')
+    MAX_DAYS = 3660  # ~10 năm
+
+    def get(self, request):
+        try:
+            start = datetime.strptime(request.GET.get('from', ''), '%Y-%m-%d').date()
+            end = datetime.strptime(request.GET.get('to', ''), '%Y-%m-%d').date() + timedelta(days=1)
+        except ValueError:
+            return Response({"error": "from và to phải có định dạng YYYY-MM-DD"}, status=status.HTTP_400_BAD_REQUEST)
+        if not 0 < (end - start).days <= self.MAX_DAYS:
+            return Response(
+                {"error": f"Khoảng ngày phải từ 1 đến {self.MAX_DAYS} ngày"}, status=status.HTTP_400_BAD_REQUEST
+            )
+
+        granularity = request.GET.get('granularity', 'day')
+        if granularity not in self.GRANULARITIES:
+            return Response(
+                {"error": f"granularity phải là một trong: {', '.join(self.GRANULARITIES)}"},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        metrics = [metric for metric in request.GET.get('metric', ','.join(self.METRICS)).split(',') if metric]
+        invalid = [metric for metric in metrics if metric not in self.METRICS]
+        if invalid or not metrics:
+            return Response(
+                {"error": f"metric phải thuộc: {', '.join(self.METRICS)}"}, status=status.HTTP_400_BAD_REQUEST
+            )
+
+        fresh = request.GET.get('fresh') == '1' and (request.user.is_superuser or request.user.role == 'admin')
+        series, cached = dashboard.get_snapshot(
+            f'series:{start}:{end}:{granularity}', lambda: self.compute(start, end, granularity), fresh=fresh
+        )
+        response = Response({
+            "from": start.isoformat(),
+            "to": (end - timedelta(days=1)).isoformat(),
+            "granularity": granularity,
+            "series": [
+                {'period': point['period'], **{metric: point[metric] for metric in metrics}} for point in series
+            ],
         })
+        response['X-Cache'] = 'HIT' if cached else 'MISS'
+        return response
+
+    def compute(self, start, end, granularity):
+        """Tính đủ mọi chỉ số cho từng kỳ (lọc chỉ số khi trả về để cache dùng chung)"""
+        total_rooms = Room.objects.count()
+        totals = rollup.period_totals(start, end, granularity)
+        series = []
+        for period, days in rollup.periods(start, end, granularity):
+            data = totals.get(period, {})
+            revenue = float(data.get('revenue', 0))
+            occupied = data.get('occupied_room_nights', 0)
+            available = total_rooms * days
+            series.append({
+                'period': period.isoformat(),
+                'revenue': revenue,
+                # Tỷ lệ lấp đầy (%) = phòng-đêm đã thuê / phòng-đêm có thể bán
+                'occupancy': round(occupied / available * 100, 1) if available else 0.0,
+                # ADR: doanh thu trung bình mỗi phòng-đêm đã thuê; RevPAR: mỗi phòng-đêm có thể bán
+                'adr': round(revenue / occupied, 2) if occupied else 0.0,
+                'revpar': round(revenue / available, 2) if available else 0.0,
+            })
+        return series
 
 # ======================================== VNPay ========================================
 def vnpay_encode(value):
@@ -2004,6 +2423,10 @@ def vnpay_redirect(request):
                         rental.actual_check_out_date = payment.paid_at
                         rental.total_price = payment.amount
                         rental.save(update_fields=['actual_check_out_date', 'total_price'])
+
+                        # Khoản phí hóa đơn (payment tạo trước khi có InvoiceLine chưa được chụp)
+                        if not payment.lines.exists():
+                            payment.snapshot_lines()
                         
                         # Update discount code usage if applicable
                         if payment.discount_code:
@@ -2352,130 +2775,46 @@ class RoomStatusUpdateTaskView(APIView):
                 'message': 'Invalid API key'
             }, status=status.HTTP_401_UNAUTHORIZED)
         
-        from django.utils import timezone
-        
         logger.info("=== Starting room status update task ===")
         now = timezone.now()
-        today = now.date()
-        
-        updated_rooms = []
-        errors = []
-        
+        started = time.perf_counter()
         try:
-            #  PHASE 1: Update rooms for bookings that have reached check-in date
-            # Tìm các booking đã đến ngày check-in nhưng phòng vẫn available
-            pending_bookings = Booking.objects.filter(
-                status__in=[BookingStatus.PENDING, BookingStatus.CONFIRMED],
-                check_in_date__date__lte=today  # Đến ngày check-in hoặc đã quá
-            ).prefetch_related('rooms')
-            
-            logger.info(f"Found {pending_bookings.count()} bookings ready for room status update")
-            
-            #  PROCESS EACH BOOKING - Update room status from available to booked
-            for booking in pending_bookings:
-                logger.info(f"Processing booking {booking.id}, check-in: {booking.check_in_date}")
-                
-                for room in booking.rooms.all():
-                    if room.status == 'available':
-                        try:
-                            old_status = room.status
-                            room.status = 'booked'
-                            room.save()
-                            
-                            updated_rooms.append({
-                                'room_number': room.room_number,
-                                'booking_id': booking.id,
-                                'old_status': old_status,
-                                'new_status': 'booked',
-                                'check_in_date': booking.check_in_date.isoformat()
-                            })
-                            
-                            logger.info(f"Updated room {room.room_number} from {old_status} to booked for booking {booking.id}")
-                            
-                        except Exception as e:
-                            error_msg = f"Failed to update room {room.room_number} for booking {booking.id}: {str(e)}"
-                            errors.append(error_msg)
-                            logger.error(error_msg)
-                    else:
-                        logger.info(f"Room {room.room_number} status is {room.status}, no update needed")
-            
-            #  PHASE 2: Handle NO-SHOW bookings (quá hạn check-in)
-            # Tìm các booking quá hạn check-in và cần giải phóng phòng
-            overdue_bookings = Booking.objects.filter(
-                status__in=[BookingStatus.PENDING, BookingStatus.CONFIRMED],
-                check_in_date__lt=now - timedelta(hours=6)  # Quá 6 tiếng sau thời gian check-in
-            ).prefetch_related('rooms')
-            
-            logger.info(f"Found {overdue_bookings.count()} overdue bookings for no-show processing")
-            
-            for booking in overdue_bookings:
-                logger.info(f"Processing overdue booking {booking.id}, check-in was: {booking.check_in_date}")
-                
-                # Chuyển booking thành NO_SHOW
-                booking.status = BookingStatus.NO_SHOW
-                booking.save()
-                
-                # Giải phóng phòng
-                for room in booking.rooms.all():
-                    if room.status in ['booked', 'available']:
-                        old_status = room.status
-                        room.status = 'available'
-                        room.save()
-                        
-                        updated_rooms.append({
-                            'room_number': room.room_number,
-                            'booking_id': booking.id,
-                            'old_status': old_status,
-                            'new_status': 'available',
-                            'reason': 'no_show',
-                            'check_in_date': booking.check_in_date.isoformat()
-                        })
-                        
-                        logger.info(f"Released room {room.room_number} due to no-show booking {booking.id}")
-                
-                # Tạo thông báo no-show
-                try:
-                    Notification.objects.create(
-                        user=booking.customer,
-                        notification_type='booking_confirmation',
-                        title='Booking đã bị hủy - No Show',
-                        message=f'Booking {booking.id} đã bị hủy do không check-in đúng thời gian.'
-                    )
-                except Exception as e:
-                    logger.error(f"Failed to create no-show notification for booking {booking.id}: {str(e)}")
-            
-            result = {
-                'success': True,
-                'message': f'Room status update completed successfully',
-                'timestamp': now.isoformat(),
-                'summary': {
-                    'total_rooms_updated': len(updated_rooms),
-                    'bookings_processed': pending_bookings.count(),
-                    'no_show_bookings': overdue_bookings.count(),
-                    'errors_count': len(errors)
-                },
-                'updated_rooms': updated_rooms
-            }
-            
-            if errors:
-                result['errors'] = errors
-                result['success'] = False
-                
-            logger.info(f"Room status update task completed: {result['summary']}")
-            
-            return Response(result, status=status.HTTP_200_OK)
-            
+            # Lease: cron gọi chồng nhau / nhiều instance → chỉ một lần chạy xử lý
+            run = tasks.run_room_status_task(now)
         except Exception as e:
-            error_result = {
+            logger.error(f"Room status update task failed: {str(e)}")
+            return Response({
                 'success': False,
                 'message': f'Room status update failed: {str(e)}',
                 'timestamp': now.isoformat(),
-                'updated_rooms': updated_rooms,
-                'errors': errors + [str(e)]
-            }
-            
-            logger.error(f"Room status update task failed: {str(e)}")
-            return Response(error_result, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+                'errors': [str(e)]
+            }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+        if run.status == TaskRunStatus.SKIPPED:
+            logger.info("Room status update task skipped: already running on another instance")
+            return Response({
+                'success': False,
+                'message': 'Room status update is already running on another instance',
+                'timestamp': now.isoformat(),
+            }, status=status.HTTP_409_CONFLICT)
+
+        phases = run.result
+        result = {
+            'success': True,
+            'message': 'Room status update completed successfully',
+            'timestamp': now.isoformat(),
+            'duration_ms': round((time.perf_counter() - started) * 1000, 1),
+            'summary': {
+                'total_rooms_updated': phases['no_show']['rooms_released'] + phases['check_in_due']['rooms_booked'],
+                'bookings_processed': phases['check_in_due']['bookings'],
+                'no_show_bookings': phases['no_show']['bookings'],
+                'errors_count': 0
+            },
+            'phases': phases,
+            'lease_token': run.token,
+        }
+        logger.info(f"Room status update task completed: {result['summary']}")
+        return Response(result, status=status.HTTP_200_OK)
 
 
 class TaskStatusView(APIView):
@@ -2503,11 +2842,12 @@ class TaskStatusView(APIView):
         ).count()
         
         # Thống kê phòng
-        room_stats = {
-            'available': Room.objects.filter(status='available').count(),
-            'booked': Room.objects.filter(status='booked').count(),
-            'occupied': Room.objects.filter(status='occupied').count(),
-            'maintenance': Room.objects.filter(status='maintenance').count(),
+        room_counts = room_stats.counts()
+        room_status = {
+            'available': room_counts['available'],
+            'booked': room_counts['booked'],
+            'occupied': room_counts['occupied'],
+            'maintenance': room_counts['maintenance'],
         }
         
         return Response({
@@ -2518,13 +2858,17 @@ class TaskStatusView(APIView):
                 'overdue_checkins': overdue_checkins,
                 'next_run_needed': upcoming_checkins > 0 or overdue_checkins > 0
             },
-            'room_status': room_stats,
+            'room_status': room_status,
+            # Lần chạy gần nhất của tác vụ định kỳ; stale → scheduler có thể đã ngừng
+            'scheduled_tasks': {
+                tasks.LOCK_NAME: schedule.status(tasks.LOCK_NAME, tasks.STALE_AFTER),
+            },
             'last_check': now.isoformat()
         })
 
 
 class InvoiceViewSet(viewsets.ViewSet, generics.ListAPIView, generics.RetrieveAPIView):
-    queryset = Payment.objects.all()
+    queryset = Payment.objects.select_related('rental__customer', 'discount_code').prefetch_related('lines')
     serializer_class = InvoiceSerializer 
     permission_classes = [IsAuthenticated, IsPaymentOwner | CanManagePayments]
     filter_backends = [DjangoFilterBackend, SearchFilter, OrderingFilter]
@@ -2534,6 +2878,21 @@ class InvoiceViewSet(viewsets.ViewSet, generics.ListAPIView, generics.RetrieveAP
 
     def get_queryset(self):
         user = self.request.user
+        # Khoản phí đã chụp sẵn ở InvoiceLine → danh sách hóa đơn chỉ cần một prefetch
         if user.role in ['admin', 'owner', 'staff']:
-            return Payment.objects.all()
-        return Payment.objects.filter(rental__customer=user)
\ No newline at end of file
+            return self.queryset.all()
+        return self.queryset.filter(rental__customer=user)
+
+    @action(detail=False, methods=['get'])
+    def export(self, request):
+        """
+        Xuất danh sách hóa đơn dạng luồng, cùng bộ lọc / tìm kiếm / sắp xếp với danh sách
+        ?file_format=csv (mặc định) | jsonl
+        """
+        file_format = request.query_params.get('file_format', 'csv')
+        if file_format not in exports.FORMATS:
+            return Response(
+                {"error": f"file_format phải là một trong: {', '.join(exports.FORMATS)}"},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        return exports.stream(self.filter_queryset(self.get_queryset()), exports.payment_row, 'invoices', file_format)
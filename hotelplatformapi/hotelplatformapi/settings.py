@@ -105,6 +105,32 @@ if not os.getenv('DATABASE_URL'):
         }
     }
 
+# Cache dùng chung giữa các worker (phiên bản chỉ mục phòng trống, bảng giá, thống kê...)
+# Có REDIS_URL thì dùng Redis, không thì dùng bảng cache trong DB (python manage.py createcachetable)
+if os.getenv('REDIS_URL'):
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': os.getenv('REDIS_URL'),
+        }
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.db.DatabaseCache',
+            'LOCATION': 'hotelplatform_cache',
+        }
+    }
+
+# Thời gian giữ phòng tạm thời (giây) khi khách mở trang thanh toán
+BOOKING_HOLD_TTL_SECONDS = int(os.getenv('BOOKING_HOLD_TTL_SECONDS', '600'))
+
+# Tác vụ nền (jobs.py): True → chạy ngay khi commit thay vì ghi vào hàng đợi cho worker (manage.py run_worker)
+JOB_QUEUE_EAGER = os.environ.get('JOB_QUEUE_EAGER', 'False').lower() == 'true'
+
+# Thư mục ghi snapshot Parquet / Arrow cho phân tích offline (lệnh export_snapshots)
+ANALYTICS_SNAPSHOT_DIR = os.getenv('ANALYTICS_SNAPSHOT_DIR', str(BASE_DIR / 'snapshots'))
+
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
 AUTH_PASSWORD_VALIDATORS = [